@@ -0,0 +1,200 @@
+"""
+两级视频渲染 - 先同步生成低清预览，成片在后台线程渲染
+
+预览使用 360x640、ultrafast、低帧率的单次ffmpeg编码，几秒内即可查看节奏；
+成片由所选合成器在单线程执行器中依次渲染，渲染状态记录在 videos 表
+（rendition=preview/final，status=rendering/ready/failed），界面轮询该表切换到成片。
+配置了额外画幅（VIDEO_EXTRA_RENDITIONS）时，成片与各画幅在同一次多路输出中生成，分别登记。
+开启 VIDEO_STREAMING 时成片以分片MP4/HLS流式输出，编码过程中 status() 返回已可播放的进度。
+每次渲染输出到独立的任务工作区，登记到存储目录后删除，同名成语的并发任务互不覆盖。
+只为进行中的任务保留 Future 与流式渲染句柄：结束后结果已在 videos 表中，status() 报告结束或提交新任务时释放。
+全局实例由多个会话共享，任务表的检查、提交与释放在同一把锁下进行。
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from config import Config
+from database_manager import db_manager
+from ffmpeg_video_composer import FFmpegVideoComposer
+from workspace_manager import workspace_manager
+
+class BackgroundRenderer:
+    """预览 + 后台成片渲染"""
+    
+    def __init__(self, database=None, max_workers: int = 1, extra_renditions: Optional[List[str]] = None):
+        self.db = database or db_manager
+        self.extra_renditions = Config.VIDEO_EXTRA_RENDITIONS if extra_renditions is None else extra_renditions
+        # 成片渲染本身已多线程编码，默认串行执行，避免多个任务争抢CPU
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="final-render")
+        self._futures: Dict[int, Future] = {}
+        self._streams: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+        self._preview_composer = None
+    
+    @property
+    def preview_composer(self) -> FFmpegVideoComposer:
+        if self._preview_composer is None:
+            self._preview_composer = FFmpegVideoComposer(
+                width=Config.VIDEO_PREVIEW_WIDTH, height=Config.VIDEO_PREVIEW_HEIGHT,
+                fps=Config.VIDEO_PREVIEW_FPS, bitrate=Config.VIDEO_PREVIEW_BITRATE,
+                preset="ultrafast", mode="single", segment_cache=False,
+                output_dir=Config.WORKSPACE_DIR
+            )
+        return self._preview_composer
+    
+    def render_preview(self, story_id: int, images: List, audio, idiom: str,
+                       durations: Optional[List[float]] = None, captions: bool = False) -> Optional[str]:
+        """同步渲染低清预览并登记为 preview 版本，返回存储路径；captions 与成片保持一致"""
+        video_id = self.db.begin_video(story_id, idiom, 'preview')
+        with workspace_manager.create(f"preview_{idiom}") as workspace:
+            video_path = self.preview_composer.create_video(images, audio, idiom, durations,
+                                                            output_path=workspace.file(f"{idiom}_preview.mp4"),
+                                                            captions=captions)
+            if not video_path:
+                self.db.fail_video(video_id, "预览渲染失败")
+                return None
+            return self.db.finish_video(video_id, video_path)
+    
+    def submit_final(self, story_id: int, images: List, audio, idiom: str, composer,
+                     durations: Optional[List[float]] = None) -> Future:
+        """提交成片渲染任务；同一故事已有任务在运行时直接返回该任务"""
+        with self._lock:
+            future = self._futures.get(story_id)
+            if future and not future.done():
+                return future
+            self._prune()
+            
+            video_ids = self._begin_final(story_id, idiom, composer)
+            if Config.VIDEO_STREAMING and getattr(composer, 'streaming_supported', False) and len(video_ids) == 1:
+                future = self._executor.submit(self._render_stream, story_id, video_ids['final'], images, audio,
+                                               idiom, composer, durations)
+            else:
+                future = self._executor.submit(self._render_final, video_ids, images, audio, idiom, composer,
+                                               durations)
+            self._futures[story_id] = future
+            return future
+    
+    def render_final(self, story_id: int, images: List, audio, idiom: str, composer,
+                     durations: Optional[List[float]] = None) -> Optional[str]:
+        """同步渲染成片（及额外画幅），返回成片存储路径"""
+        video_ids = self._begin_final(story_id, idiom, composer)
+        return self._render_final(video_ids, images, audio, idiom, composer, durations)
+    
+    def _begin_final(self, story_id: int, idiom: str, composer) -> Dict[str, int]:
+        """登记成片及额外画幅；合成器不支持多路输出（moviepy）时只登记成片"""
+        names = ['final']
+        if hasattr(composer, 'create_renditions'):
+            names += [name for name in self.extra_renditions if name != 'final']
+        return {name: self.db.begin_video(story_id, idiom, name) for name in names}
+    
+    def _render_final(self, video_ids: Dict[str, int], images: List, audio, idiom: str, composer,
+                      durations: Optional[List[float]] = None) -> Optional[str]:
+        workspace = workspace_manager.create(f"final_{idiom}")
+        try:
+            if len(video_ids) > 1:
+                paths = composer.create_renditions(images, audio, idiom, list(video_ids), durations,
+                                                   output_dir=workspace.path)
+            else:
+                paths = {'final': composer.create_video(images, audio, idiom, durations,
+                                                        output_path=workspace.file(f"{idiom}_story.mp4"))}
+        except Exception as e:
+            paths = {}
+            logger.error(f"成片渲染失败 [{idiom}]: {e}")
+        
+        saved = {}
+        for name, video_id in video_ids.items():
+            try:
+                if not paths.get(name):
+                    raise RuntimeError("视频合成器未返回文件")
+                saved[name] = self.db.finish_video(video_id, paths[name])
+            except Exception as e:
+                logger.error(f"视频渲染失败 [{idiom} {name}]: {e}")
+                self.db.fail_video(video_id, str(e))
+        workspace.close(failed=len(saved) < len(video_ids))
+        return saved.get('final')
+    
+    def _render_stream(self, story_id: int, video_id: int, images: List, audio, idiom: str,
+                       composer, durations: Optional[List[float]] = None) -> Optional[str]:
+        """流式编码成片，结束后登记为 final"""
+        workspace = workspace_manager.create(f"stream_{idiom}")
+        try:
+            stream = composer.start_stream(images, audio, idiom, durations=durations, output_dir=workspace.path)
+            self._streams[story_id] = stream
+            if not stream.wait():
+                raise RuntimeError(stream.error)
+            video_path = stream.to_mp4(workspace.file(f"{idiom}_story.mp4"))
+            video_path = self.db.finish_video(video_id, video_path)
+            workspace.close()
+            return video_path
+        except Exception as e:
+            logger.error(f"流式渲染失败 [{idiom}]: {e}")
+            self.db.fail_video(video_id, str(e))
+            workspace.close(failed=True)
+            return None
+        finally:
+            self._streams.pop(story_id, None)
+    
+    def render(self, story_id: int, images: List, audio, idiom: str, composer,
+               durations: Optional[List[float]] = None) -> Dict[str, Any]:
+        """先出预览，再提交成片；关闭预览时直接同步渲染成片"""
+        if not Config.VIDEO_PREVIEW:
+            self.render_final(story_id, images, audio, idiom, composer, durations)
+            return self.status(story_id)
+        
+        self.render_preview(story_id, images, audio, idiom, durations, getattr(composer, 'captions', False))
+        self.submit_final(story_id, images, audio, idiom, composer, durations)
+        return self.status(story_id)
+    
+    def status(self, story_id: int) -> Dict[str, Any]:
+        """当前可播放的视频及成片状态"""
+        renditions = self.db.get_video_renditions(story_id)
+        final = renditions.get('final')
+        preview = renditions.get('preview')
+        
+        if final and final['status'] == 'ready':
+            current = final
+        elif preview and preview['status'] == 'ready':
+            current = preview
+        else:
+            current = None
+        
+        stream = self._streams.get(story_id)
+        future = self._futures.get(story_id)
+        if future and future.done() and not (final and final['status'] == 'rendering'):
+            # 已报告结束的任务不再保留
+            with self._lock:
+                self._forget(story_id, future)
+        
+        return {
+            'video_path': current['path'] if current else None,
+            'rendition': current['rendition'] if current else None,
+            'final_status': final['status'] if final else None,
+            'error': final['error'] if final else None,
+            'renditions': renditions,
+            'stream': stream.poll() if stream else None
+        }
+    
+    def wait(self, story_id: int, timeout: Optional[float] = None) -> Optional[str]:
+        """等待成片渲染结束（测试与命令行使用）；任务已结束并释放时返回已登记的成片"""
+        future = self._futures.get(story_id)
+        if future:
+            return future.result(timeout)
+        final = self.db.get_video_renditions(story_id).get('final')
+        return final['path'] if final and final['status'] == 'ready' else None
+    
+    def _forget(self, story_id: int, future: Future):
+        # 调用方持有 self._lock；只移除该任务本身，同一故事随后提交的新任务保留
+        if self._futures.get(story_id) is future:
+            self._futures.pop(story_id, None)
+    
+    def _prune(self):
+        """释放所有已结束的任务（从未轮询过状态的故事也不会一直占用），调用方持有 self._lock"""
+        for story_id, future in list(self._futures.items()):
+            if future.done():
+                self._forget(story_id, future)
+
+# 创建全局实例
+background_renderer = BackgroundRenderer()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+批量处理引擎 - 无界面运行 故事→场景→插画→音频→视频 流水线
+
+用法:
+    python batch_processor.py idioms.txt --workers 2
+    python batch_processor.py idioms.csv --manifest output/run1.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from loguru import logger
+
+from config import config
+from utils import Logger, StageFingerprint, cache_manager
+from pipeline_scheduler import Stage, StagedScheduler
+from database_manager import db_manager
+from fixed_audio_generator import fixed_audio_generator
+from ffmpeg_video_composer import get_video_composer
+from background_renderer import background_renderer
+
+class IdiomPipeline:
+    """单个成语的无界面处理流水线
+    
+    每个阶段接收并返回同一个 job 字典，阶段之间只通过 job 传递数据，
+    因此既可以顺序执行（process），也可以交给调度器分阶段执行。
+    """
+    
+    STAGES = ("story", "scenes", "images", "audio", "video")
+    
+    def __init__(self, max_scenes: int = 5, video_backend: Optional[str] = None,
+                 transition: Optional[str] = None):
+        self.max_scenes = max_scenes
+        self.video_backend = video_backend or config.VIDEO_BACKEND
+        self.transition = transition or config.VIDEO_TRANSITION
+        self.story_generator = None
+        self.scene_extractor = None
+        self.image_generator = None
+        self._init_lock = threading.Lock()
+        self._image_lock = threading.Lock()  # 扩散模型同一时间只运行一个推理
+    
+    def _get_story_generator(self):
+        with self._init_lock:
+            if self.story_generator is None:
+                # 各工作线程共享同一个连接池、并发上限和限速器
+                from deepseek_client import deepseek_client
+                self.story_generator = deepseek_client
+        return self.story_generator
+    
+    def _get_scene_extractor(self):
+        with self._init_lock:
+            if self.scene_extractor is None:
+                from modules.scene_extractor import SceneExtractor
+                self.scene_extractor = SceneExtractor()
+        return self.scene_extractor
+    
+    def _get_image_generator(self):
+        with self._init_lock:
+            if self.image_generator is None and config.IMAGE_WORKER:
+                # 与 Web 界面共用工作进程中的热模型
+                from image_worker import image_worker_client
+                self.image_generator = image_worker_client
+            elif self.image_generator is None:
+                from image_generator import ImageGenerator
+                logger.info("正在初始化图像生成器...")
+                self.image_generator = ImageGenerator()
+        return self.image_generator
+    
+    def run_story(self, job: Dict) -> Dict:
+        """阶段1：生成故事文本"""
+        idiom = job['idiom']
+        cache_key = cache_manager.get_cache_key(idiom, prefix=f"story/{idiom}")
+        story = cache_manager.get_cached_result(cache_key)
+        
+        if story is None:
+            story = self._get_story_generator().generate_story(idiom)
+            cache_manager.save_cache(cache_key, story)
+        
+        job['story'] = story
+        return job
+    
+    def run_scenes(self, job: Dict) -> Dict:
+        """阶段2：提取场景并保存故事"""
+        scenes = self._get_scene_extractor().extract_scenes(job['story'], max_scenes=self.max_scenes)
+        job['scenes'] = scenes
+        job['story_id'] = db_manager.save_story(job['idiom'], job['story'], scenes)
+        return job
+    
+    def run_images(self, job: Dict) -> Dict:
+        """阶段3：生成插画（逐场景缓存）"""
+        idiom = job['idiom']
+        image_generator = self._get_image_generator()
+        image_params = StageFingerprint.image_params(image_generator)
+        
+        scenes = job['scenes']
+        images = []
+        pending = []
+        for i, scene in enumerate(scenes):
+            cache_key = cache_manager.get_cache_key(
+                StageFingerprint.compute("image", scene=scene, **image_params),
+                prefix=f"images/{idiom}"
+            )
+            images.append(cache_manager.get_cached_result(cache_key))
+            if images[i] is None:
+                pending.append((i, cache_key))
+        
+        def on_image(index, image):
+            i, cache_key = pending[index]
+            if image is None:
+                raise RuntimeError(f"第 {i+1} 张插画生成失败")
+            images[i] = image
+            cache_manager.save_cache(cache_key, image)
+            logger.info(f"[{idiom}] 插画 {i+1}/{len(scenes)} 完成")
+        
+        if pending:
+            # 未命中缓存的场景按批生成，多个成语之间仍串行使用模型
+            with self._image_lock:
+                image_generator.generate_story_images([scenes[i] for i, _ in pending], progress_callback=on_image)
+        logger.info(f"[{idiom}] 插画完成（缓存 {len(scenes) - len(pending)}/{len(scenes)}）")
+        
+        job['images'] = images
+        db_manager.save_images(job['story_id'], images, idiom)
+        return job
+    
+    def run_audio(self, job: Dict) -> Dict:
+        """阶段4：生成旁白音轨（内存PCM，直接交给视频阶段）"""
+        idiom = job['idiom']
+        cache_key = cache_manager.get_cache_key(
+            StageFingerprint.compute("narration", text=job['story'], **StageFingerprint.tts_params(fixed_audio_generator)),
+            prefix=f"audio/{idiom}"
+        )
+        track = cache_manager.get_cached_result(cache_key)
+        
+        if track is None:
+            track = fixed_audio_generator.synthesize_track(job['story'], idiom)
+            if track is None:
+                raise RuntimeError("音频生成失败")
+            cache_manager.save_cache(cache_key, track)
+        
+        job['audio'] = track
+        if config.ARCHIVE_AUDIO:
+            job['audio_path'] = db_manager.save_audio(job['story_id'], track, idiom)
+        return job
+    
+    def run_video(self, job: Dict) -> Dict:
+        """阶段5：合成视频"""
+        # 音轨只供本阶段使用，取出后不再随 job 传递
+        # 配置了额外画幅时与成片在同一次多路输出中生成并分别登记
+        # 场景按旁白的句子边界切换（由音轨的段落时间表直接得到）
+        video_composer = get_video_composer(self.video_backend, self.transition)
+        track = job.pop('audio')
+        # 场景文本与图片成对筛选，缺图的场景不参与分配时长
+        pairs = [(scene, image) for scene, image in zip(job['scenes'], job['images']) if image is not None]
+        images = [image for _, image in pairs]
+        durations = track.scene_durations(len(images), [scene for scene, _ in pairs])
+        video_path = background_renderer.render_final(job['story_id'], images, track,
+                                                      job['idiom'], video_composer, durations)
+        if not video_path:
+            raise RuntimeError("视频生成失败")
+        
+        job['video_path'] = video_path
+        return job
+    
+    def stage(self, name: str) -> Callable[[Dict], Dict]:
+        """按名称获取阶段函数"""
+        return getattr(self, f"run_{name}")
+    
+    def __getstate__(self):
+        # 进程池阶段需要pickle流水线：锁和已加载的模型不随之复制
+        state = self.__dict__.copy()
+        state.update(story_generator=None, scene_extractor=None, image_generator=None,
+                     _init_lock=None, _image_lock=None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_lock = threading.Lock()
+        self._image_lock = threading.Lock()
+    
+    def process(self, idiom: str) -> Dict:
+        """顺序执行全部阶段，返回清单记录"""
+        job = {'idiom': idiom, 'started_at': time.time()}
+        for name in self.STAGES:
+            try:
+                job = self.stage(name)(job)
+            except Exception as e:
+                logger.error(f"[{idiom}] 阶段 {name} 失败: {e}")
+                job['error'] = str(e)
+                job['failed_stage'] = name
+                break
+        return self.to_record(job)
+    
+    @staticmethod
+    def to_record(job: Dict) -> Dict:
+        """把 job 转换为可写入清单的记录（不含图片等大对象）"""
+        return {
+            'idiom': job['idiom'],
+            'status': 'error' if job.get('error') else 'success',
+            'story_id': job.get('story_id'),
+            'scenes_count': len(job.get('scenes') or []),
+            'images_count': len(job.get('images') or []),
+            'audio_path': job.get('audio_path'),
+            'video_path': job.get('video_path'),
+            'failed_stage': job.get('failed_stage'),
+            'error': job.get('error'),
+            'elapsed': round(time.time() - job.get('started_at', time.time()), 2),
+            'finished_at': datetime.now().isoformat(timespec='seconds')
+        }
+
+class BatchProcessor:
+    """批量处理器 - 限制并发数、流式写入清单、支持断点续跑"""
+    
+    def __init__(self, pipeline: Optional[IdiomPipeline] = None, max_in_flight: int = None,
+                 overlap: Optional[bool] = None):
+        self.pipeline = pipeline or IdiomPipeline()
+        self.max_in_flight = max_in_flight or config.BATCH_MAX_IN_FLIGHT
+        self.overlap = config.PIPELINE_OVERLAP if overlap is None else overlap
+    
+    def build_stages(self) -> List[Stage]:
+        """流水线阶段：网络阶段用线程池，扩散模型由单线程独占，视频编码用进程池"""
+        network_workers = config.PIPELINE_NETWORK_WORKERS
+        queue_size = config.PIPELINE_QUEUE_SIZE
+        return [
+            Stage("story", self.pipeline.stage("story"), workers=network_workers, queue_size=queue_size),
+            Stage("scenes", self.pipeline.stage("scenes"), workers=1, queue_size=queue_size),
+            Stage("images", self.pipeline.stage("images"), workers=1, queue_size=queue_size),
+            Stage("audio", self.pipeline.stage("audio"), workers=network_workers, queue_size=queue_size),
+            Stage("video", self.pipeline.stage("video"), workers=config.PIPELINE_ENCODE_WORKERS,
+                  kind="process", queue_size=queue_size)
+        ]
+    
+    @staticmethod
+    def load_manifest(manifest_path: Path) -> Dict[str, Dict]:
+        """读取清单，同一成语以最后一条记录为准"""
+        records = {}
+        manifest_path = Path(manifest_path)
+        if not manifest_path.exists():
+            return records
+        
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下半行，忽略即可
+                    continue
+                records[record['idiom']] = record
+        return records
+    
+    def run(self, idioms: Iterable[str], manifest_path: Path = None, resume: bool = True,
+            on_result: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """处理成语序列，每完成一个就追加一行到清单"""
+        manifest_path = Path(manifest_path or config.BATCH_MANIFEST)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        finished = set()
+        if resume:
+            finished = {idiom for idiom, record in self.load_manifest(manifest_path).items()
+                        if record['status'] == 'success'}
+            if finished:
+                logger.info(f"从清单恢复，跳过已完成的 {len(finished)} 个成语")
+        
+        # 上次崩溃可能留下不完整的最后一行，先补上换行，避免新记录与其粘连
+        if manifest_path.exists() and manifest_path.stat().st_size > 0:
+            with open(manifest_path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        
+        summary = {'success': 0, 'error': 0, 'skipped': 0}
+        start_time = time.time()
+        
+        def pending() -> Iterator[str]:
+            seen = set()
+            for idiom in idioms:
+                idiom = idiom.strip()
+                if not idiom or idiom in seen:
+                    continue
+                seen.add(idiom)
+                if idiom in finished:
+                    summary['skipped'] += 1
+                    continue
+                yield idiom
+        
+        with open(manifest_path, 'a', encoding='utf-8') as manifest:
+            
+            def write(record: Dict):
+                manifest.write(json.dumps(record, ensure_ascii=False) + '\n')
+                manifest.flush()
+                os.fsync(manifest.fileno())
+                summary[record['status']] += 1
+                logger.info(f"[{record['idiom']}] {record['status']} ({record['elapsed']}秒)")
+                if on_result:
+                    on_result(record)
+            
+            if self.overlap:
+                jobs = ({'idiom': idiom, 'started_at': time.time()} for idiom in pending())
+                summary['pipeline'] = StagedScheduler(self.build_stages()).run(
+                    jobs, on_result=lambda job: write(self.pipeline.to_record(job))
+                )
+            else:
+                self._run_concurrent(pending(), write)
+        
+        summary['elapsed'] = round(time.time() - start_time, 2)
+        summary['manifest'] = str(manifest_path)
+        logger.info(f"批量处理完成: {summary}")
+        return summary
+    
+    def _run_concurrent(self, idioms: Iterable[str], write: Callable[[Dict], None]):
+        """每个成语顺序执行全部阶段，最多保持 max_in_flight 个成语在处理中"""
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="batch") as executor:
+            in_flight = set()
+            for idiom in idioms:
+                if len(in_flight) >= self.max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        write(future.result())
+                in_flight.add(executor.submit(self.pipeline.process, idiom))
+            
+            for future in wait(in_flight).done:
+                write(future.result())
+
+def read_idioms(path: Path) -> Iterator[str]:
+    """按行读取成语文件，csv 取第一列"""
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        if path.suffix.lower() == '.csv':
+            for row in csv.reader(f):
+                if row and row[0].strip() and row[0].strip().lower() not in ('idiom', '成语'):
+                    yield row[0].strip()
+        else:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="成语故事短视频批量生成")
+    parser.add_argument("input", help="成语文件（.txt 每行一个，或 .csv 第一列）")
+    parser.add_argument("--manifest", default=str(config.BATCH_MANIFEST), help="结果清单路径（JSONL）")
+    parser.add_argument("--workers", type=int, default=config.BATCH_MAX_IN_FLIGHT,
+                        help="同时处理的成语数（仅 --sequential-stages 模式）")
+    parser.add_argument("--max-scenes", type=int, default=5, help="每个故事的场景数")
+    parser.add_argument("--no-resume", action="store_true", help="忽略清单中已完成的记录，全部重跑")
+    parser.add_argument("--sequential-stages", action="store_true",
+                        help="每个成语顺序执行各阶段（默认各阶段流水线并行）")
+    parser.add_argument("--video-backend", choices=["ffmpeg", "moviepy"], default=config.VIDEO_BACKEND,
+                        help="视频合成后端")
+    parser.add_argument("--transition", choices=["none", "fade", "slide", "zoom"], default=config.VIDEO_TRANSITION,
+                        help="转场效果（仅ffmpeg后端）")
+    args = parser.parse_args()
+    
+    Logger.setup_logger(config.LOG_FILE, config.LOG_LEVEL)
+    
+    pipeline = IdiomPipeline(max_scenes=args.max_scenes, video_backend=args.video_backend, transition=args.transition)
+    processor = BatchProcessor(pipeline, max_in_flight=args.workers,
+                               overlap=False if args.sequential_stages else None)
+    summary = processor.run(read_idioms(args.input), args.manifest, resume=not args.no_resume)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+字幕渲染器 - 按旁白句子时间烧录中文字幕
+
+字形只光栅化一次并存入全进程共享的字形图集，整行字幕由字形拼接后放入 LRU 缓存，
+跨故事复用；字幕叠加层预先转换为预乘颜色与反向透明度，合成时只处理字幕所在区域。
+静帧时间线按 场景×字幕 的变化点切分，每种组合只合成一次，不逐帧绘制文字。
+"""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from config import Config
+
+# 常见中文字体位置（Windows / macOS / Linux）
+FONT_CANDIDATES = [
+    "C:/Windows/Fonts/msyh.ttc",
+    "C:/Windows/Fonts/simhei.ttf",
+    "/System/Library/Fonts/PingFang.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+]
+
+# 不能出现在行首的标点
+NO_LINE_START = set("，。！？；：、”’）》」』")
+
+Cue = Tuple[float, float, str]
+
+def caption_cues(audio) -> List[Cue]:
+    """由音轨的段落时间表生成字幕 [(开始秒, 结束秒, 文本)]，去掉句末的句号和逗号"""
+    cues = []
+    for item in audio.timing_manifest():
+        text = item['text'].strip().rstrip("。，")
+        if text:
+            cues.append((item['start_seconds'], item['end_seconds'], text))
+    return cues
+
+def find_font() -> Optional[str]:
+    if Config.CAPTION_FONT:
+        return Config.CAPTION_FONT
+    for path in FONT_CANDIDATES:
+        if Path(path).exists():
+            return path
+    return None
+
+class GlyphAtlas:
+    """字形图集：每个 (字体, 字号, 描边, 字符) 只光栅化一次"""
+    
+    def __init__(self):
+        self._fonts = {}
+        self._glyphs = {}
+        self._lock = threading.Lock()
+        self.stats = {'glyphs': 0, 'hits': 0}
+    
+    def font(self, font_path: Optional[str], size: int):
+        key = (font_path, size)
+        if key not in self._fonts:
+            from PIL import ImageFont
+            if font_path:
+                self._fonts[key] = ImageFont.truetype(font_path, size)
+            else:
+                logger.warning("未找到中文字体，使用PIL默认字体（请设置 CAPTION_FONT）")
+                self._fonts[key] = ImageFont.load_default(size)
+        return self._fonts[key]
+    
+    def glyph(self, font_path: Optional[str], size: int, stroke: int, char: str):
+        """返回 (填充蒙版, 描边蒙版, 左偏移, 上偏移, 步进宽度)"""
+        key = (font_path, size, stroke, char)
+        with self._lock:
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self.stats['hits'] += 1
+                return glyph
+            glyph = self._rasterize(self.font(font_path, size), stroke, char)
+            self._glyphs[key] = glyph
+            self.stats['glyphs'] += 1
+            return glyph
+    
+    @staticmethod
+    def _rasterize(font, stroke: int, char: str):
+        from PIL import Image, ImageDraw
+        
+        advance = font.getlength(char)
+        left, top, right, bottom = font.getbbox(char, stroke_width=stroke)
+        if right <= left or bottom <= top:
+            empty = np.zeros((0, 0), dtype=np.uint8)
+            return empty, empty, 0, 0, advance
+        
+        size = (right - left, bottom - top)
+        fill = Image.new("L", size, 0)
+        ImageDraw.Draw(fill).text((-left, -top), char, font=font, fill=255)
+        outline = Image.new("L", size, 0)
+        ImageDraw.Draw(outline).text((-left, -top), char, font=font, fill=255,
+                                     stroke_width=stroke, stroke_fill=255)
+        return np.asarray(fill), np.asarray(outline), left, top, advance
+
+class CaptionOverlay:
+    """字幕叠加层：区域位置、预乘颜色和反向透明度（uint16，合成时 (bg*inv>>8)+pre）"""
+    
+    def __init__(self, x: int, y: int, premultiplied: np.ndarray, inverse_alpha: np.ndarray):
+        self.x = x
+        self.y = y
+        self.premultiplied = premultiplied
+        self.inverse_alpha = inverse_alpha
+        self.height, self.width = inverse_alpha.shape[:2]
+
+# 全进程共享：字形图集与整行字幕缓存
+glyph_atlas = GlyphAtlas()
+_line_cache: "OrderedDict[tuple, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+_line_cache_lock = threading.Lock()
+line_cache_stats = {'hits': 0, 'misses': 0}
+
+class CaptionRenderer:
+    """字幕渲染器，字号、边距按画面宽度自适应"""
+    
+    def __init__(self, width: int, height: int, font_path: Optional[str] = None, font_size: int = None,
+                 color: Tuple[int, int, int] = (255, 255, 255), stroke_color: Tuple[int, int, int] = (0, 0, 0),
+                 bottom_margin: float = 0.1):
+        self.width = width
+        self.height = height
+        self.font_path = font_path or find_font()
+        self.font_size = font_size or Config.CAPTION_FONT_SIZE or max(12, width // 18)
+        self.stroke = max(1, self.font_size // 14)
+        self.color = np.array(color, dtype=np.uint16)
+        self.stroke_color = np.array(stroke_color, dtype=np.uint16)
+        self.bottom_margin = bottom_margin
+        self.max_line_width = int(width * 0.88)
+        self._overlays: Dict[str, CaptionOverlay] = {}
+    
+    def overlay(self, text: str) -> CaptionOverlay:
+        """整条字幕的叠加层（同一渲染器内按文本缓存）"""
+        overlay = self._overlays.get(text)
+        if overlay is None:
+            overlay = self._build_overlay(text)
+            self._overlays[text] = overlay
+        return overlay
+    
+    def composite(self, frame: np.ndarray, overlay: CaptionOverlay, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """把字幕叠加到画面上（out 为 None 时返回新数组），只计算字幕区域"""
+        if out is None:
+            out = frame.copy()
+        elif out is not frame:
+            np.copyto(out, frame)
+        
+        y0, x0 = overlay.y, overlay.x
+        region = frame[y0:y0 + overlay.height, x0:x0 + overlay.width]
+        blended = region * overlay.inverse_alpha
+        blended >>= 8
+        blended += overlay.premultiplied
+        np.minimum(blended, 255, out=blended)
+        out[y0:y0 + overlay.height, x0:x0 + overlay.width] = blended
+        return out
+    
+    def apply(self, frames: List, durations: Sequence[float], cues: Sequence[Cue]) -> Tuple[List, List[float]]:
+        """静帧时间线叠加字幕：按场景与字幕的变化点切分，每种 (场景, 字幕) 组合只合成一次
+        
+        frames 为已适配输出尺寸的PIL图片，返回新的 (画面列表, 时长列表)，总时长不变。
+        """
+        from PIL import Image
+        
+        timeline = self.timeline(durations, cues)
+        composed = {}
+        out_frames, out_durations = [], []
+        for scene_index, cue_index, duration in timeline:
+            key = (scene_index, cue_index)
+            if key not in composed:
+                if cue_index is None:
+                    composed[key] = frames[scene_index]
+                else:
+                    frame = np.asarray(frames[scene_index].convert("RGB"))
+                    composed[key] = Image.fromarray(self.composite(frame, self.overlay(cues[cue_index][2])))
+            out_frames.append(composed[key])
+            out_durations.append(duration)
+        
+        logger.info(f"字幕叠加: {len(cues)} 条字幕，{len(timeline)} 个片段，合成 {len(composed)} 张画面")
+        return out_frames, out_durations
+    
+    @staticmethod
+    def timeline(durations: Sequence[float], cues: Sequence[Cue]) -> List[Tuple[int, Optional[int], float]]:
+        """合并场景边界与字幕边界，返回 [(场景序号, 字幕序号或None, 时长)]，相邻相同组合合并"""
+        scene_ends = np.cumsum(durations)
+        total = float(scene_ends[-1])
+        points = {0.0, total}
+        points.update(round(float(end), 6) for end in scene_ends)
+        for start, end, _ in cues:
+            points.update(round(min(max(value, 0.0), total), 6) for value in (start, end))
+        points = sorted(points)
+        
+        timeline = []
+        for start, end in zip(points, points[1:]):
+            if end - start < 1e-6:
+                continue
+            middle = (start + end) / 2
+            scene_index = min(int(np.searchsorted(scene_ends, middle, side='right')), len(durations) - 1)
+            cue_index = next((i for i, (cue_start, cue_end, _) in enumerate(cues) if cue_start <= middle < cue_end), None)
+            if timeline and timeline[-1][:2] == (scene_index, cue_index):
+                timeline[-1] = (scene_index, cue_index, timeline[-1][2] + end - start)
+            else:
+                timeline.append((scene_index, cue_index, end - start))
+        return timeline
+    
+    @staticmethod
+    def cue_index_at(cues: Sequence[Cue], seconds: float) -> Optional[int]:
+        return next((i for i, (start, end, _) in enumerate(cues) if start <= seconds < end), None)
+    
+    def _font_key(self) -> tuple:
+        return (self.font_path, self.font_size, self.stroke)
+    
+    def _build_overlay(self, text: str) -> CaptionOverlay:
+        lines = [self._line_masks(line) for line in self._wrap(text)]
+        line_height = max(fill.shape[0] for fill, _ in lines)
+        spacing = self.font_size // 4
+        width = max(fill.shape[1] for fill, _ in lines)
+        height = line_height * len(lines) + spacing * (len(lines) - 1)
+        
+        fill = np.zeros((height, width), dtype=np.uint16)
+        outline = np.zeros((height, width), dtype=np.uint16)
+        for index, (line_fill, line_outline) in enumerate(lines):
+            top = index * (line_height + spacing)
+            left = (width - line_fill.shape[1]) // 2
+            fill[top:top + line_fill.shape[0], left:left + line_fill.shape[1]] = line_fill
+            outline[top:top + line_outline.shape[0], left:left + line_outline.shape[1]] = line_outline
+        
+        # 描边在下、文字在上：alpha = max(描边, 文字)，颜色按文字覆盖比例混合
+        alpha = np.maximum(fill, outline)
+        premultiplied = (fill[..., None] * self.color + (alpha - fill)[..., None] * self.stroke_color) // 255
+        alpha = alpha + (alpha >> 7)  # 0..255 映射到 0..256，便于右移8位
+        inverse_alpha = np.repeat((256 - alpha)[..., None], 3, axis=2).astype(np.uint16)
+        
+        x = max(0, (self.width - width) // 2)
+        y = max(0, self.height - int(self.height * self.bottom_margin) - height)
+        return CaptionOverlay(x, y, premultiplied.astype(np.uint16), inverse_alpha)
+    
+    def _line_masks(self, line: str) -> Tuple[np.ndarray, np.ndarray]:
+        """整行字幕蒙版（全进程 LRU 缓存，跨故事复用）"""
+        key = self._font_key() + (line,)
+        with _line_cache_lock:
+            masks = _line_cache.get(key)
+            if masks is not None:
+                _line_cache.move_to_end(key)
+                line_cache_stats['hits'] += 1
+                return masks
+            line_cache_stats['misses'] += 1
+        
+        font = glyph_atlas.font(self.font_path, self.font_size)
+        ascent, descent = font.getmetrics()
+        pad = self.stroke
+        glyphs = [glyph_atlas.glyph(self.font_path, self.font_size, self.stroke, char) for char in line]
+        width = int(round(sum(glyph[4] for glyph in glyphs))) + 2 * pad + 1
+        height = ascent + descent + 2 * pad
+        
+        fill = np.zeros((height, width), dtype=np.uint8)
+        outline = np.zeros((height, width), dtype=np.uint8)
+        x = float(pad)
+        for glyph_fill, glyph_outline, left, top, advance in glyphs:
+            if glyph_fill.size:
+                gx, gy = int(round(x)) + left, pad + top
+                h = min(glyph_fill.shape[0], height - gy)
+                w = min(glyph_fill.shape[1], width - gx)
+                if gx >= 0 and gy >= 0 and h > 0 and w > 0:
+                    np.maximum(fill[gy:gy + h, gx:gx + w], glyph_fill[:h, :w], out=fill[gy:gy + h, gx:gx + w])
+                    np.maximum(outline[gy:gy + h, gx:gx + w], glyph_outline[:h, :w], out=outline[gy:gy + h, gx:gx + w])
+            x += advance
+        
+        masks = (fill, outline)
+        with _line_cache_lock:
+            _line_cache[key] = masks
+            while len(_line_cache) > Config.CAPTION_CACHE_LINES:
+                _line_cache.popitem(last=False)
+        return masks
+    
+    def _wrap(self, text: str) -> List[str]:
+        """按宽度逐字折行，标点不放在行首"""
+        lines, current, current_width = [], "", 0.0
+        for char in text:
+            advance = glyph_atlas.glyph(self.font_path, self.font_size, self.stroke, char)[4]
+            if current and current_width + advance > self.max_line_width and char not in NO_LINE_START:
+                lines.append(current)
+                current, current_width = "", 0.0
+            current += char
+            current_width += advance
+        if current:
+            lines.append(current)
+        return lines
@@ -15,10 +15,24 @@ class Config:
     # API配置
     DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', 'sk-0fbcaf78abf7432294d0883b25b544f6')
     DEEPSEEK_BASE_URL = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com/v1')
+    DEEPSEEK_MODEL = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+    DEEPSEEK_MAX_CONCURRENCY = int(os.getenv('DEEPSEEK_MAX_CONCURRENCY', 8))  # 同时进行的请求数
+    DEEPSEEK_RATE_LIMIT = float(os.getenv('DEEPSEEK_RATE_LIMIT', 5.0))  # 每秒请求数，0 表示不限速
+    DEEPSEEK_TIMEOUT = float(os.getenv('DEEPSEEK_TIMEOUT', 60))  # 秒
+    DEEPSEEK_MAX_RETRIES = int(os.getenv('DEEPSEEK_MAX_RETRIES', 5))
     
     # 模型配置
     SD_MODEL_PATH = os.getenv('SD_MODEL_PATH', 'runwayml/stable-diffusion-v1-5')
     SD_CACHE_DIR = os.getenv('SD_CACHE_DIR', './models')
+    SD_MODEL_REVISION = os.getenv('SD_MODEL_REVISION', 'main')
+    SD_SCHEDULER = os.getenv('SD_SCHEDULER', 'default')
+    SD_BACKEND = os.getenv('SD_BACKEND', 'pytorch').lower()  # pytorch / onnx / openvino（后两者为CPU推理）
+    SD_INT8 = os.getenv('SD_INT8', 'false').lower() == 'true'  # onnx/openvino 使用 int8 权重量化
+    SD_EXPORT_DIR = Path(SD_CACHE_DIR) / 'exported'  # 导出的 ONNX/OpenVINO 模型
+    CPU_INFERENCE_THREADS = int(os.getenv('CPU_INFERENCE_THREADS', 0))  # 0 表示物理核数
+    PROMPT_EMBED_CACHE_SIZE = int(os.getenv('PROMPT_EMBED_CACHE_SIZE', 256))  # 提示词嵌入 LRU 条数
+    PROMPT_EMBED_PERSIST = os.getenv('PROMPT_EMBED_PERSIST', 'false').lower() == 'true'  # 嵌入以 safetensors 存盘
+    PROMPT_EMBED_DIR = Path(SD_CACHE_DIR) / 'prompt_embeds'
     
     # 路径配置
     BASE_DIR = Path(__file__).parent
@@ -28,16 +42,46 @@ class Config:
     TEMP_DIR = BASE_DIR / os.getenv('TEMP_DIR', 'temp')
     CACHE_DIR = BASE_DIR / os.getenv('CACHE_DIR', 'cache')
     LOG_DIR = BASE_DIR / os.getenv('LOG_DIR', 'logs')
+    WORKSPACE_DIR = TEMP_DIR / 'jobs'  # 每个任务独立的临时工作区
+    WORKSPACE_MAX_AGE_HOURS = float(os.getenv('WORKSPACE_MAX_AGE_HOURS', 24))  # 超时的遗留工作区被回收
+    WORKSPACE_GC_INTERVAL = float(os.getenv('WORKSPACE_GC_INTERVAL', 600))  # 创建工作区时最多每隔N秒回收一次
+    WORKSPACE_KEEP_FAILED = os.getenv('WORKSPACE_KEEP_FAILED', 'false').lower() == 'true'  # 保留失败任务现场便于排查
     
     # 视频配置
     VIDEO_WIDTH = int(os.getenv('VIDEO_WIDTH', 1080))
     VIDEO_HEIGHT = int(os.getenv('VIDEO_HEIGHT', 1920))
     VIDEO_FPS = int(os.getenv('VIDEO_FPS', 24))
     VIDEO_BITRATE = os.getenv('VIDEO_BITRATE', '5000k')
+    VIDEO_BACKEND = os.getenv('VIDEO_BACKEND', 'ffmpeg')  # ffmpeg 或 moviepy
+    VIDEO_PRESET = os.getenv('VIDEO_PRESET', 'veryfast')  # x264 preset
+    FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', '')  # 为空时自动查找
+    VIDEO_ENCODE_MODE = os.getenv('VIDEO_ENCODE_MODE', 'chunked')  # chunked（分片并行编码，可增量复用）或 single
+    VIDEO_ENCODE_WORKERS = int(os.getenv('VIDEO_ENCODE_WORKERS', 0))  # 分片编码并行数，0 表示CPU核数
+    VIDEO_CHUNK_SECONDS = float(os.getenv('VIDEO_CHUNK_SECONDS', 0))  # 分片最长秒数，0 表示按场景分片
+    VIDEO_TRANSITION = os.getenv('VIDEO_TRANSITION', 'none')  # none/fade/slide/zoom
+    VIDEO_TRANSITION_SECONDS = float(os.getenv('VIDEO_TRANSITION_SECONDS', 0.5))
+    VIDEO_SEGMENT_CACHE = os.getenv('VIDEO_SEGMENT_CACHE', 'true').lower() == 'true'  # 缓存已编码片段
+    VIDEO_SEGMENT_CACHE_BYTES = int(os.getenv('VIDEO_SEGMENT_CACHE_BYTES', 1024 ** 3))  # 默认1GB
+    VIDEO_EXTRA_RENDITIONS = [name.strip() for name in os.getenv('VIDEO_EXTRA_RENDITIONS', '').split(',') if name.strip()]  # 如 16x9,1x1
+    VIDEO_CAPTIONS = os.getenv('VIDEO_CAPTIONS', 'false').lower() == 'true'  # 按旁白句子烧录字幕
+    CAPTION_FONT = os.getenv('CAPTION_FONT', '')  # 字体文件路径，为空时自动查找常见中文字体
+    CAPTION_FONT_SIZE = int(os.getenv('CAPTION_FONT_SIZE', 0))  # 0 表示按画面宽度自动计算
+    CAPTION_CACHE_LINES = int(os.getenv('CAPTION_CACHE_LINES', 512))  # 跨故事缓存的字幕行数
+    VIDEO_STREAMING = os.getenv('VIDEO_STREAMING', 'false').lower() == 'true'  # 成片以流式方式边编码边播放
+    VIDEO_STREAM_FORMAT = os.getenv('VIDEO_STREAM_FORMAT', 'fmp4')  # fmp4 或 hls
+    VIDEO_STREAM_SEGMENT_SECONDS = float(os.getenv('VIDEO_STREAM_SEGMENT_SECONDS', 2))
+    VIDEO_PREVIEW = os.getenv('VIDEO_PREVIEW', 'true').lower() == 'true'  # 先出低清预览，成片后台渲染
+    VIDEO_PREVIEW_WIDTH = int(os.getenv('VIDEO_PREVIEW_WIDTH', 360))
+    VIDEO_PREVIEW_HEIGHT = int(os.getenv('VIDEO_PREVIEW_HEIGHT', 640))
+    VIDEO_PREVIEW_FPS = int(os.getenv('VIDEO_PREVIEW_FPS', 12))
+    VIDEO_PREVIEW_BITRATE = os.getenv('VIDEO_PREVIEW_BITRATE', '600k')
     
     # 音频配置
     AUDIO_SAMPLE_RATE = int(os.getenv('AUDIO_SAMPLE_RATE', 44100))
     AUDIO_CHANNELS = int(os.getenv('AUDIO_CHANNELS', 2))
+    TTS_MAX_WORKERS = int(os.getenv('TTS_MAX_WORKERS', 4))  # 段落并行合成线程数
+    TTS_SEGMENT_CHARS = int(os.getenv('TTS_SEGMENT_CHARS', 0))  # 段落最少字数，0 表示逐句合成（场景可按句切分）
+    ARCHIVE_AUDIO = os.getenv('ARCHIVE_AUDIO', 'true').lower() == 'true'  # 是否额外保存mp3存档
     
     # 图像配置
     IMAGE_WIDTH = int(os.getenv('IMAGE_WIDTH', 512))
@@ -49,6 +93,7 @@ class Config:
     MAX_SCENES = int(os.getenv('MAX_SCENES', 15))
     INFERENCE_STEPS = int(os.getenv('INFERENCE_STEPS', 30))
     GUIDANCE_SCALE = float(os.getenv('GUIDANCE_SCALE', 7.5))
+    IMAGE_SEED = int(os.getenv('IMAGE_SEED', -1))  # -1 表示不固定种子
     
     # 日志配置
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -57,7 +102,36 @@ class Config:
     # 性能配置
     ENABLE_MEMORY_EFFICIENT_ATTENTION = os.getenv('ENABLE_MEMORY_EFFICIENT_ATTENTION', 'true').lower() == 'true'
     ENABLE_CPU_OFFLOAD = os.getenv('ENABLE_CPU_OFFLOAD', 'true').lower() == 'true'
-    BATCH_SIZE = int(os.getenv('BATCH_SIZE', 4))
+    BATCH_SIZE = int(os.getenv('BATCH_SIZE', 4))  # 插画按批生成的最大批大小，实际批大小随可用显存/内存调整
+    IMAGE_BATCH_MEMORY_MB = int(os.getenv('IMAGE_BATCH_MEMORY_MB', 0))  # 批内每张图片预估占用，0 表示按分辨率估算
+    
+    # 模型注册表配置（进程内各会话共享模型）
+    MODEL_IDLE_TIMEOUT = float(os.getenv('MODEL_IDLE_TIMEOUT', 900))  # 秒，无人使用超过该时间卸载，0 表示不卸载
+    MODEL_MEMORY_PRESSURE_PERCENT = float(os.getenv('MODEL_MEMORY_PRESSURE_PERCENT', 90))  # 内存使用率超过时卸载空闲模型
+    MODEL_CHECK_INTERVAL = float(os.getenv('MODEL_CHECK_INTERVAL', 30))  # 秒，后台检查间隔
+    
+    # 图像工作进程配置（独立进程持有扩散模型，各前端共享）
+    IMAGE_WORKER = os.getenv('IMAGE_WORKER', 'false').lower() == 'true'  # 插画交给工作进程生成
+    IMAGE_WORKER_HOST = os.getenv('IMAGE_WORKER_HOST', '127.0.0.1')  # 只监听本机
+    IMAGE_WORKER_PORT = int(os.getenv('IMAGE_WORKER_PORT', 6390))
+    IMAGE_WORKER_AUTHKEY = os.getenv('IMAGE_WORKER_AUTHKEY', '')  # 为空时使用下面文件中首次启动随机生成的密钥
+    IMAGE_WORKER_AUTHKEY_FILE = BASE_DIR / os.getenv('IMAGE_WORKER_AUTHKEY_FILE', '.image_worker_key')  # 权限 0600
+    IMAGE_WORKER_AUTOSTART = os.getenv('IMAGE_WORKER_AUTOSTART', 'true').lower() == 'true'  # 连接不上时自动拉起
+    IMAGE_WORKER_COALESCE_MS = float(os.getenv('IMAGE_WORKER_COALESCE_MS', 50))  # 合并并发请求的等待窗口
+    IMAGE_WORKER_TRANSPORT = os.getenv('IMAGE_WORKER_TRANSPORT', 'png')  # png 或 shm（共享内存）
+    IMAGE_WORKER_STARTUP_TIMEOUT = float(os.getenv('IMAGE_WORKER_STARTUP_TIMEOUT', 60))  # 秒
+    
+    # 批量处理配置
+    BATCH_MAX_IN_FLIGHT = int(os.getenv('BATCH_MAX_IN_FLIGHT', 2))  # 同时处理的成语数
+    BATCH_MANIFEST = OUTPUT_DIR / os.getenv('BATCH_MANIFEST', 'batch_manifest.jsonl')
+    PIPELINE_OVERLAP = os.getenv('PIPELINE_OVERLAP', 'true').lower() == 'true'  # 各阶段流水线并行
+    PIPELINE_NETWORK_WORKERS = int(os.getenv('PIPELINE_NETWORK_WORKERS', 4))  # 故事/TTS等网络阶段线程数
+    PIPELINE_ENCODE_WORKERS = int(os.getenv('PIPELINE_ENCODE_WORKERS', 2))  # 视频编码进程数
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', 2))  # 阶段间队列长度
+    
+    # 缓存配置
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 2 * 1024 ** 3))  # 默认2GB
+    CACHE_IMAGE_FORMAT = os.getenv('CACHE_IMAGE_FORMAT', 'PNG')  # PNG 或 WEBP（无损）
     
     # RTX显卡优化配置
     ENABLE_RTX_OPTIMIZATION = os.getenv('ENABLE_RTX_OPTIMIZATION', 'true').lower() == 'true'
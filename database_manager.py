@@ -1,27 +1,77 @@
 """
 数据库管理器 - 基于SQLite的缓存系统
 """
+import io
+import os
 import sqlite3
 import json
 import hashlib
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-import shutil
+import threading
+import time
 from loguru import logger
 
+from workspace_manager import prune_versions, publish, publish_bytes, workspace_manager
+
+class ConnectionManager:
+    """SQLite连接管理器 - 每个线程复用一个长连接
+    
+    连接以WAL模式打开（读写互不阻塞），synchronous=NORMAL，并设置忙等待超时，
+    避免并发写入时直接抛出 "database is locked"。连接随线程结束自动释放。
+    """
+    
+    def __init__(self, db_path: str, busy_timeout: float = 30.0, cached_statements: int = 256):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+    
+    def connection(self) -> sqlite3.Connection:
+        """获取当前线程的连接
+        
+        返回的连接可直接用作上下文管理器：正常退出时提交，异常时回滚，但不会关闭连接。
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+    
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        # cached_statements 为每个连接的预编译语句缓存，长连接下才能真正复用
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            check_same_thread=False
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout * 1000)}')
+        return conn
+
 class DatabaseManager:
     """数据库管理器"""
     
-    def __init__(self, db_path: str = "idiom_cache.db", storage_dir: str = "storage"):
+    def __init__(self, db_path: str = "idiom_cache.db", storage_dir: str = "storage", busy_timeout: float = 30.0):
         self.db_path = db_path
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.connections = ConnectionManager(db_path, busy_timeout=busy_timeout)
         self._init_database()
     
     def _init_database(self):
         """初始化数据库"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connections.connection() as conn:
             cursor = conn.cursor()
             
             # 创建故事表
@@ -93,233 +143,394 @@ class DatabaseManager:
             
             # 创建索引
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_stories_idiom ON stories(idiom)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_stories_updated ON stories(updated_at, id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_scenes_story_id ON scenes(story_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_story_id ON images(story_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_audio_story_id ON audio(story_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_videos_story_id ON videos(story_id)')
             
+            self._migrate_videos(cursor)
+            self._init_storage_stats(cursor)
+            
             conn.commit()
             logger.info("数据库初始化完成")
     
+    # 视频版本与渲染状态列（旧库通过 ALTER TABLE 补齐）
+    _VIDEO_COLUMNS = {
+        'rendition': "TEXT NOT NULL DEFAULT 'final'",
+        'status': "TEXT NOT NULL DEFAULT 'ready'",
+        'error': 'TEXT',
+        'updated_at': 'TIMESTAMP'
+    }
+    
+    def _migrate_videos(self, cursor):
+        """为视频表补充 rendition（preview/final）与 status（rendering/ready/failed）列"""
+        existing = {row[1] for row in cursor.execute('PRAGMA table_info(videos)')}
+        for column, definition in self._VIDEO_COLUMNS.items():
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE videos ADD COLUMN {column} {definition}')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_videos_story_rendition ON videos(story_id, rendition)')
+    
+    # 统计类别 -> (表名, 大小列)
+    _STAT_TABLES = {
+        'story': ('stories', None),
+        'image': ('images', 'image_size'),
+        'audio': ('audio', 'audio_size'),
+        'video': ('videos', 'video_size')
+    }
+    
+    def _init_storage_stats(self, cursor):
+        """创建存储统计汇总表，并用触发器随增删改同步更新"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS storage_stats (
+                category TEXT PRIMARY KEY,
+                item_count INTEGER NOT NULL DEFAULT 0,
+                total_size INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        
+        # 文件系统校准结果
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS storage_reconcile (
+                category TEXT PRIMARY KEY,
+                file_count INTEGER NOT NULL,
+                file_size INTEGER NOT NULL,
+                db_count INTEGER NOT NULL,
+                db_size INTEGER NOT NULL,
+                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        for category, (table, size_column) in self._STAT_TABLES.items():
+            size_new = f'COALESCE(NEW.{size_column}, 0)' if size_column else '0'
+            size_old = f'COALESCE(OLD.{size_column}, 0)' if size_column else '0'
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_insert AFTER INSERT ON {table}
+                BEGIN
+                    UPDATE storage_stats SET item_count = item_count + 1, total_size = total_size + {size_new}
+                    WHERE category = '{category}';
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_delete AFTER DELETE ON {table}
+                BEGIN
+                    UPDATE storage_stats SET item_count = item_count - 1, total_size = total_size - {size_old}
+                    WHERE category = '{category}';
+                END
+            ''')
+            if size_column:
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_stats_update AFTER UPDATE OF {size_column} ON {table}
+                    BEGIN
+                        UPDATE storage_stats SET total_size = total_size - {size_old} + {size_new}
+                        WHERE category = '{category}';
+                    END
+                ''')
+        
+        # 首次创建时根据现有数据回填
+        existing = {row[0] for row in cursor.execute('SELECT category FROM storage_stats')}
+        for category, (table, size_column) in self._STAT_TABLES.items():
+            if category not in existing:
+                size_expr = f'COALESCE(SUM({size_column}), 0)' if size_column else '0'
+                cursor.execute(f'''
+                    INSERT INTO storage_stats (category, item_count, total_size)
+                    SELECT ?, COUNT(*), {size_expr} FROM {table}
+                ''', (category,))
+    
     def save_story(self, idiom: str, story_text: str, scenes: List[str]) -> int:
         """保存故事和场景"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connections.connection() as conn:
             cursor = conn.cursor()
             
-            # 保存故事
+            # 保存故事（原地更新，保持story_id不变，统计触发器才能正确计数）
             cursor.execute('''
-                INSERT OR REPLACE INTO stories (idiom, story_text, updated_at)
+                INSERT INTO stories (idiom, story_text, updated_at)
                 VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(idiom) DO UPDATE SET
+                    story_text = excluded.story_text,
+                    updated_at = CURRENT_TIMESTAMP
             ''', (idiom, story_text))
             
-            story_id = cursor.lastrowid
+            cursor.execute('SELECT id FROM stories WHERE idiom = ?', (idiom,))
+            story_id = cursor.fetchone()[0]
             
             # 删除旧场景
             cursor.execute('DELETE FROM scenes WHERE story_id = ?', (story_id,))
             
             # 保存新场景
-            for i, scene in enumerate(scenes):
-                cursor.execute('''
-                    INSERT INTO scenes (story_id, scene_text, scene_order)
-                    VALUES (?, ?, ?)
-                ''', (story_id, scene, i + 1))
+            cursor.executemany('''
+                INSERT INTO scenes (story_id, scene_text, scene_order)
+                VALUES (?, ?, ?)
+            ''', [(story_id, scene, i + 1) for i, scene in enumerate(scenes)])
             
             conn.commit()
             logger.info(f"故事 '{idiom}' 已保存，包含 {len(scenes)} 个场景")
             return story_id
     
     def save_images(self, story_id: int, images: List[Any], idiom: str) -> List[str]:
-        """保存图片并返回文件路径列表"""
+        """保存图片并返回文件路径列表（文件名带内容哈希，原子写入）"""
         image_paths = []
+        rows = []
         
         for i, image in enumerate(images):
-            # 生成文件名
-            filename = f"{idiom}_{i+1:02d}.jpg"
-            image_path = self.storage_dir / "images" / filename
-            image_path.parent.mkdir(parents=True, exist_ok=True)
-            
-            # 保存图片
+            # 编码到内存
+            buffer = io.BytesIO()
             if hasattr(image, 'save'):
-                image.save(image_path, 'JPEG', quality=95)
+                image.save(buffer, 'JPEG', quality=95)
             else:
                 # 如果是PIL Image对象
                 import PIL.Image
                 if isinstance(image, PIL.Image.Image):
-                    image.save(image_path, 'JPEG', quality=95)
+                    image.save(buffer, 'JPEG', quality=95)
                 else:
                     logger.error(f"无法保存图片 {i+1}，类型: {type(image)}")
                     continue
             
-            # 获取文件大小
-            file_size = image_path.stat().st_size
-            
-            # 保存到数据库
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO images (story_id, image_path, image_filename, image_size)
-                    VALUES (?, ?, ?, ?)
-                ''', (story_id, str(image_path), filename, file_size))
+            # 按内容哈希命名：{成语}_{序号}.{哈希}.jpg
+            image_path = publish_bytes(buffer.getvalue(), self.storage_dir / "images", f"{idiom}_{i+1:02d}", ".jpg")
             
+            rows.append((story_id, str(image_path), image_path.name, len(buffer.getvalue())))
             image_paths.append(str(image_path))
-            logger.info(f"图片已保存: {filename}")
+            logger.info(f"图片已保存: {image_path.name}")
+        
+        # 一次事务批量写入数据库（替换该故事原有的图片记录）
+        with self.connections.connection() as conn:
+            old_paths = [row[0] for row in conn.execute('SELECT image_path FROM images WHERE story_id = ?', (story_id,))]
+            conn.execute('DELETE FROM images WHERE story_id = ?', (story_id,))
+            conn.executemany('''
+                INSERT INTO images (story_id, image_path, image_filename, image_size)
+                VALUES (?, ?, ?, ?)
+            ''', rows)
         
+        self._release_files('images', 'image_path', old_paths)
         return image_paths
     
-    def save_audio(self, story_id: int, audio_path: str, idiom: str) -> str:
-        """保存音频文件"""
-        # 生成文件名
-        filename = f"{idiom}_01.mp3"
-        new_audio_path = self.storage_dir / "audio" / filename
-        new_audio_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # 复制音频文件
-        shutil.copy2(audio_path, new_audio_path)
+    def save_audio(self, story_id: int, audio, idiom: str) -> str:
+        """保存音频文件，audio 为文件路径或内存音轨（AudioTrack，直接编码为存档mp3）"""
+        audio_dir = self.storage_dir / "audio"
+        if hasattr(audio, 'export'):
+            # 在任务工作区中编码，再按内容哈希发布
+            with workspace_manager.create(f"audio_{idiom}") as workspace:
+                new_audio_path = publish(audio.export(workspace.file("audio.mp3")), audio_dir, f"{idiom}_01", ".mp3")
+        else:
+            new_audio_path = publish(audio, audio_dir, f"{idiom}_01", ".mp3")
+        filename = new_audio_path.name
         
         # 获取文件信息
         file_size = new_audio_path.stat().st_size
         
         # 保存到数据库
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connections.connection() as conn:
             cursor = conn.cursor()
+            old_paths = [row[0] for row in cursor.execute('SELECT audio_path FROM audio WHERE story_id = ?', (story_id,))]
+            cursor.execute('DELETE FROM audio WHERE story_id = ?', (story_id,))
             cursor.execute('''
-                INSERT OR REPLACE INTO audio (story_id, audio_path, audio_filename, audio_size)
+                INSERT INTO audio (story_id, audio_path, audio_filename, audio_size)
                 VALUES (?, ?, ?, ?)
             ''', (story_id, str(new_audio_path), filename, file_size))
         
+        self._release_files('audio', 'audio_path', old_paths)
         logger.info(f"音频已保存: {filename}")
         return str(new_audio_path)
     
-    def save_video(self, story_id: int, video_path: str, idiom: str) -> str:
+    def save_video(self, story_id: int, video_path: str, idiom: str, rendition: str = 'final') -> str:
         """保存视频文件"""
-        # 生成文件名
-        filename = f"{idiom}_story.mp4"
-        new_video_path = self.storage_dir / "videos" / filename
-        new_video_path.parent.mkdir(parents=True, exist_ok=True)
+        video_id = self.begin_video(story_id, idiom, rendition)
+        return self.finish_video(video_id, video_path)
+    
+    def _video_filename(self, idiom: str, rendition: str) -> str:
+        return f"{idiom}_story.mp4" if rendition == 'final' else f"{idiom}_{rendition}.mp4"
+    
+    def begin_video(self, story_id: int, idiom: str, rendition: str = 'final') -> int:
+        """登记一个渲染中的视频版本（替换该故事同一版本的旧记录），返回记录ID
         
-        # 复制视频文件
-        shutil.copy2(video_path, new_video_path)
+        渲染期间记录的是不带哈希的目标路径，完成后由 finish_video 更新为实际发布的版本。
+        """
+        filename = self._video_filename(idiom, rendition)
+        target_path = self.storage_dir / "videos" / filename
+        
+        with self.connections.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM videos WHERE story_id = ? AND rendition = ?', (story_id, rendition))
+            cursor.execute('''
+                INSERT INTO videos (story_id, video_path, video_filename, rendition, status, updated_at)
+                VALUES (?, ?, ?, ?, 'rendering', CURRENT_TIMESTAMP)
+            ''', (story_id, str(target_path), filename, rendition))
+            return cursor.lastrowid
+    
+    def finish_video(self, video_id: int, video_path: str) -> str:
+        """渲染完成：按内容哈希发布到存储目录并标记为 ready，删除不再被引用的旧版本"""
+        with self.connections.connection() as conn:
+            row = conn.execute('SELECT video_path, video_filename FROM videos WHERE id = ?', (video_id,)).fetchone()
+        if not row:
+            raise ValueError(f"视频记录不存在: {video_id}")
+        
+        # 新版本写入独立的文件名，播放中的旧版本不受影响
+        target = Path(row[0])
+        stem, suffix = Path(row[1]).stem, Path(row[1]).suffix
+        new_video_path = publish(video_path, target.parent, stem, suffix)
         
         # 获取文件信息
         file_size = new_video_path.stat().st_size
         
         # 保存到数据库
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO videos (story_id, video_path, video_filename, video_size)
-                VALUES (?, ?, ?, ?)
-            ''', (story_id, str(new_video_path), filename, file_size))
+        with self.connections.connection() as conn:
+            conn.execute('''
+                UPDATE videos SET video_path = ?, video_filename = ?, video_size = ?, status = 'ready', error = NULL,
+                                  updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (str(new_video_path), new_video_path.name, file_size, video_id))
+            referenced = [path for (path,) in conn.execute(
+                'SELECT video_path FROM videos WHERE video_path LIKE ?', (f"%{stem}.%{suffix}",))]
         
-        logger.info(f"视频已保存: {filename}")
+        prune_versions(target.parent, stem, suffix, referenced)
+        logger.info(f"视频已保存: {new_video_path.name}")
         return str(new_video_path)
     
+    def _release_files(self, table: str, column: str, paths: List[str]):
+        """删除已替换的旧文件（仍被其他记录引用的保留，内容相同的文件可能被多条记录共享）"""
+        with self.connections.connection() as conn:
+            for path in set(paths):
+                if conn.execute(f'SELECT 1 FROM {table} WHERE {column} = ? LIMIT 1', (path,)).fetchone():
+                    continue
+                try:
+                    Path(path).unlink(missing_ok=True)
+                except OSError as e:
+                    logger.warning(f"删除旧文件失败 {path}: {e}")
+    
+    def fail_video(self, video_id: int, error: str):
+        """标记视频渲染失败"""
+        with self.connections.connection() as conn:
+            conn.execute('''
+                UPDATE videos SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+            ''', (error[:500], video_id))
+    
+    def get_video_renditions(self, story_id: int) -> Dict[str, Dict[str, Any]]:
+        """获取故事各视频版本的状态 {rendition: {...}}"""
+        with self.connections.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, rendition, status, video_path, video_filename, video_size, error, updated_at
+                FROM videos WHERE story_id = ? ORDER BY id
+            ''', (story_id,)).fetchall()
+        
+        return {row[1]: {'id': row[0], 'rendition': row[1], 'status': row[2], 'path': row[3],
+                         'filename': row[4], 'size': row[5], 'error': row[6], 'updated_at': row[7]}
+                for row in rows}
+    
+    # 故事详情查询：场景/图片/音频/视频通过相关子查询在SQL端聚合为JSON，一次往返取回
+    _STORY_SELECT = '''
+        SELECT s.id, s.idiom, s.story_text, s.created_at, s.updated_at,
+               (SELECT json_group_array(scene_text) FROM (
+                    SELECT scene_text FROM scenes WHERE story_id = s.id ORDER BY scene_order
+               )) AS scenes,
+               (SELECT json_group_array(json_object('path', image_path, 'filename', image_filename, 'size', image_size)) FROM (
+                    SELECT image_path, image_filename, image_size FROM images WHERE story_id = s.id ORDER BY id
+               )) AS images,
+               (SELECT json_object('path', audio_path, 'filename', audio_filename, 'size', audio_size)
+                FROM audio WHERE story_id = s.id ORDER BY id DESC LIMIT 1) AS audio,
+               (SELECT json_object('path', video_path, 'filename', video_filename, 'size', video_size,
+                                   'rendition', rendition)
+                FROM videos WHERE story_id = s.id AND status = 'ready'
+                ORDER BY rendition = 'final' DESC, id DESC LIMIT 1) AS video
+        FROM stories s
+    '''
+    
+    # SQLite 默认单条语句最多 999 个绑定参数
+    _MAX_IN_PARAMS = 500
+    
     def get_story(self, idiom: str) -> Optional[Dict[str, Any]]:
-        """获取故事信息"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 获取故事基本信息
-            cursor.execute('''
-                SELECT id, story_text, created_at, updated_at
-                FROM stories WHERE idiom = ?
-            ''', (idiom,))
-            
-            story_row = cursor.fetchone()
-            if not story_row:
-                return None
-            
-            story_id, story_text, created_at, updated_at = story_row
-            
-            # 获取场景
-            cursor.execute('''
-                SELECT scene_text, scene_order
-                FROM scenes WHERE story_id = ?
-                ORDER BY scene_order
-            ''', (story_id,))
-            
-            scenes = [row[0] for row in cursor.fetchall()]
-            
-            # 获取图片
-            cursor.execute('''
-                SELECT image_path, image_filename, image_size
-                FROM images WHERE story_id = ?
-                ORDER BY id
-            ''', (story_id,))
-            
-            images = [{'path': row[0], 'filename': row[1], 'size': row[2]} 
-                     for row in cursor.fetchall()]
-            
-            # 获取音频
-            cursor.execute('''
-                SELECT audio_path, audio_filename, audio_size
-                FROM audio WHERE story_id = ?
-            ''', (story_id,))
-            
-            audio_row = cursor.fetchone()
-            audio = {'path': audio_row[0], 'filename': audio_row[1], 'size': audio_row[2]} if audio_row else None
-            
-            # 获取视频
-            cursor.execute('''
-                SELECT video_path, video_filename, video_size
-                FROM videos WHERE story_id = ?
-            ''', (story_id,))
-            
-            video_row = cursor.fetchone()
-            video = {'path': video_row[0], 'filename': video_row[1], 'size': video_row[2]} if video_row else None
-            
-            return {
-                'id': story_id,
-                'idiom': idiom,
-                'story_text': story_text,
-                'scenes': scenes,
-                'images': images,
-                'audio': audio,
-                'video': video,
-                'created_at': created_at,
-                'updated_at': updated_at
-            }
-    
-    def list_stories(self, limit: int = 50) -> List[Dict[str, Any]]:
-        """列出所有故事"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT s.idiom, s.story_text, s.created_at, s.updated_at,
-                       COUNT(DISTINCT sc.id) as scene_count,
-                       COUNT(DISTINCT i.id) as image_count,
-                       COUNT(DISTINCT a.id) as audio_count,
-                       COUNT(DISTINCT v.id) as video_count
+        """获取故事信息（单次查询）"""
+        with self.connections.connection() as conn:
+            row = conn.execute(self._STORY_SELECT + ' WHERE s.idiom = ?', (idiom,)).fetchone()
+        return self._row_to_story(row) if row else None
+    
+    def get_stories(self, idioms: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量获取故事信息，查询次数只与分块数有关，与故事数量无关"""
+        idioms = list(dict.fromkeys(idioms))
+        stories = {}
+        
+        with self.connections.connection() as conn:
+            for start in range(0, len(idioms), self._MAX_IN_PARAMS):
+                chunk = idioms[start:start + self._MAX_IN_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(self._STORY_SELECT + f' WHERE s.idiom IN ({placeholders})', chunk).fetchall()
+                for row in rows:
+                    story = self._row_to_story(row)
+                    stories[story['idiom']] = story
+        
+        return stories
+    
+    @staticmethod
+    def _row_to_story(row) -> Dict[str, Any]:
+        story_id, idiom, story_text, created_at, updated_at, scenes, images, audio, video = row
+        return {
+            'id': story_id,
+            'idiom': idiom,
+            'story_text': story_text,
+            'scenes': json.loads(scenes),
+            'images': json.loads(images),
+            'audio': json.loads(audio) if audio else None,
+            'video': json.loads(video) if video else None,
+            'created_at': created_at,
+            'updated_at': updated_at
+        }
+    
+    def list_stories(self, limit: int = 50, cursor: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出故事（按更新时间倒序）"""
+        return self.list_stories_page(limit, cursor)['stories']
+    
+    def list_stories_page(self, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """分页列出故事
+        
+        使用 (updated_at, id) 键集分页：cursor 为上一页返回的 next_cursor，
+        翻页代价与页码无关。预览文本和各类数量均在SQL端计算。
+        """
+        params = []
+        where = ''
+        if cursor:
+            cursor_updated_at, cursor_id = cursor.rsplit('|', 1)
+            where = 'WHERE (s.updated_at, s.id) < (?, ?)'
+            params.extend([cursor_updated_at, int(cursor_id)])
+        params.append(limit)
+        
+        with self.connections.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT s.id, s.idiom,
+                       CASE WHEN length(s.story_text) > 100
+                            THEN substr(s.story_text, 1, 100) || '...'
+                            ELSE s.story_text END AS preview,
+                       s.created_at, s.updated_at,
+                       (SELECT COUNT(*) FROM scenes WHERE story_id = s.id) AS scene_count,
+                       (SELECT COUNT(*) FROM images WHERE story_id = s.id) AS image_count,
+                       (SELECT COUNT(*) FROM audio WHERE story_id = s.id) AS audio_count,
+                       (SELECT COUNT(*) FROM videos WHERE story_id = s.id) AS video_count
                 FROM stories s
-                LEFT JOIN scenes sc ON s.id = sc.story_id
-                LEFT JOIN images i ON s.id = i.story_id
-                LEFT JOIN audio a ON s.id = a.story_id
-                LEFT JOIN videos v ON s.id = v.story_id
-                GROUP BY s.id, s.idiom, s.story_text, s.created_at, s.updated_at
-                ORDER BY s.updated_at DESC
+                {where}
+                ORDER BY s.updated_at DESC, s.id DESC
                 LIMIT ?
-            ''', (limit,))
-            
-            stories = []
-            for row in cursor.fetchall():
-                stories.append({
-                    'idiom': row[0],
-                    'story_text': row[1][:100] + '...' if len(row[1]) > 100 else row[1],
-                    'created_at': row[2],
-                    'updated_at': row[3],
-                    'scene_count': row[4],
-                    'image_count': row[5],
-                    'audio_count': row[6],
-                    'video_count': row[7]
-                })
-            
-            return stories
+            ''', params).fetchall()
+        
+        stories = []
+        for row in rows:
+            stories.append({
+                'id': row[0],
+                'idiom': row[1],
+                'story_text': row[2],
+                'created_at': row[3],
+                'updated_at': row[4],
+                'scene_count': row[5],
+                'image_count': row[6],
+                'audio_count': row[7],
+                'video_count': row[8]
+            })
+        
+        next_cursor = f"{rows[-1][4]}|{rows[-1][0]}" if len(rows) == limit else None
+        return {'stories': stories, 'next_cursor': next_cursor}
     
     def delete_story(self, idiom: str) -> bool:
         """删除故事及其所有相关文件"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.connections.connection() as conn:
                 cursor = conn.cursor()
                 
                 # 获取故事ID
@@ -340,66 +551,141 @@ class DatabaseManager:
                 cursor.execute('SELECT video_path FROM videos WHERE story_id = ?', (story_id,))
                 video_paths = [row[0] for row in cursor.fetchall()]
                 
-                # 删除文件
-                for path in image_paths + audio_paths + video_paths:
-                    try:
-                        Path(path).unlink(missing_ok=True)
-                    except Exception as e:
-                        logger.warning(f"删除文件失败 {path}: {e}")
-                
-                # 删除数据库记录
+                # 删除数据库记录（逐表删除，统计触发器同步扣减）
+                for table in ('images', 'audio', 'videos', 'scenes'):
+                    cursor.execute(f'DELETE FROM {table} WHERE story_id = ?', (story_id,))
                 cursor.execute('DELETE FROM stories WHERE id = ?', (story_id,))
                 conn.commit()
-                
-                logger.info(f"故事 '{idiom}' 及其所有文件已删除")
-                return True
-                
+            
+            # 删除文件（按内容哈希命名的文件可能仍被其他故事引用）
+            self._release_files('images', 'image_path', image_paths)
+            self._release_files('audio', 'audio_path', audio_paths)
+            self._release_files('videos', 'video_path', video_paths)
+            
+            logger.info(f"故事 '{idiom}' 及其所有文件已删除")
+            return True
+        
         except Exception as e:
             logger.error(f"删除故事失败: {e}")
             return False
     
     def get_storage_stats(self) -> Dict[str, Any]:
-        """获取存储统计信息"""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            
-            # 统计故事数量
-            cursor.execute('SELECT COUNT(*) FROM stories')
-            story_count = cursor.fetchone()[0]
-            
-            # 统计文件数量
-            cursor.execute('SELECT COUNT(*) FROM images')
-            image_count = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM audio')
-            audio_count = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM videos')
-            video_count = cursor.fetchone()[0]
-            
-            # 计算存储大小
-            cursor.execute('SELECT SUM(image_size) FROM images')
-            image_size = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT SUM(audio_size) FROM audio')
-            audio_size = cursor.fetchone()[0] or 0
-            
-            cursor.execute('SELECT SUM(video_size) FROM videos')
-            video_size = cursor.fetchone()[0] or 0
-            
-            total_size = image_size + audio_size + video_size
+        """获取存储统计信息（读取汇总表，与数据量无关）"""
+        with self.connections.connection() as conn:
+            rows = conn.execute('SELECT category, item_count, total_size FROM storage_stats').fetchall()
+        
+        stats = {category: (count, size) for category, count, size in rows}
+        image_count, image_size = stats.get('image', (0, 0))
+        audio_count, audio_size = stats.get('audio', (0, 0))
+        video_count, video_size = stats.get('video', (0, 0))
+        total_size = image_size + audio_size + video_size
+        
+        return {
+            'story_count': stats.get('story', (0, 0))[0],
+            'image_count': image_count,
+            'audio_count': audio_count,
+            'video_count': video_count,
+            'total_size': total_size,
+            'total_size_mb': total_size / (1024 * 1024),
+            'image_size': image_size,
+            'audio_size': audio_size,
+            'video_size': video_size
+        }
+    
+    def reconcile_storage(self, repair: bool = True) -> Dict[str, Dict[str, Any]]:
+        """校准存储统计
+        
+        按表重新计算数量和大小，与汇总表比较（repair=True 时修正漂移），
+        并扫描存储目录记录实际文件数量和大小，供管理界面展示。
+        """
+        directories = {'image': 'images', 'audio': 'audio', 'video': 'videos'}
+        report = {}
+        
+        conn = self.connections.connection()
+        for category, (table, size_column) in self._STAT_TABLES.items():
+            size_expr = f'COALESCE(SUM({size_column}), 0)' if size_column else '0'
+            # 每个分类的读取与修正放在同一个写事务中，避免期间的插入/删除被覆盖
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                db_count, db_size = conn.execute(f'SELECT COUNT(*), {size_expr} FROM {table}').fetchone()
+                stat_count, stat_size = conn.execute(
+                    'SELECT item_count, total_size FROM storage_stats WHERE category = ?', (category,)
+                ).fetchone()
+                
+                if (stat_count, stat_size) != (db_count, db_size):
+                    logger.warning(f"存储统计漂移 [{category}]: 汇总 {stat_count}/{stat_size}, 实际 {db_count}/{db_size}")
+                    if repair:
+                        conn.execute(
+                            'UPDATE storage_stats SET item_count = ?, total_size = ? WHERE category = ?',
+                            (db_count, db_size, category)
+                        )
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
             
-            return {
-                'story_count': story_count,
-                'image_count': image_count,
-                'audio_count': audio_count,
-                'video_count': video_count,
-                'total_size': total_size,
-                'total_size_mb': total_size / (1024 * 1024),
-                'image_size': image_size,
-                'audio_size': audio_size,
-                'video_size': video_size
-            }
+            report[category] = {'db_count': db_count, 'db_size': db_size,
+                                'drift': (stat_count - db_count, stat_size - db_size)}
+        
+        # 文件系统扫描放在事务之外
+        for category, directory in directories.items():
+            file_count, file_size = self._scan_directory(self.storage_dir / directory)
+            report[category].update({'file_count': file_count, 'file_size': file_size})
+        
+        with self.connections.connection() as conn:
+            conn.executemany('''
+                INSERT OR REPLACE INTO storage_reconcile (category, file_count, file_size, db_count, db_size, checked_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', [(category, item['file_count'], item['file_size'], item['db_count'], item['db_size'])
+                  for category, item in report.items() if 'file_count' in item])
+        
+        logger.info("存储统计校准完成")
+        return report
+    
+    def get_reconcile_report(self) -> List[Dict[str, Any]]:
+        """获取最近一次文件系统校准结果"""
+        with self.connections.connection() as conn:
+            rows = conn.execute('''
+                SELECT category, file_count, file_size, db_count, db_size, checked_at
+                FROM storage_reconcile ORDER BY category
+            ''').fetchall()
+        
+        return [{'category': row[0], 'file_count': row[1], 'file_size': row[2],
+                 'db_count': row[3], 'db_size': row[4], 'checked_at': row[5]} for row in rows]
+    
+    def start_reconciler(self, interval: float = 600.0):
+        """启动后台校准线程（重复调用无副作用）"""
+        if getattr(self, '_reconciler', None) and self._reconciler.is_alive():
+            return
+        
+        def run():
+            while True:
+                try:
+                    self.reconcile_storage()
+                except Exception as e:
+                    logger.error(f"存储统计校准失败: {e}")
+                time.sleep(interval)
+        
+        self._reconciler = threading.Thread(target=run, name="storage-reconciler", daemon=True)
+        self._reconciler.start()
+    
+    @staticmethod
+    def _scan_directory(directory: Path):
+        """统计目录下的文件数量和总大小"""
+        file_count, file_size = 0, 0
+        if not directory.exists():
+            return file_count, file_size
+        
+        stack = [str(directory)]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        file_count += 1
+                        file_size += entry.stat(follow_symlinks=False).st_size
+        return file_count, file_size
 
 # 创建全局数据库管理器实例
 db_manager = DatabaseManager()
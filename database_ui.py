@@ -49,7 +49,27 @@ def show_database_management():
     # 故事列表
     st.subheader("📚 故事列表")
     
-    stories = db_manager.list_stories(limit=100)
+    # 键集分页：记录每一页的起始游标，支持前后翻页
+    if 'story_page_cursors' not in st.session_state:
+        st.session_state.story_page_cursors = [None]
+    
+    page = db_manager.list_stories_page(limit=100, cursor=st.session_state.story_page_cursors[-1])
+    stories = page['stories']
+    
+    page_col1, page_col2, page_col3 = st.columns([1, 1, 4])
+    
+    with page_col1:
+        if st.button("⬅️ 上一页", disabled=len(st.session_state.story_page_cursors) == 1):
+            st.session_state.story_page_cursors.pop()
+            st.rerun()
+    
+    with page_col2:
+        if st.button("下一页 ➡️", disabled=page['next_cursor'] is None):
+            st.session_state.story_page_cursors.append(page['next_cursor'])
+            st.rerun()
+    
+    with page_col3:
+        st.caption(f"第 {len(st.session_state.story_page_cursors)} 页")
     
     if stories:
         # 创建DataFrame
@@ -120,22 +140,33 @@ def show_database_management():
         db_size = db_path.stat().st_size
         st.info(f"数据库文件大小: {db_size / 1024 / 1024:.2f} MB")
         
-        # 显示存储目录结构
-        storage_dir = Path("storage")
-        if storage_dir.exists():
-            st.subheader("📂 存储目录结构")
-            
-            def show_directory_tree(path, level=0):
-                indent = "  " * level
-                if path.is_dir():
-                    st.text(f"{indent}📁 {path.name}/")
-                    for child in sorted(path.iterdir()):
-                        show_directory_tree(child, level + 1)
-                else:
-                    size = path.stat().st_size
-                    st.text(f"{indent}📄 {path.name} ({size / 1024:.1f} KB)")
-            
-            show_directory_tree(storage_dir)
+        # 显示存储目录校准结果（由后台线程定期扫描，页面加载不再遍历文件）
+        db_manager.start_reconciler()
+        
+        st.subheader("📂 存储目录校准")
+        
+        if st.button("🔍 立即校准"):
+            with st.spinner("正在扫描存储目录..."):
+                db_manager.reconcile_storage()
+        
+        report = db_manager.get_reconcile_report()
+        if report:
+            category_names = {'image': '图片', 'audio': '音频', 'video': '视频'}
+            rows = []
+            for item in report:
+                drift = item['file_count'] != item['db_count'] or item['file_size'] != item['db_size']
+                rows.append({
+                    "类别": category_names.get(item['category'], item['category']),
+                    "文件数": item['file_count'],
+                    "文件大小(MB)": round(item['file_size'] / 1024 / 1024, 2),
+                    "记录数": item['db_count'],
+                    "记录大小(MB)": round(item['db_size'] / 1024 / 1024, 2),
+                    "状态": "⚠️ 不一致" if drift else "✅ 一致",
+                    "校准时间": item['checked_at']
+                })
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        else:
+            st.info("尚未校准，后台校准完成后显示")
     else:
         st.warning("数据库文件不存在")
 
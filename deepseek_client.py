@@ -0,0 +1,239 @@
+"""
+DeepSeek 异步客户端 - 连接复用、并发上限、令牌桶限速、429/5xx 指数退避重试
+
+AsyncDeepSeekClient 基于 httpx.AsyncClient，长连接在所有请求间复用；
+DeepSeekStoryClient 在后台事件循环上运行异步客户端，供线程池阶段以同步方式调用。
+兼容任意 OpenAI 格式的 /chat/completions 接口，可通过 DEEPSEEK_BASE_URL 指向本地模拟服务。
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+from loguru import logger
+
+from config import Config
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+STORY_PROMPT = """请为成语"{idiom}"创作一个适合3-8岁儿童阅读的故事，要求：
+1. 字数控制在{max_length}字以内
+2. 包含丰富的场景描述，便于后续生成插画
+3. 语言生动有趣，符合儿童认知水平
+4. 故事要有明确的开始、发展和结尾
+5. 每个场景都要有详细的视觉描述
+6. 故事要有教育意义，传递正面价值观"""
+
+# 需要重试的HTTP状态码
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class DeepSeekAPIError(Exception):
+    """DeepSeek 请求失败（不可重试的错误，或重试次数耗尽）"""
+    
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class TokenBucket:
+    """异步令牌桶：平均速率 rate 次/秒，允许 capacity 次突发"""
+    
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class AsyncDeepSeekClient:
+    """异步 DeepSeek 客户端，需在 async with 中使用或手动调用 aclose()"""
+    
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 model: Optional[str] = None, max_concurrency: Optional[int] = None,
+                 rate_limit: Optional[float] = None, timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None, backoff_base: float = 1.0, backoff_max: float = 30.0):
+        if httpx is None:
+            raise ImportError("需要安装 httpx: pip install httpx")
+        
+        self.api_key = api_key or Config.DEEPSEEK_API_KEY
+        self.base_url = (base_url or Config.DEEPSEEK_BASE_URL).rstrip('/')
+        self.model = model or Config.DEEPSEEK_MODEL
+        self.max_concurrency = max_concurrency or Config.DEEPSEEK_MAX_CONCURRENCY
+        self.rate_limit = Config.DEEPSEEK_RATE_LIMIT if rate_limit is None else rate_limit
+        self.timeout = timeout or Config.DEEPSEEK_TIMEOUT
+        self.max_retries = Config.DEEPSEEK_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        
+        self._client = None
+        self._semaphore = None
+        self._bucket = None
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0}
+    
+    async def __aenter__(self):
+        self._ensure_client()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+    
+    def _ensure_client(self):
+        # 延迟到事件循环内创建，信号量和锁与当前循环绑定
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={
+                    'Authorization': f'Bearer {self.api_key}',
+                    'Content-Type': 'application/json'
+                },
+                timeout=httpx.Timeout(self.timeout, connect=min(10.0, self.timeout)),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._bucket = TokenBucket(self.rate_limit)
+    
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _backoff_delay(self, attempt: int, response=None) -> float:
+        """指数退避 + 随机抖动；服务端给出 Retry-After 时优先采用"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(self.backoff_max, max(0.0, float(retry_after)))
+                except ValueError:
+                    pass
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(ceiling / 2, ceiling)
+    
+    async def chat(self, messages: List[Dict], **params) -> str:
+        """调用 /chat/completions，返回第一条回复内容"""
+        self._ensure_client()
+        payload = {'model': self.model, 'messages': messages}
+        payload.update(params)
+        
+        attempt = 0
+        while True:
+            await self._bucket.acquire()
+            response = None
+            error = None
+            async with self._semaphore:
+                self.stats['requests'] += 1
+                try:
+                    response = await self._client.post('/chat/completions', json=payload)
+                except (httpx.TimeoutException, httpx.TransportError) as e:
+                    error = f"网络错误: {e!r}"
+            
+            if response is not None:
+                if response.status_code == 200:
+                    try:
+                        return response.json()['choices'][0]['message']['content'].strip()
+                    except (ValueError, KeyError, IndexError) as e:
+                        self.stats['failures'] += 1
+                        raise DeepSeekAPIError(f"响应格式错误: {e}", response.status_code)
+                if response.status_code not in RETRY_STATUS:
+                    self.stats['failures'] += 1
+                    raise DeepSeekAPIError(f"请求失败 HTTP {response.status_code}: {response.text[:200]}",
+                                           response.status_code)
+                error = f"HTTP {response.status_code}"
+            
+            if attempt >= self.max_retries:
+                self.stats['failures'] += 1
+                raise DeepSeekAPIError(f"重试{self.max_retries}次后仍失败: {error}",
+                                       response.status_code if response is not None else None)
+            
+            delay = self._backoff_delay(attempt, response)
+            attempt += 1
+            self.stats['retries'] += 1
+            logger.warning(f"DeepSeek 请求失败（{error}），{delay:.2f}秒后第{attempt}次重试")
+            await asyncio.sleep(delay)
+    
+    async def generate_story(self, idiom: str, max_length: int = Config.MAX_STORY_LENGTH) -> str:
+        """生成单个成语故事"""
+        story = await self.chat(
+            [{'role': 'user', 'content': STORY_PROMPT.format(idiom=idiom, max_length=max_length)}],
+            temperature=0.8, max_tokens=1000, top_p=0.9,
+            frequency_penalty=0.1, presence_penalty=0.1
+        )
+        if not story:
+            raise DeepSeekAPIError(f"成语 {idiom} 返回空故事")
+        return story
+    
+    async def generate_stories(self, idioms: Iterable[str],
+                               return_exceptions: bool = True) -> Dict[str, Union[str, Exception]]:
+        """并发生成多个故事，并发度由 max_concurrency 和令牌桶共同约束
+        
+        return_exceptions=True 时单个失败不影响其他成语，失败项的值为异常对象。
+        """
+        idioms = list(dict.fromkeys(idioms))
+        results = await asyncio.gather(*(self.generate_story(idiom) for idiom in idioms),
+                                       return_exceptions=return_exceptions)
+        return dict(zip(idioms, results))
+
+class DeepSeekStoryClient:
+    """同步外观：在后台线程的事件循环上运行 AsyncDeepSeekClient
+    
+    多个工作线程共享同一个连接池、并发上限和限速器，接口与 DeepSeekStoryGenerator.generate_story 一致。
+    """
+    
+    def __init__(self, **client_kwargs):
+        self._client_kwargs = client_kwargs
+        self._client = None
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def _run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._client = AsyncDeepSeekClient(**self._client_kwargs)
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="deepseek-loop", daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+    
+    @property
+    def stats(self) -> Dict:
+        return dict(self._client.stats) if self._client else {'requests': 0, 'retries': 0, 'failures': 0}
+    
+    def generate_story(self, idiom: str) -> str:
+        return self._run(self._client_call('generate_story', idiom))
+    
+    def generate_stories(self, idioms: Iterable[str]) -> Dict[str, Union[str, Exception]]:
+        return self._run(self._client_call('generate_stories', list(idioms)))
+    
+    async def _client_call(self, method: str, *args):
+        return await getattr(self._client, method)(*args)
+    
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._client = self._loop = self._thread = None
+
+# 全局客户端实例（首次调用时才启动事件循环）
+deepseek_client = DeepSeekStoryClient()
@@ -0,0 +1,655 @@
+"""
+FFmpeg视频合成器 - 单次ffmpeg调用生成幻灯片视频，绕过MoviePy逐帧渲染
+
+每张图片只用PIL缩放/填充一次，通过concat分离器按各自时长循环静帧，
+音频直接混流（内存音轨经stdin传入），x264使用 tune=stillimage。
+
+chunked 模式下每个场景（或每N秒）独立编码为以关键帧开头的片段，多个ffmpeg进程并行，
+再用concat分离器 -c copy 拼接并一次性混入音频。片段按 图片哈希+帧数+转场+编码参数 缓存，
+重新导出时只编码发生变化的场景。
+
+start_stream 以流式方式输出分片MP4（frag_keyframe+empty_moov）或HLS事件播放列表，
+编码过程中已写出的片段即可播放，StreamingRender.poll() 返回当前进度供界面轮询。
+
+create_renditions 只解码/拼接一次场景时间线，经 split 滤镜分出多路，
+各自缩放、填充或裁剪到不同画幅与码率，在同一个ffmpeg进程中输出多个文件。
+"""
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from loguru import logger
+
+from config import Config
+from workspace_manager import Workspace, atomic_copy, atomic_move, workspace_manager
+
+# 画幅名称 -> (宽, 高, 码率, 适配方式)；pad 为等比缩放后填充黑边，crop 为铺满后居中裁剪
+RENDITIONS = {
+    "9x16": (1080, 1920, "5000k", "pad"),
+    "16x9": (1280, 720, "2500k", "pad"),
+    "1x1": (1080, 1080, "3500k", "pad"),
+}
+
+def get_ffmpeg_binary() -> str:
+    """ffmpeg可执行文件：Config.FFMPEG_BINARY > PATH > imageio-ffmpeg自带"""
+    if Config.FFMPEG_BINARY:
+        return Config.FFMPEG_BINARY
+    binary = shutil.which("ffmpeg")
+    if binary:
+        return binary
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        raise RuntimeError("未找到ffmpeg，请安装ffmpeg或设置 FFMPEG_BINARY")
+
+def probe_duration(path: str) -> float:
+    """读取媒体文件时长（秒）"""
+    result = subprocess.run([get_ffmpeg_binary(), "-hide_banner", "-i", str(path)],
+                            capture_output=True, text=True, errors="replace")
+    match = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        raise RuntimeError(f"无法读取时长: {path}")
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def scene_durations(audio, count: int, audio_duration: float) -> List[float]:
+    """各场景时长：AudioTrack 按其段落时间表在句子边界切分，音频文件按时长均分"""
+    if hasattr(audio, 'scene_durations'):
+        return audio.scene_durations(count)
+    return [audio_duration / count] * count
+
+def fit_image(image, width: int, height: int, background: Tuple[int, int, int] = (0, 0, 0)):
+    """等比缩放到画布内并居中填充"""
+    from PIL import Image
+    
+    if not hasattr(image, 'convert'):
+        image = Image.fromarray(image)
+    image = image.convert("RGB")
+    
+    scale = min(width / image.width, height / image.height)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+    if size == (width, height):
+        return image
+    
+    canvas = Image.new("RGB", (width, height), background)
+    canvas.paste(image, ((width - size[0]) // 2, (height - size[1]) // 2))
+    return canvas
+
+class SegmentCache:
+    """已编码片段缓存，按最近使用时间淘汰
+    
+    命中的片段硬链接（跨文件系统时复制）到调用方的工作区再交给 concat：
+    其他任务写入缓存触发淘汰时只删除缓存中的目录项，进行中的拼接不受影响。
+    """
+    
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    @staticmethod
+    def key(image_digest: str, frames: int, transition: str, profile: str) -> str:
+        payload = f"{image_digest}|{frames}|{transition}|{profile}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str, dest: Path) -> Optional[Path]:
+        """命中时把片段放到 dest 并返回 dest，未命中（或刚被淘汰）返回None"""
+        path = self.cache_dir / f"{key}.mp4"
+        try:
+            os.utime(path)  # 更新最近使用时间
+            try:
+                os.link(path, dest)
+            except OSError as e:
+                if isinstance(e, FileNotFoundError):
+                    raise
+                shutil.copyfile(path, dest)
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return dest
+    
+    def put(self, key: str, segment_path: Path) -> Path:
+        """把编码好的片段复制进缓存（原子替换），调用方继续使用自己工作区中的 segment_path"""
+        atomic_copy(segment_path, self.cache_dir / f"{key}.mp4")
+        self._evict()
+        return segment_path
+    
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".mp4") and not entry.name.startswith("."):  # 跳过写入中的临时文件
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+class StreamingRender:
+    """进行中的流式编码任务，ffmpeg在后台进程中运行"""
+    
+    def __init__(self, process: subprocess.Popen, path: Path, fmt: str, duration: float,
+                 workspace: Workspace, progress_path: Path, audio_data: Optional[bytes] = None):
+        self.process = process
+        self.path = Path(path)
+        self.format = fmt
+        self.duration = duration
+        self.workspace = workspace
+        self.progress_path = progress_path
+        self.error = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._feed, args=(audio_data,), name="stream-feed", daemon=True)
+        self._thread.start()
+    
+    def _feed(self, audio_data: Optional[bytes]):
+        """写入音频后等待进程结束（stderr在此读取，避免管道写满阻塞ffmpeg）"""
+        try:
+            if audio_data is not None:
+                try:
+                    self.process.stdin.write(audio_data)
+                except BrokenPipeError:
+                    pass
+                finally:
+                    self.process.stdin.close()
+            stderr = self.process.stderr.read()
+            if self.process.wait() != 0:
+                self.error = f"ffmpeg失败: {stderr.decode('utf-8', 'replace')[-500:]}"
+                logger.error(self.error)
+        finally:
+            self.workspace.close(failed=self.error is not None)
+            self._done.set()
+    
+    def encoded_seconds(self) -> float:
+        """已编码时长，读取 -progress 输出中最后的 out_time_us"""
+        try:
+            text = self.progress_path.read_text(encoding="utf-8", errors="replace")
+        except OSError:
+            return 0.0
+        values = re.findall(r"out_time_us=(\d+)", text)
+        return int(values[-1]) / 1e6 if values else 0.0
+    
+    def segments(self) -> List[Tuple[str, float]]:
+        """HLS播放列表中已完成的片段 [(文件名, 时长)]"""
+        if self.format != "hls" or not self.path.exists():
+            return []
+        segments = []
+        duration = None
+        for line in self.path.read_text(encoding="utf-8", errors="replace").splitlines():
+            if line.startswith("#EXTINF:"):
+                duration = float(line[8:].split(",")[0])
+            elif line and not line.startswith("#") and duration is not None:
+                segments.append((line, duration))
+                duration = None
+        return segments
+    
+    def poll(self) -> Dict:
+        """当前状态：encoding/ready/failed，可播放时长与已编码进度"""
+        done = self._done.is_set()
+        status = ("failed" if self.error else "ready") if done else "encoding"
+        segments = self.segments()
+        if self.format == "hls":
+            playable = sum(duration for _, duration in segments)
+        else:
+            playable = self.duration if status == "ready" else self.encoded_seconds()
+        return {
+            'status': status,
+            'format': self.format,
+            'path': str(self.path),
+            'duration': self.duration,
+            'playable_seconds': round(min(playable, self.duration), 2),
+            'segments': len(segments),
+            'error': self.error
+        }
+    
+    def wait(self, timeout: Optional[float] = None) -> Optional[str]:
+        """等待编码结束，成功时返回输出路径"""
+        if not self._done.wait(timeout):
+            raise TimeoutError("流式编码未在限定时间内完成")
+        return None if self.error else str(self.path)
+    
+    def to_mp4(self, output_path: Path) -> str:
+        """编码完成后得到单个MP4：分片MP4直接使用，HLS流拷贝合并"""
+        if self.format != "hls":
+            return str(self.path)
+        args = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+                "-i", str(self.path), "-c", "copy", "-movflags", "+faststart", str(output_path)]
+        FFmpegVideoComposer._run(args)
+        return str(output_path)
+
+class FFmpegVideoComposer:
+    """FFmpeg视频合成器"""
+    
+    streaming_supported = True
+    
+    def __init__(self, width: int = None, height: int = None, fps: int = None,
+                 bitrate: str = None, preset: str = None, output_dir: Path = None,
+                 mode: str = None, workers: int = None, chunk_seconds: float = None,
+                 segment_cache: Union[SegmentCache, bool, None] = None, captions: Optional[bool] = None):
+        self.width = width or Config.VIDEO_WIDTH
+        self.height = height or Config.VIDEO_HEIGHT
+        self.fps = fps or Config.VIDEO_FPS
+        self.bitrate = bitrate or Config.VIDEO_BITRATE
+        self.preset = preset or Config.VIDEO_PRESET
+        self.output_dir = Path(output_dir or Config.OUTPUT_DIR)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        
+        self.mode = mode or Config.VIDEO_ENCODE_MODE
+        self.workers = workers or Config.VIDEO_ENCODE_WORKERS or os.cpu_count() or 1
+        self.chunk_seconds = Config.VIDEO_CHUNK_SECONDS if chunk_seconds is None else chunk_seconds
+        # None 按配置使用默认缓存，False 表示不缓存片段
+        if segment_cache is None and Config.VIDEO_SEGMENT_CACHE:
+            segment_cache = SegmentCache(Config.CACHE_DIR / "segments", Config.VIDEO_SEGMENT_CACHE_BYTES)
+        self.segment_cache = segment_cache or None
+        self.captions = Config.VIDEO_CAPTIONS if captions is None else captions
+    
+    def create_video(self, images: List, audio, idiom: str, durations: Optional[Sequence[float]] = None,
+                     output_path: Optional[str] = None, mode: Optional[str] = None,
+                     captions=None) -> Optional[str]:
+        """创建视频
+        
+        audio 为音频文件路径或 AudioTrack；durations 为每张图片的显示时长，
+        缺省时 AudioTrack 按段落时间表在句子边界切分，音频文件按时长平均分配。
+        mode: single（单次编码）或 chunked（分片并行编码后无损拼接），缺省使用实例配置。
+        captions: 字幕列表 [(开始秒, 结束秒, 文本)]，True 表示由音轨时间表生成，缺省使用实例配置。
+        """
+        mode = mode or self.mode
+        if mode not in ("single", "chunked"):
+            raise ValueError(f"未知的编码模式: {mode}")
+        if not images:
+            logger.error("没有可用的图片")
+            return None
+        
+        output_path = Path(output_path or self.output_dir / f"{idiom}_story.mp4")
+        workspace = workspace_manager.create(f"video_{idiom}")
+        work_dir = workspace.path
+        start_time = time.perf_counter()
+        
+        try:
+            audio_args, audio_data, audio_duration = self._audio_input(audio)
+            durations = list(durations) if durations else scene_durations(audio, len(images), audio_duration)
+            logger.info(f"音频时长: {audio_duration:.2f}秒, 各图片时长: {[round(d, 2) for d in durations]}")
+            
+            # 每张图片只缩放/填充一次
+            frames = [fit_image(image, self.width, self.height) for image in images]
+            frames, durations = self._apply_captions(frames, durations, audio, captions)
+            
+            if mode == "chunked":
+                segment_paths = self._encode_segments(frames, durations, work_dir)
+                concat_list = self._write_segment_list(segment_paths, work_dir)
+                args = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+                        "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+                args += audio_args
+                args += ["-map", "0:v", "-map", "1:a", "-c:v", "copy"]
+            else:
+                frame_paths = [self._write_frame(frame, work_dir / f"scene_{i:03d}.png") for i, frame in enumerate(frames)]
+                concat_list = self._write_concat_list(frame_paths, durations, work_dir)
+                args = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+                        "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+                args += audio_args
+                # 先转换像素格式再补帧：每张图片只转换一次，重复帧直接复用
+                args += ["-map", "0:v", "-map", "1:a",
+                         "-vf", f"format=yuv420p,fps={self.fps}"]
+                args += self._video_codec_args()
+            
+            # 先写入工作区，完成后原子替换，并发任务不会读到或覆盖半个文件
+            encoded_path = work_dir / "output.mp4"
+            args += ["-c:a", "aac", "-b:a", "128k",
+                     "-t", f"{sum(durations):.3f}",
+                     "-movflags", "+faststart", str(encoded_path)]
+            self._run(args, audio_data)
+            atomic_move(encoded_path, output_path)
+            
+            logger.info(f"视频创建成功: {output_path}（{mode}，{time.perf_counter() - start_time:.2f}秒）")
+            return str(output_path)
+        
+        except Exception as e:
+            logger.error(f"创建视频失败: {e}")
+            workspace.close(failed=True)
+            return None
+        finally:
+            workspace.close()
+    
+    def start_stream(self, images: List, audio, idiom: str, fmt: Optional[str] = None,
+                     durations: Optional[Sequence[float]] = None, output_dir: Optional[Path] = None) -> StreamingRender:
+        """启动流式编码并立即返回
+        
+        fmt: fmp4（单个分片MP4文件，边写边可播放）或 hls（event 播放列表 + fMP4分片）。
+        关键帧按分片时长强制插入，每个分片/片段都可以独立解码。
+        """
+        fmt = fmt or Config.VIDEO_STREAM_FORMAT
+        if fmt not in ("fmp4", "hls"):
+            raise ValueError(f"未知的流式格式: {fmt}")
+        if not images:
+            raise ValueError("没有可用的图片")
+        
+        stream_dir = Path(output_dir or self.output_dir / "stream" / idiom)
+        stream_dir.mkdir(parents=True, exist_ok=True)
+        workspace = workspace_manager.create(f"stream_{idiom}")
+        work_dir = workspace.path
+        
+        try:
+            audio_args, audio_data, audio_duration = self._audio_input(audio)
+            durations = list(durations) if durations else scene_durations(audio, len(images), audio_duration)
+            frames = [fit_image(image, self.width, self.height) for image in images]
+            frames, durations = self._apply_captions(frames, durations, audio, None)
+            frame_paths = [self._write_frame(frame, work_dir / f"scene_{i:03d}.png") for i, frame in enumerate(frames)]
+            concat_list = self._write_concat_list(frame_paths, durations, work_dir)
+        except Exception:
+            workspace.close(failed=True)
+            raise
+        
+        segment_seconds = Config.VIDEO_STREAM_SEGMENT_SECONDS
+        progress_path = work_dir / "progress.txt"
+        args = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y", "-nostats",
+                "-progress", str(progress_path),
+                "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+        args += audio_args
+        args += ["-map", "0:v", "-map", "1:a", "-vf", f"format=yuv420p,fps={self.fps}"]
+        args += self._video_codec_args()
+        args += ["-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})",
+                 "-c:a", "aac", "-b:a", "128k", "-t", f"{sum(durations):.3f}"]
+        
+        if fmt == "hls":
+            path = stream_dir / "index.m3u8"
+            args += ["-f", "hls", "-hls_time", str(segment_seconds), "-hls_playlist_type", "event",
+                     "-hls_segment_type", "fmp4", "-hls_flags", "independent_segments",
+                     "-hls_fmp4_init_filename", "init.mp4",
+                     "-hls_segment_filename", str(stream_dir / "segment_%04d.m4s"), str(path)]
+        else:
+            path = stream_dir / f"{idiom}_stream.mp4"
+            args += ["-movflags", "frag_keyframe+empty_moov+default_base_moof", str(path)]
+        
+        process = subprocess.Popen(args, stdin=subprocess.PIPE if audio_data is not None else subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        logger.info(f"流式编码已启动: {path}（{fmt}，{sum(durations):.2f}秒）")
+        return StreamingRender(process, path, fmt, sum(durations), workspace, progress_path, audio_data)
+    
+    def create_renditions(self, images: List, audio, idiom: str, names: Sequence[str],
+                          durations: Optional[Sequence[float]] = None,
+                          output_dir: Optional[Path] = None) -> Dict[str, Optional[str]]:
+        """单个ffmpeg进程同时输出多个画幅，返回 {画幅名称: 文件路径}
+        
+        names 取 RENDITIONS 中的名称，"final" 表示本合成器自身的分辨率与码率；output_dir 缺省为实例输出目录。
+        场景图只按统一的母版尺寸处理一次，时间线只解码一次，split 后各路先缩放再补帧。
+        烧录字幕时字幕须在各路补边/缩放之后叠加（否则会落在黑边里且大小不对），
+        此时各路按自身尺寸适配并合成字幕，作为同一进程的独立输入。
+        """
+        if not images:
+            logger.error("没有可用的图片")
+            return {name: None for name in names}
+        
+        specs = {name: self._rendition_spec(name) for name in names}
+        output_dir = Path(output_dir or self.output_dir)
+        outputs = {name: output_dir / (f"{idiom}_story.mp4" if name == "final" else f"{idiom}_{name}.mp4")
+                   for name in names}
+        workspace = workspace_manager.create(f"renditions_{idiom}")
+        work_dir = workspace.path
+        start_time = time.perf_counter()
+        
+        try:
+            audio_args, audio_data, audio_duration = self._audio_input(audio)
+            durations = list(durations) if durations else scene_durations(audio, len(images), audio_duration)
+            
+            # 母版为正方形，边长取最大原图边长，避免任一画幅二次放大丢失细节
+            master_size = max(max(image.shape[:2] if hasattr(image, 'shape') else image.size) for image in images)
+            masters = [fit_image(image, master_size, master_size) for image in images]
+            cues = self._caption_cues(audio, None)
+            
+            args = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y"]
+            branches = []
+            if cues:
+                from caption_renderer import CaptionRenderer
+                for i, (width, height, _, fit) in enumerate(specs.values()):
+                    rendition_dir = work_dir / f"rendition_{i}"
+                    rendition_dir.mkdir()
+                    frames = [self._fit_rendition(master, width, height, fit) for master in masters]
+                    frames, frame_durations = CaptionRenderer(width, height).apply(frames, durations, cues)
+                    frame_paths = [self._write_frame(frame, rendition_dir / f"scene_{j:03d}.png")
+                                   for j, frame in enumerate(frames)]
+                    concat_list = self._write_concat_list(frame_paths, frame_durations, rendition_dir)
+                    args += ["-f", "concat", "-safe", "0", "-i", str(concat_list)]
+                    branches.append(f"[{i}:v]setsar=1,format=yuv420p,fps={self.fps}[v{i}]")
+                audio_index = len(specs)
+            else:
+                frame_paths = [self._write_frame(master, work_dir / f"scene_{i:03d}.png")
+                               for i, master in enumerate(masters)]
+                concat_list = self._write_concat_list(frame_paths, durations, work_dir)
+                args += ["-f", "concat", "-safe", "0", "-i", str(concat_list)]
+                
+                labels = [f"s{i}" for i in range(len(specs))]
+                branches.append(f"[0:v]split={len(specs)}" + "".join(f"[{label}]" for label in labels))
+                for i, (label, (width, height, _, fit)) in enumerate(zip(labels, specs.values())):
+                    if fit == "crop":
+                        geometry = (f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+                                    f"crop={width}:{height}")
+                    else:
+                        geometry = (f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                                    f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2")
+                    # 缩放在补帧之前：每张图片每路只缩放一次
+                    branches.append(f"[{label}]{geometry},setsar=1,format=yuv420p,fps={self.fps}[v{i}]")
+                audio_index = 1
+            
+            args += audio_args
+            args += ["-filter_complex", ";".join(branches)]
+            for i, (name, (_, _, bitrate, _)) in enumerate(specs.items()):
+                args += ["-map", f"[v{i}]", "-map", f"{audio_index}:a"]
+                args += ["-c:v", "libx264", "-preset", self.preset, "-tune", "stillimage",
+                         "-b:v", bitrate, "-r", str(self.fps)]
+                args += ["-c:a", "aac", "-b:a", "128k", "-t", f"{sum(durations):.3f}",
+                         "-movflags", "+faststart", str(work_dir / f"output_{name}.mp4")]
+            self._run(args, audio_data)
+            for name, path in outputs.items():
+                atomic_move(work_dir / f"output_{name}.mp4", path)
+            
+            logger.info(f"多画幅视频创建成功: {', '.join(specs)}（{time.perf_counter() - start_time:.2f}秒）")
+            return {name: str(path) for name, path in outputs.items()}
+        
+        except Exception as e:
+            logger.error(f"创建多画幅视频失败: {e}")
+            workspace.close(failed=True)
+            return {name: None for name in names}
+        finally:
+            workspace.close()
+    
+    def _apply_captions(self, frames: List, durations: Sequence[float], audio, captions) -> Tuple[List, List[float]]:
+        """在静帧时间线上叠加字幕，每种 (场景, 字幕) 组合只合成一次"""
+        cues = self._caption_cues(audio, captions)
+        if not cues:
+            return frames, list(durations)
+        from caption_renderer import CaptionRenderer
+        width, height = frames[0].size
+        return CaptionRenderer(width, height).apply(frames, durations, cues)
+    
+    @staticmethod
+    def _fit_rendition(image, width: int, height: int, fit: str):
+        """按画幅的适配方式把母版缩放到输出尺寸（与 split 路径中的 scale/pad/crop 一致）"""
+        if fit == "crop":
+            from PIL import Image, ImageOps
+            return ImageOps.fit(image, (width, height), Image.LANCZOS)
+        return fit_image(image, width, height)
+    
+    def _caption_cues(self, audio, captions) -> list:
+        captions = self.captions if captions is None else captions
+        if captions is True:
+            if not hasattr(audio, 'timing_manifest'):
+                logger.warning("音频文件没有段落时间表，跳过字幕")
+                return []
+            from caption_renderer import caption_cues
+            return caption_cues(audio)
+        return list(captions or [])
+    
+    def _rendition_spec(self, name: str) -> Tuple[int, int, str, str]:
+        if name == "final":
+            return self.width, self.height, self.bitrate, "pad"
+        if name not in RENDITIONS:
+            raise ValueError(f"未知的画幅: {name}")
+        return RENDITIONS[name]
+    
+    def _profile(self) -> str:
+        """编码参数摘要，参数变化时缓存的片段失效"""
+        return "|".join([f"{self.width}x{self.height}", str(self.fps)] + self._video_codec_args())
+    
+    def _video_codec_args(self, tune: Optional[str] = "stillimage") -> List[str]:
+        args = ["-c:v", "libx264", "-preset", self.preset]
+        if tune:
+            args += ["-tune", tune]
+        return args + ["-b:v", self.bitrate, "-pix_fmt", "yuv420p", "-r", str(self.fps)]
+    
+    def _frame_counts(self, durations: Sequence[float]) -> List[int]:
+        """按累计时长取整到帧，避免逐段取整造成的累计漂移"""
+        counts = []
+        elapsed = 0.0
+        previous = 0
+        for duration in durations:
+            elapsed += duration
+            boundary = round(elapsed * self.fps)
+            counts.append(max(1, boundary - previous))
+            previous = max(boundary, previous + 1)
+        return counts
+    
+    def _plan_segments(self, durations: Sequence[float]) -> List[Tuple[int, int]]:
+        """分片计划 [(图片序号, 帧数)]；chunk_seconds>0 时长场景再按N秒切分"""
+        chunk_frames = round(self.chunk_seconds * self.fps) if self.chunk_seconds > 0 else 0
+        plan = []
+        for index, frames in enumerate(self._frame_counts(durations)):
+            while chunk_frames and frames > chunk_frames:
+                plan.append((index, chunk_frames))
+                frames -= chunk_frames
+            plan.append((index, frames))
+        return plan
+    
+    def _encode_segments(self, frames: List, durations: Sequence[float], work_dir: Path,
+                         transition: str = "none") -> List[Path]:
+        """编码各分片（命中缓存的直接复用），按时间顺序返回片段路径
+        
+        每个分片由独立的ffmpeg进程编码，线程只负责等待进程；键相同的分片只编码一次。
+        """
+        plan = self._plan_segments(durations)
+        cache = self.segment_cache
+        profile = self._profile()
+        digests = [hashlib.sha256(frame.tobytes()).hexdigest() for frame in frames]
+        
+        keys = []
+        segment_paths = {}
+        pending = {}
+        for index, frame_count in plan:
+            key = SegmentCache.key(digests[index], frame_count, transition, profile)
+            keys.append(key)
+            if key in segment_paths or key in pending:
+                continue
+            cached_path = cache.get(key, work_dir / f"cached_{key[:16]}.mp4") if cache else None
+            if cached_path:
+                segment_paths[key] = cached_path
+            else:
+                pending[key] = (index, frame_count)
+        
+        logger.info(f"共 {len(plan)} 个分片，复用 {len(segment_paths)}，需编码 {len(pending)}")
+        if pending:
+            # 只为需要编码的图片写出帧文件
+            frame_paths = {index: self._write_frame(frames[index], work_dir / f"scene_{index:03d}.png")
+                           for index in sorted({index for index, _ in pending.values()})}
+            workers = max(1, min(self.workers, len(pending)))
+            # 多个编码进程同时运行时限制每个进程的线程数，避免超额订阅
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            
+            def encode(item):
+                key, (index, frame_count) = item
+                segment_path = work_dir / f"segment_{key[:16]}.mp4"
+                self._encode_still_segment(frame_paths[index], frame_count, segment_path, threads)
+                return key, cache.put(key, segment_path) if cache else segment_path
+            
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode") as executor:
+                segment_paths.update(executor.map(encode, pending.items()))
+        
+        return [segment_paths[key] for key in keys]
+    
+    def _encode_still_segment(self, frame_path: Path, frames: int, segment_path: Path, threads: int = 0):
+        """把一张静帧编码为固定帧数的片段（以IDR帧开头，可直接流拷贝拼接）"""
+        # 图片只解码、转换一次，由loop滤镜复制出其余帧
+        args = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+                "-framerate", str(self.fps), "-i", str(frame_path),
+                "-vf", f"format=yuv420p,loop=loop={frames - 1}:size=1,setpts=N/({self.fps}*TB)",
+                "-frames:v", str(frames)]
+        args += self._video_codec_args()
+        args += ["-threads", str(threads), "-an", str(segment_path)]
+        self._run(args)
+    
+    @staticmethod
+    def _write_segment_list(segment_paths: List[Path], work_dir: Path) -> Path:
+        concat_list = work_dir / "segments.ffconcat"
+        lines = ["ffconcat version 1.0"] + [f"file '{path.as_posix()}'" for path in segment_paths]
+        concat_list.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return concat_list
+    
+    @staticmethod
+    def _write_frame(frame, frame_path: Path) -> Path:
+        """写为无损PNG（低压缩等级，写入更快）"""
+        frame.save(frame_path, compress_level=1)
+        return frame_path
+    
+    @staticmethod
+    def _write_concat_list(frame_paths: List[Path], durations: Sequence[float], work_dir: Path) -> Path:
+        """concat分离器列表；最后一张需重复一次，否则其时长会被忽略"""
+        lines = ["ffconcat version 1.0"]
+        for frame_path, duration in zip(frame_paths, durations):
+            lines.append(f"file '{frame_path.as_posix()}'")
+            lines.append(f"duration {duration:.6f}")
+        lines.append(f"file '{frame_paths[-1].as_posix()}'")
+        
+        concat_list = work_dir / "scenes.ffconcat"
+        concat_list.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        return concat_list
+    
+    @staticmethod
+    def _audio_input(audio) -> Tuple[List[str], Optional[bytes], float]:
+        """音频输入参数：AudioTrack 以原始PCM经stdin传入，文件直接读取"""
+        if hasattr(audio, 'samples') and hasattr(audio, 'sample_rate'):
+            args = ["-f", "s16le", "-ar", str(audio.sample_rate), "-ac", "1", "-i", "pipe:0"]
+            return args, audio.samples.tobytes(), audio.duration
+        return ["-i", str(audio)], None, probe_duration(audio)
+    
+    @staticmethod
+    def _run(args: List[str], stdin_data: Optional[bytes] = None):
+        result = subprocess.run(args, input=stdin_data, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg失败: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+
+def get_video_composer(backend: Optional[str] = None, transition: Optional[str] = None,
+                       captions: Optional[bool] = None):
+    """按名称获取视频合成器：ffmpeg（默认）或 moviepy；ffmpeg后端选择转场效果时使用转场合成器
+    
+    captions 为是否烧录字幕，缺省使用配置；moviepy 后端不支持字幕
+    """
+    backend = (backend or Config.VIDEO_BACKEND).lower()
+    transition = transition or Config.VIDEO_TRANSITION
+    if backend == "moviepy":
+        from fixed_video_composer import fixed_video_composer
+        return fixed_video_composer
+    if backend == "ffmpeg":
+        if transition != "none":
+            from transition_renderer import SmoothVideoComposer
+            return SmoothVideoComposer(transition=transition, captions=captions)
+        if captions is not None and captions != ffmpeg_video_composer.captions:
+            return FFmpegVideoComposer(captions=captions)
+        return ffmpeg_video_composer
+    raise ValueError(f"未知的视频合成后端: {backend}")
+
+# 创建全局实例
+ffmpeg_video_composer = FFmpegVideoComposer()
@@ -1,79 +1,285 @@
 """
 修复版音频生成器 - 解决网络连接问题
+
+TTS输出直接从内存解码为统一采样率的PCM，段落一次性拼接为 AudioTrack 交给视频阶段；
+只有需要存档时才编码为mp3。段落在句末切分，AudioTrack 记录每段的采样数和文本，
+视频阶段据此得到各句的起止时间，按句子边界切换场景。
 """
+import io
 import os
-import tempfile
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional, Sequence, Union
 import numpy as np
 from loguru import logger
 
+from config import Config
+from workspace_manager import atomic_path, workspace_manager
+
+# 所有段落统一转换到该采样率（单声道16位）
+CANONICAL_SAMPLE_RATE = 22050
+
+class AudioTrack:
+    """单声道16位PCM音轨，记录每个段落的采样数和文本"""
+    
+    def __init__(self, samples: np.ndarray, sample_rate: int = CANONICAL_SAMPLE_RATE,
+                 segment_lengths: Optional[List[int]] = None, segment_texts: Optional[List[str]] = None):
+        self.samples = np.ascontiguousarray(samples, dtype=np.int16)
+        self.sample_rate = sample_rate
+        self.segment_lengths = list(segment_lengths) if segment_lengths else [len(self.samples)]
+        self.segment_texts = list(segment_texts) if segment_texts else [""] * len(self.segment_lengths)
+    
+    @classmethod
+    def concatenate(cls, parts: Sequence[np.ndarray], sample_rate: int = CANONICAL_SAMPLE_RATE,
+                    texts: Optional[Sequence[str]] = None) -> "AudioTrack":
+        """预分配输出后一次性拷贝各段，避免反复拼接造成的二次方复制"""
+        lengths = [len(part) for part in parts]
+        samples = np.empty(sum(lengths), dtype=np.int16)
+        offset = 0
+        for part, length in zip(parts, lengths):
+            samples[offset:offset + length] = part
+            offset += length
+        return cls(samples, sample_rate, lengths, texts)
+    
+    def timing_manifest(self) -> List[Dict]:
+        """段落时间表：各段起止采样位置由合成时的采样数累加得到，无需重新测量"""
+        manifest = []
+        start = 0
+        for index, (length, text) in enumerate(zip(self.segment_lengths, self.segment_texts)):
+            manifest.append({
+                'index': index,
+                'text': text,
+                'start': start,
+                'end': start + length,
+                'start_seconds': start / self.sample_rate,
+                'end_seconds': (start + length) / self.sample_rate
+            })
+            start += length
+        return manifest
+    
+    def scene_durations(self, scene_count: int, scene_texts: Optional[Sequence[str]] = None) -> List[float]:
+        """按句子边界把音轨分给各场景，返回每个场景的时长（秒），总和等于音轨时长
+        
+        提供场景文本时，每个场景从其开头文字所在的句子开始；
+        无法定位时，在最接近均分点的句子边界切换；句子数少于场景数时退化为均分。
+        """
+        if scene_count <= 0:
+            return []
+        total = len(self.samples)
+        ends = list(np.cumsum(self.segment_lengths)[:-1]) if len(self.segment_lengths) > 1 else []
+        
+        cuts = self._anchor_cuts(scene_texts) if scene_texts and len(scene_texts) == scene_count else None
+        if cuts is None:
+            cuts = self._balanced_cuts(ends, total, scene_count)
+        
+        points = [0] + cuts + [total]
+        return [(points[i + 1] - points[i]) / self.sample_rate for i in range(scene_count)]
+    
+    def _anchor_cuts(self, scene_texts: Sequence[str]) -> Optional[List[int]]:
+        """按场景文本在故事中的位置定位切换点（各句起点），失败返回None"""
+        starts = [item['start'] for item in self.timing_manifest()]
+        char_ends = np.cumsum([len(text) for text in self.segment_texts])
+        full_text = "".join(self.segment_texts)
+        
+        cuts = []
+        search_from = 0
+        for scene_text in scene_texts[1:]:
+            probe = scene_text.strip()[:12]
+            position = full_text.find(probe, search_from) if probe else -1
+            if position < 0:
+                return None
+            index = int(np.searchsorted(char_ends, position, side='right'))
+            if index >= len(starts) or (cuts and starts[index] <= cuts[-1]) or starts[index] == 0:
+                return None
+            cuts.append(starts[index])
+            search_from = position + len(probe)
+        return cuts
+    
+    @staticmethod
+    def _balanced_cuts(ends: List[int], total: int, scene_count: int) -> List[int]:
+        """在最接近均分点的句子边界切换，保证每个场景至少一句"""
+        if len(ends) < scene_count - 1:
+            return [round(total * k / scene_count) for k in range(1, scene_count)]
+        
+        cuts = []
+        low = 0
+        for k in range(1, scene_count):
+            # 余下的场景每个至少要留一个边界
+            high = len(ends) - (scene_count - 1 - k)
+            target = total * k / scene_count
+            index = min(range(low, high), key=lambda i: abs(ends[i] - target))
+            cuts.append(int(ends[index]))
+            low = index + 1
+        return cuts
+    
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sample_rate
+    
+    @property
+    def segment_durations(self) -> List[float]:
+        return [length / self.sample_rate for length in self.segment_lengths]
+    
+    def to_float(self) -> np.ndarray:
+        """转换为 [-1, 1] 浮点数组，形状 (采样数, 1)，可直接用于 MoviePy AudioArrayClip"""
+        return (self.samples.astype(np.float32) / 32768.0).reshape(-1, 1)
+    
+    def to_wav_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(self.samples.tobytes())
+        return buffer.getvalue()
+    
+    def export(self, path: Union[str, Path], format: str = "mp3") -> str:
+        """编码并写出存档文件（先写临时文件再原子替换）"""
+        with atomic_path(path) as temp_path:
+            if format == "wav":
+                temp_path.write_bytes(self.to_wav_bytes())
+            else:
+                from pydub import AudioSegment
+                segment = AudioSegment(data=self.samples.tobytes(), sample_width=2,
+                                       frame_rate=self.sample_rate, channels=1)
+                segment.export(str(temp_path), format=format, parameters=["-ac", "1", "-ar", str(self.sample_rate)])
+        return str(path)
+
 class FixedAudioGenerator:
-    """修复版音频生成器"""
+    """修复版音频生成器
+    
+    各段落相互独立，使用线程池并行合成，总耗时约等于最慢的一段。
+    tts_backend(text) 返回编码后的音频字节（mp3/wav），失败返回None；默认使用gTTS。
+    """
     
-    def __init__(self):
+    def __init__(self, tts_backend: Optional[Callable[[str], Optional[bytes]]] = None,
+                 max_workers: Optional[int] = None, sample_rate: int = CANONICAL_SAMPLE_RATE):
         self.output_dir = Path("output_audio")
         self.output_dir.mkdir(exist_ok=True)
+        
+        # TTS参数（同时用于缓存指纹）
+        self.tts_engine = "gtts"
+        self.lang = "zh-cn"
+        self.slow = False
+        self.sample_rate = sample_rate
+        self.segment_chars = Config.TTS_SEGMENT_CHARS
+        
+        self.tts_backend = tts_backend or self._generate_with_gtts
+        self.max_workers = max_workers or Config.TTS_MAX_WORKERS
+        # SAPI/pyttsx3 引擎不是线程安全的，备用方案串行执行
+        self._fallback_lock = threading.Lock()
     
     def generate_story_audio(self, story_text: str, idiom: str) -> str:
-        """生成故事音频 - 修复版"""
+        """生成故事音频并导出mp3存档，返回文件路径"""
+        track = self.synthesize_track(story_text, idiom)
+        if track is None:
+            return None
+        return self.export_track(track, idiom)
+    
+    def synthesize_track(self, story_text: str, idiom: str) -> Optional[AudioTrack]:
+        """合成故事音轨（内存中的PCM），不写出任何音频文件"""
         try:
             logger.info("开始生成修复版音频...")
             
             # 分段处理长文本
-            segments = self._split_text(story_text)
+            segments = self._split_text(story_text, self.segment_chars)
             logger.info(f"成功分段，共 {len(segments)} 个段落")
             
-            audio_segments = []
+            # 每个任务独立的工作区，仅供需要落盘的备用引擎使用
+            with workspace_manager.create(f"tts_{idiom}") as workspace:
+                results = self._synthesize_segments(segments, workspace.path)
             
-            for i, segment in enumerate(segments):
-                logger.info(f"正在生成第 {i+1}/{len(segments)} 个音频段落...")
-                
-                # 尝试使用gTTS
-                audio_path = self._generate_with_gtts(segment, f"{idiom}_temp_{i}")
-                
-                if audio_path is None:
-                    # 使用备用方案
-                    logger.warning("gTTS生成失败，使用备用方案")
-                    audio_path = self._generate_fallback_audio(segment, f"{idiom}_temp_{i}")
-                
-                if audio_path:
-                    audio_segments.append(audio_path)
-                    logger.info(f"段落 {i+1} 音频生成完成")
-                else:
-                    logger.error(f"段落 {i+1} 音频生成失败")
-            
-            if not audio_segments:
+            # 失败的段落连同其文本一起跳过，时间表与音频保持一致
+            pairs = [(part, text) for part, text in zip(results, segments) if part is not None]
+            if not pairs:
                 logger.error("所有音频段落生成失败")
                 return None
             
-            # 合并音频
-            final_audio_path = self._merge_audio_segments(audio_segments, idiom)
-            
-            # 清理临时文件
-            for temp_path in audio_segments:
-                try:
-                    os.remove(temp_path)
-                except:
-                    pass
-            
-            return final_audio_path
-            
+            track = AudioTrack.concatenate([part for part, _ in pairs], self.sample_rate, [text for _, text in pairs])
+            logger.info(f"故事音频生成完成，时长 {track.duration:.2f}秒")
+            return track
+        
         except Exception as e:
             logger.error(f"音频生成失败: {e}")
             return None
     
+    def export_track(self, track: AudioTrack, idiom: str) -> str:
+        """导出mp3存档"""
+        final_path = self.output_dir / f"{idiom}_01.mp3"
+        return track.export(final_path)
+    
+    def _synthesize_segments(self, segments: List[str], job_dir: Path) -> List[Optional[np.ndarray]]:
+        """并行合成所有段落，结果按段落顺序返回，失败的段落为None"""
+        workers = max(1, min(self.max_workers, len(segments)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts") as executor:
+            return list(executor.map(lambda item: self._synthesize_segment(item[0], item[1], job_dir),
+                                     enumerate(segments)))
+    
+    def _synthesize_segment(self, index: int, segment: str, job_dir: Path) -> Optional[np.ndarray]:
+        """合成单个段落并解码为PCM，失败时对该段落单独使用备用方案"""
+        samples = None
+        try:
+            data = self.tts_backend(segment)
+            if data:
+                samples = self._decode_audio(data)
+        except Exception as e:
+            logger.warning(f"段落 {index+1} TTS异常: {e}")
+        
+        if samples is None:
+            logger.warning(f"段落 {index+1} 主TTS生成失败，使用备用方案")
+            with self._fallback_lock:
+                samples = self._generate_fallback_audio(segment, job_dir / f"segment_{index:03d}")
+        
+        if samples is not None:
+            logger.info(f"段落 {index+1} 音频生成完成")
+        else:
+            logger.error(f"段落 {index+1} 音频生成失败")
+        return samples
+    
+    def _decode_audio(self, data: bytes) -> np.ndarray:
+        """从内存解码音频，转换为单声道16位、统一采样率的PCM"""
+        if data[:4] == b'RIFF':
+            with wave.open(io.BytesIO(data), 'rb') as wav_file:
+                if wav_file.getsampwidth() == 2:
+                    channels = wav_file.getnchannels()
+                    rate = wav_file.getframerate()
+                    samples = np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+                    if channels > 1:
+                        samples = samples.reshape(-1, channels).mean(axis=1)
+                    return self._resample(samples, rate)
+        
+        # mp3 等压缩格式：pydub 通过管道交给ffmpeg解码，不产生临时文件
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(io.BytesIO(data))
+        audio = audio.set_channels(1).set_sample_width(2).set_frame_rate(self.sample_rate)
+        return np.frombuffer(audio.raw_data, dtype=np.int16)
+    
+    def _resample(self, samples: np.ndarray, rate: int) -> np.ndarray:
+        """线性插值重采样到统一采样率"""
+        if rate == self.sample_rate:
+            return samples.astype(np.int16, copy=False)
+        count = int(round(len(samples) * self.sample_rate / rate))
+        positions = np.linspace(0, len(samples) - 1, count) if count else np.empty(0)
+        resampled = np.interp(positions, np.arange(len(samples)), samples.astype(np.float32))
+        return np.clip(resampled, -32768, 32767).astype(np.int16)
+    
     def _split_text(self, text: str, max_length: int = 100) -> List[str]:
-        """分段文本"""
-        if len(text) <= max_length:
+        """分段文本，段落总在句末结束；max_length 为段落最少字数，0 表示逐句分段"""
+        if max_length and len(text) <= max_length:
             return [text]
         
         segments = []
         current_segment = ""
         
         for char in text:
+            # 句末的后引号归入上一段
+            if char in '”’」』）' and segments and not current_segment.strip():
+                segments[-1] += char
+                continue
             current_segment += char
-            if len(current_segment) >= max_length and char in '。！？':
+            if len(current_segment) >= max_length and char in '。！？' and current_segment.strip(' \n。！？'):
                 segments.append(current_segment.strip())
                 current_segment = ""
         
@@ -82,25 +288,22 @@ class FixedAudioGenerator:
         
         return segments
     
-    def _generate_with_gtts(self, text: str, filename: str) -> Optional[str]:
-        """使用gTTS生成音频"""
+    def _generate_with_gtts(self, text: str) -> Optional[bytes]:
+        """使用gTTS生成音频，直接写入内存"""
         try:
             from gtts import gTTS
             
-            # 创建临时文件
-            temp_path = f"temp_{filename}.mp3"
-            
-            # 生成音频
-            tts = gTTS(text=text, lang='zh-cn', slow=False)
-            tts.save(temp_path)
-            
-            return temp_path
+            buffer = io.BytesIO()
+            tts = gTTS(text=text, lang=self.lang, slow=self.slow)
+            tts.write_to_fp(buffer)
             
+            return buffer.getvalue()
+        
         except Exception as e:
             logger.warning(f"gTTS生成失败: {e}")
             return None
     
-    def _generate_fallback_audio(self, text: str, filename: str) -> str:
+    def _generate_fallback_audio(self, text: str, output_stem: Path) -> Optional[np.ndarray]:
         """备用音频生成方案 - 使用本地TTS或生成有声音的音频"""
         try:
             # 尝试使用Windows自带的SAPI (Speech API)
@@ -109,7 +312,7 @@ class FixedAudioGenerator:
                 speaker = win32com.client.Dispatch("SAPI.SpVoice")
                 
                 # 保存为WAV文件
-                temp_path = f"temp_{filename}.wav"
+                temp_path = f"{output_stem}.wav"
                 
                 # 使用Windows SAPI生成语音
                 # 需要先设置输出格式为WAV
@@ -123,8 +326,8 @@ class FixedAudioGenerator:
                 # 如果文件生成成功
                 if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
                     logger.info(f"使用Windows SAPI生成音频，时长: {len(text)*0.3:.1f}秒")
-                    return temp_path
-                    
+                    return self._decode_audio(Path(temp_path).read_bytes())
+            
             except ImportError:
                 logger.debug("win32com不可用，尝试其他方案")
             except Exception as e:
@@ -143,15 +346,15 @@ class FixedAudioGenerator:
                 engine.setProperty('volume', 0.8)  # 音量
                 
                 # 保存为WAV文件
-                temp_path = f"temp_{filename}.wav"
+                temp_path = f"{output_stem}.wav"
                 engine.save_to_file(text, temp_path)
                 engine.runAndWait()
                 
                 # 如果文件生成成功
                 if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
                     logger.info(f"使用pyttsx3生成音频，时长: {len(text)*0.3:.1f}秒")
-                    return temp_path
-                    
+                    return self._decode_audio(Path(temp_path).read_bytes())
+            
             except ImportError:
                 logger.debug("pyttsx3不可用，使用音频信号方案")
             except Exception as e:
@@ -159,7 +362,7 @@ class FixedAudioGenerator:
             
             # 备用方案：生成有声音的音频信号
             duration = len(text) * 0.3  # 每个字符0.3秒
-            sample_rate = 22050
+            sample_rate = self.sample_rate
             
             # 生成有声音的音频信号
             t = np.linspace(0, duration, int(duration * sample_rate))
@@ -185,84 +388,11 @@ class FixedAudioGenerator:
             # 归一化音频
             audio_signal = audio_signal / np.max(np.abs(audio_signal)) * 0.8
             
-            # 保存为WAV文件
-            temp_path = f"temp_{filename}.wav"
-            
-            # 使用scipy保存音频
-            try:
-                from scipy.io import wavfile
-                wavfile.write(temp_path, sample_rate, (audio_signal * 32767).astype(np.int16))
-            except ImportError:
-                # 如果没有scipy，创建简单的WAV文件
-                self._create_simple_wav(temp_path, audio_signal, sample_rate)
-            
             logger.info(f"使用备用音频方案，时长: {duration*1000:.0f}ms (文本长度: {len(text)}字)")
-            return temp_path
-            
-        except Exception as e:
-            logger.error(f"备用音频生成失败: {e}")
-            return None
-    
-    def _create_simple_wav(self, filename: str, data: np.ndarray, sample_rate: int):
-        """创建简单的WAV文件"""
-        import wave
-        import struct
-        
-        # 转换为16位整数
-        data = (data * 32767).astype(np.int16)
+            return (audio_signal * 32767).astype(np.int16)
         
-        with wave.open(filename, 'w') as wav_file:
-            wav_file.setnchannels(1)  # 单声道
-            wav_file.setsampwidth(2)  # 16位
-            wav_file.setframerate(sample_rate)
-            wav_file.writeframes(data.tobytes())
-    
-    def _merge_audio_segments(self, audio_paths: List[str], idiom: str) -> str:
-        """合并音频段落"""
-        try:
-            # 使用pydub合并音频
-            from pydub import AudioSegment
-            
-            combined = AudioSegment.empty()
-            
-            for audio_path in audio_paths:
-                if os.path.exists(audio_path):
-                    try:
-                        # 尝试不同的音频格式
-                        if audio_path.endswith('.wav'):
-                            audio = AudioSegment.from_wav(audio_path)
-                        elif audio_path.endswith('.mp3'):
-                            audio = AudioSegment.from_mp3(audio_path)
-                        else:
-                            audio = AudioSegment.from_file(audio_path)
-                        
-                        # 确保音频是单声道
-                        if audio.channels > 1:
-                            audio = audio.set_channels(1)
-                        
-                        # 设置采样率
-                        audio = audio.set_frame_rate(22050)
-                        
-                        combined += audio
-                        logger.info(f"成功合并音频段落: {audio_path}")
-                        
-                    except Exception as e:
-                        logger.warning(f"跳过音频段落 {audio_path}: {e}")
-                        continue
-            
-            if len(combined) == 0:
-                logger.error("没有可用的音频段落")
-                return None
-            
-            # 保存最终音频
-            final_path = self.output_dir / f"{idiom}_01.mp3"
-            combined.export(str(final_path), format="mp3", parameters=["-ac", "1", "-ar", "22050"])
-            
-            logger.info("故事音频生成完成")
-            return str(final_path)
-            
         except Exception as e:
-            logger.error(f"合并音频失败: {e}")
+            logger.error(f"备用音频生成失败: {e}")
             return None
 
 # 创建全局实例
@@ -7,6 +7,8 @@ from pathlib import Path
 from typing import List, Optional, Union
 from loguru import logger
 
+from workspace_manager import atomic_move, workspace_manager
+
 # 尝试导入MoviePy，处理版本兼容性
 try:
     from moviepy import VideoFileClip, AudioFileClip, ImageClip, concatenate_videoclips, CompositeVideoClip
@@ -19,6 +21,9 @@ except ImportError:
         MOVIEPY_AVAILABLE = False
         logger.error("MoviePy 未安装或导入失败")
 
+if MOVIEPY_AVAILABLE:
+    from moviepy.audio.AudioClip import AudioArrayClip
+
 class FixedVideoComposer:
     """修复版视频合成器"""
     
@@ -28,8 +33,14 @@ class FixedVideoComposer:
         self.output_dir = Path("output")
         self.output_dir.mkdir(exist_ok=True)
     
-    def create_video(self, images: List, audio_path: str, idiom: str) -> str:
-        """创建视频 - 修复版"""
+    def create_video(self, images: List, audio, idiom: str, durations: Optional[List[float]] = None,
+                     output_path: Optional[str] = None) -> str:
+        """创建视频 - 修复版
+        
+        audio 可以是音频文件路径，也可以是内存中的 AudioTrack（直接使用PCM，无需再解码mp3）。
+        AudioTrack 自带段落时间表，各图片时长按句子边界切分，总时长与音频一致，无需截取或循环音频。
+        临时音频与编码中的视频都写在任务独立的工作区，完成后原子替换到 output_path。
+        """
         if not MOVIEPY_AVAILABLE:
             logger.error("MoviePy 不可用，无法创建视频")
             return None
@@ -38,12 +49,19 @@ class FixedVideoComposer:
             logger.info("开始创建修复版视频...")
             
             # 加载音频
-            audio_clip = AudioFileClip(audio_path)
+            if hasattr(audio, 'to_float'):
+                audio_clip = AudioArrayClip(audio.to_float(), fps=audio.sample_rate)
+            else:
+                audio_clip = AudioFileClip(str(audio))
             audio_duration = float(audio_clip.duration)
             
             # 计算每张图片的显示时间
-            image_duration = audio_duration / len(images)
-            logger.info(f"音频时长: {audio_duration:.2f}秒, 每张图片: {image_duration:.2f}秒")
+            if not durations:
+                if hasattr(audio, 'scene_durations'):
+                    durations = audio.scene_durations(len(images))
+                else:
+                    durations = [audio_duration / len(images)] * len(images)
+            logger.info(f"音频时长: {audio_duration:.2f}秒, 各图片时长: {[round(d, 2) for d in durations]}")
             
             # 创建图片剪辑
             clips = []
@@ -57,7 +75,7 @@ class FixedVideoComposer:
                         img_array = np.array(image)
                     
                     # 创建图片剪辑
-                    clip = ImageClip(img_array, duration=image_duration)
+                    clip = ImageClip(img_array, duration=durations[i])
                     
                     # 尝试调整大小（兼容不同版本）
                     try:
@@ -92,19 +110,22 @@ class FixedVideoComposer:
                 return None
             
             # 导出视频
-            output_path = self.output_dir / f"{idiom}_story.mp4"
+            output_path = Path(output_path or self.output_dir / f"{idiom}_story.mp4")
             logger.info(f"开始导出视频到: {output_path}")
             
             # 使用兼容的参数
-            final_video.write_videofile(
-                str(output_path),
-                fps=self.fps,
-                codec='libx264',
-                audio_codec='aac',
-                bitrate=self.bitrate,
-                temp_audiofile='temp-audio.m4a',
-                remove_temp=True
-            )
+            with workspace_manager.create(f"moviepy_{idiom}") as workspace:
+                encoded_path = workspace.file("output.mp4")
+                final_video.write_videofile(
+                    str(encoded_path),
+                    fps=self.fps,
+                    codec='libx264',
+                    audio_codec='aac',
+                    bitrate=self.bitrate,
+                    temp_audiofile=str(workspace.file("temp-audio.m4a")),
+                    remove_temp=True
+                )
+                atomic_move(encoded_path, output_path)
             
             # 清理资源
             final_video.close()
@@ -0,0 +1,140 @@
+"""
+CPU 推理后端 - 把 Stable Diffusion 导出为 ONNX / OpenVINO 并在 CPU 上运行
+
+没有 GPU 的渲染节点上，float32 PyTorch 生成一张 512x512 需要数分钟。
+SD_BACKEND 为 onnx 或 openvino 时，首次使用从 SD_MODEL_PATH 导出文本编码器、UNet 与 VAE
+（借助 optimum），结果缓存在 SD_EXPORT_DIR 下按 模型@版本/后端 区分的目录中，之后直接加载；
+导出先写入同级临时目录再整体替换，中途失败不会留下半成品。
+推理线程数取 CPU_INFERENCE_THREADS（0 表示物理核数）；SD_INT8 开启时对权重做 int8 量化：
+ONNX 只量化文本编码器与 UNet 中的 MatMul/Gemm（VAE 保持浮点以免画面出现色块），
+OpenVINO 使用其 8 位权重压缩。
+"""
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from config import Config
+
+CPU_BACKENDS = ("onnx", "openvino")
+# int8 量化的子模型与算子
+QUANTIZED_PARTS = ("text_encoder", "unet")
+QUANTIZED_OPS = ["MatMul", "Gemm"]
+
+def cpu_threads() -> int:
+    """推理线程数：配置值，否则为物理核数（超线程对矩阵运算帮助有限）"""
+    if Config.CPU_INFERENCE_THREADS > 0:
+        return Config.CPU_INFERENCE_THREADS
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False)
+    except ImportError:
+        physical = None
+    return physical or os.cpu_count() or 1
+
+def backend_tag(backend: Optional[str] = None, int8: Optional[bool] = None) -> str:
+    """后端标识，量化后的输出与浮点不同，需要区分缓存"""
+    backend = backend or Config.SD_BACKEND
+    int8 = Config.SD_INT8 if int8 is None else int8
+    return f"{backend}-int8" if int8 and backend != "pytorch" else backend
+
+def export_dir(backend: str, model_path: Optional[str] = None, int8: Optional[bool] = None,
+               root: Optional[Path] = None) -> Path:
+    model_path = str(model_path or Config.SD_MODEL_PATH)
+    slug = re.sub(r"[^\w.-]+", "_", model_path.strip("/\\"))[-60:]
+    return Path(root or Config.SD_EXPORT_DIR) / f"{slug}@{Config.SD_MODEL_REVISION}" / backend_tag(backend, int8)
+
+def load_pipeline(backend: str, model_path: Optional[str] = None, int8: Optional[bool] = None,
+                  threads: Optional[int] = None, root: Optional[Path] = None):
+    """加载导出后的 CPU 管道，首次使用时先导出"""
+    if backend not in CPU_BACKENDS:
+        raise ValueError(f"不支持的CPU推理后端: {backend}")
+    model_path = str(model_path or Config.SD_MODEL_PATH)
+    int8 = Config.SD_INT8 if int8 is None else int8
+    threads = threads or cpu_threads()
+    target = export_dir(backend, model_path, int8, root)
+    
+    if not (target / "model_index.json").exists():
+        _export(backend, model_path, int8, target)
+    
+    logger.info(f"加载 {backend_tag(backend, int8)} 管道: {target}（{threads} 线程）")
+    if backend == "onnx":
+        return _load_onnx(target, threads)
+    return _load_openvino(target, threads)
+
+def _export(backend: str, model_path: str, int8: bool, target: Path):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{target.name}.", dir=target.parent))
+    logger.info(f"正在把 {model_path} 导出为 {backend_tag(backend, int8)}，首次导出需要数分钟...")
+    try:
+        if backend == "onnx":
+            from optimum.onnxruntime import ORTStableDiffusionPipeline
+            pipe = ORTStableDiffusionPipeline.from_pretrained(model_path, export=True, revision=Config.SD_MODEL_REVISION,
+                                                              cache_dir=Config.SD_CACHE_DIR)
+            pipe.save_pretrained(staging)
+            del pipe
+            if int8:
+                _quantize_onnx(staging)
+        else:
+            from optimum.intel import OVStableDiffusionPipeline
+            kwargs = {}
+            if int8:
+                from optimum.intel import OVWeightQuantizationConfig
+                kwargs['quantization_config'] = OVWeightQuantizationConfig(bits=8)
+            pipe = OVStableDiffusionPipeline.from_pretrained(model_path, export=True, compile=False,
+                                                             revision=Config.SD_MODEL_REVISION,
+                                                             cache_dir=Config.SD_CACHE_DIR, **kwargs)
+            pipe.save_pretrained(staging)
+            del pipe
+        
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+        logger.info(f"导出完成: {target}")
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def _quantize_onnx(directory: Path):
+    """动态 int8 权重量化，替换原模型文件（含外部权重文件）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    
+    for part in QUANTIZED_PARTS:
+        model = directory / part / "model.onnx"
+        if not model.exists():
+            continue
+        quantized = model.with_name("model.int8.onnx")
+        quantize_dynamic(str(model), str(quantized), weight_type=QuantType.QInt8, op_types_to_quantize=QUANTIZED_OPS)
+        for path in model.parent.iterdir():
+            if path != quantized and path.name.startswith("model.onnx"):
+                path.unlink()
+        os.replace(quantized, model)
+        logger.info(f"{part} 已量化为 int8")
+
+def _load_onnx(directory: Path, threads: int):
+    import onnxruntime as ort
+    from optimum.onnxruntime import ORTStableDiffusionPipeline
+    
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    # 子模型按顺序执行，算子间并行只会与算子内线程争抢核心
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return ORTStableDiffusionPipeline.from_pretrained(directory, provider="CPUExecutionProvider",
+                                                      session_options=options)
+
+def _load_openvino(directory: Path, threads: int):
+    from optimum.intel import OVStableDiffusionPipeline
+    
+    ov_config = {
+        "INFERENCE_NUM_THREADS": str(threads),
+        "PERFORMANCE_HINT": "LATENCY",
+        # 编译后的模型缓存，之后启动跳过编译
+        "CACHE_DIR": str(directory / "ov_cache")
+    }
+    pipe = OVStableDiffusionPipeline.from_pretrained(directory, compile=False, ov_config=ov_config)
+    pipe.compile()
+    return pipe
@@ -0,0 +1,253 @@
+"""
+图像生成器 - Stable Diffusion 按批生成故事插画
+
+generate_story_images 把多个场景拼成一批送入管道，每一项有独立的种子与负面提示词，
+文本编码器与 UNet 每个去噪步骤只为整批启动一次。
+批大小取 Config.BATCH_SIZE 与 PerformanceMonitor 报告的可用显存/内存所能容纳的较小值，
+显存不足（OOM）时减半重试并记住该上限；结果按场景顺序返回，每张图片完成后回调进度。
+文本嵌入取自 prompt_embedding_cache，管道直接接收 prompt_embeds，重复的提示词不再经过文本编码器。
+"""
+import hashlib
+import random
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+import torch
+from loguru import logger
+
+from config import Config
+from prompt_embedding_cache import PromptEmbeddingCache, prompt_embedding_cache
+from utils import PerformanceMonitor
+
+# 儿童插画风格
+STYLE_PROMPT = ("children's book illustration, cartoon style, bright colors, soft lighting, "
+                "cute characters, detailed background, high quality")
+NEGATIVE_PROMPT = "realistic, adult, scary, dark, violent, low quality, blurry, distorted"
+
+# 512x512、开启CFG时批内每张图片的预估占用（MB），按分辨率等比缩放
+BATCH_ITEM_MB = {"cuda": 900, "cpu": 1800}
+# 只使用可用内存的这一比例，给模型权重之外的临时张量留余量
+MEMORY_HEADROOM = 0.8
+
+SCHEDULERS = {
+    "ddim": "DDIMScheduler",
+    "euler": "EulerDiscreteScheduler",
+    "euler_a": "EulerAncestralDiscreteScheduler",
+    "dpm++": "DPMSolverMultistepScheduler",
+    "pndm": "PNDMScheduler",
+}
+
+# 注册表中的图像模型名称
+IMAGE_MODEL = "stable_diffusion"
+
+ProgressCallback = Callable[[int, Optional[object]], None]
+
+def is_out_of_memory(error: BaseException) -> bool:
+    if isinstance(error, MemoryError):
+        return True
+    oom_error = getattr(torch.cuda, "OutOfMemoryError", None)
+    if oom_error is not None and isinstance(error, oom_error):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+class ImageGenerator:
+    """Stable Diffusion 插画生成器
+    
+    pipe 可直接传入已构建的管道（测试与基准使用），否则按 Config 加载 SD_MODEL_PATH。
+    embedding_cache 为 False 时不使用嵌入缓存，把提示词原样交给管道编码。
+    backend 为 onnx / openvino 时加载 image_backends 导出的 CPU 管道（默认取 Config.SD_BACKEND）。
+    """
+    
+    def __init__(self, model_path: Optional[str] = None, device: Optional[str] = None, pipe=None,
+                 batch_size: Optional[int] = None, steps: Optional[int] = None, guidance: Optional[float] = None,
+                 width: Optional[int] = None, height: Optional[int] = None, embedding_cache=None,
+                 model_key: Optional[str] = None, backend: Optional[str] = None):
+        self.model_path = model_path or Config.SD_MODEL_PATH
+        self.backend = backend or Config.SD_BACKEND
+        if self.backend != "pytorch":
+            # ONNX Runtime / OpenVINO 后端只在 CPU 上运行
+            device = "cpu"
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = max(1, batch_size or Config.BATCH_SIZE)
+        self.steps = steps or Config.INFERENCE_STEPS
+        self.guidance = Config.GUIDANCE_SCALE if guidance is None else guidance
+        self.width = width or Config.IMAGE_WIDTH
+        self.height = height or Config.IMAGE_HEIGHT
+        # OOM 后学到的批大小上限
+        self._oom_limit = None
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'images': 0, 'oom_retries': 0}
+        self.pipe = pipe if pipe is not None else self._load_pipeline()
+        if embedding_cache is False:
+            self.embedding_cache = None
+        else:
+            self.embedding_cache = prompt_embedding_cache if embedding_cache is None else embedding_cache
+        self.model_key = model_key or PromptEmbeddingCache.model_key(self.pipe, self.model_path, self.backend)
+    
+    def _load_pipeline(self):
+        if self.backend != "pytorch":
+            from image_backends import load_pipeline
+            return self._apply_scheduler(load_pipeline(self.backend, self.model_path))
+        
+        from diffusers import StableDiffusionPipeline
+        
+        use_fp16 = self.device == "cuda" and Config.USE_FLOAT16_FOR_RTX
+        logger.info(f"正在加载 Stable Diffusion: {self.model_path}（{self.device}，{'fp16' if use_fp16 else 'fp32'}）")
+        pipe = StableDiffusionPipeline.from_pretrained(
+            self.model_path,
+            torch_dtype=torch.float16 if use_fp16 else torch.float32,
+            revision=Config.SD_MODEL_REVISION,
+            cache_dir=Config.SD_CACHE_DIR,
+            safety_checker=None,
+            requires_safety_checker=False
+        )
+        
+        pipe = self._apply_scheduler(pipe)
+        
+        if self.device == "cuda":
+            if Config.ENABLE_RTX_OPTIMIZATION:
+                torch.cuda.set_per_process_memory_fraction(Config.RTX_MEMORY_FRACTION)
+            # 整模型卸载在批内共享一次搬运；逐层卸载会让批处理退化为逐张的开销，不使用
+            if Config.ENABLE_CPU_OFFLOAD:
+                pipe.enable_model_cpu_offload()
+            else:
+                pipe = pipe.to("cuda")
+        else:
+            from image_backends import cpu_threads
+            torch.set_num_threads(cpu_threads())
+            pipe = pipe.to("cpu")
+        
+        if Config.ENABLE_MEMORY_EFFICIENT_ATTENTION:
+            try:
+                pipe.enable_xformers_memory_efficient_attention()
+            except Exception:
+                pipe.enable_attention_slicing()
+        return pipe
+    
+    @staticmethod
+    def _apply_scheduler(pipe):
+        scheduler_name = SCHEDULERS.get(Config.SD_SCHEDULER.lower())
+        if scheduler_name:
+            import diffusers
+            pipe.scheduler = getattr(diffusers, scheduler_name).from_config(pipe.scheduler.config)
+        return pipe
+    
+    @property
+    def scheduler_name(self) -> str:
+        scheduler = getattr(self.pipe, 'scheduler', None)
+        return type(scheduler).__name__ if scheduler is not None else Config.SD_SCHEDULER
+    
+    def build_prompt(self, scene: str) -> str:
+        return f"{scene}, {STYLE_PROMPT}"
+    
+    def scene_seed(self, scene: str) -> Optional[int]:
+        """固定种子时按 基础种子+场景文本 派生，同一场景无论在哪一批、第几个位置都得到同一张图"""
+        if Config.IMAGE_SEED < 0:
+            return None
+        digest = hashlib.sha256(f"{Config.IMAGE_SEED}:{scene}".encode("utf-8")).hexdigest()
+        return int(digest[:8], 16)
+    
+    def generate_image(self, prompt: str, negative_prompt: Optional[str] = None, seed: Optional[int] = None):
+        """生成单张插画"""
+        images = self.generate_story_images([prompt], negative_prompts=[negative_prompt or NEGATIVE_PROMPT],
+                                            seeds=[seed] if seed is not None else None)
+        if images[0] is None:
+            raise RuntimeError("插画生成失败")
+        return images[0]
+    
+    def generate_story_images(self, scenes: Sequence[str], progress_callback: Optional[ProgressCallback] = None,
+                              negative_prompts: Optional[Sequence[str]] = None,
+                              seeds: Optional[Sequence[Optional[int]]] = None,
+                              batch_size: Optional[int] = None) -> List:
+        """按批生成故事插画，返回与 scenes 一一对应的列表（生成失败的位置为None）
+        
+        progress_callback(序号, 图片) 在每张图片完成后按顺序调用，失败时图片为None。
+        """
+        scenes = list(scenes)
+        if not scenes:
+            return []
+        negative_prompts = list(negative_prompts or [NEGATIVE_PROMPT] * len(scenes))
+        seeds = [seed if seed is not None else self.scene_seed(scene)
+                 for scene, seed in zip(scenes, seeds or [None] * len(scenes))]
+        seeds = [seed if seed is not None else random.randrange(2 ** 31) for seed in seeds]
+        
+        results = [None] * len(scenes)
+        start_time = time.perf_counter()
+        position = 0
+        with self._lock:
+            while position < len(scenes):
+                size = self._batch_size(batch_size, len(scenes) - position)
+                indices = list(range(position, position + size))
+                try:
+                    images = self._run_batch([scenes[i] for i in indices], [negative_prompts[i] for i in indices],
+                                             [seeds[i] for i in indices])
+                except Exception as e:
+                    if is_out_of_memory(e) and size > 1:
+                        self._oom_limit = size // 2
+                        self.stats['oom_retries'] += 1
+                        logger.warning(f"批大小 {size} 内存不足，减半为 {self._oom_limit} 重试")
+                        PerformanceMonitor.cleanup_gpu_memory()
+                        continue
+                    logger.error(f"插画生成失败（第 {position + 1}-{position + size} 张）: {e}")
+                    images = [None] * size
+                
+                for index, image in zip(indices, images):
+                    results[index] = image
+                    if progress_callback:
+                        progress_callback(index, image)
+                position += size
+        
+        elapsed = time.perf_counter() - start_time
+        done = sum(image is not None for image in results)
+        logger.info(f"插画生成完成 {done}/{len(scenes)} 张，{elapsed:.2f}秒（{done / max(elapsed, 1e-9):.2f} 张/秒）")
+        return results
+    
+    def _batch_size(self, requested: Optional[int], remaining: int) -> int:
+        """批大小：请求值、OOM上限、可用内存可容纳的张数与剩余张数中的最小值"""
+        size = min(requested or self.batch_size, remaining)
+        if self._oom_limit is not None:
+            size = min(size, self._oom_limit)
+        
+        free_mb = PerformanceMonitor.get_free_memory_mb(self.device)
+        if free_mb is not None:
+            item_mb = Config.IMAGE_BATCH_MEMORY_MB or (
+                BATCH_ITEM_MB["cuda" if self.device.startswith("cuda") else "cpu"]
+                * self.width * self.height / (512 * 512))
+            fits = int(free_mb * MEMORY_HEADROOM // item_mb)
+            if fits < size:
+                logger.info(f"可用内存 {free_mb:.0f}MB，批大小由 {size} 调整为 {max(1, fits)}")
+                size = fits
+        return max(1, size)
+    
+    def _run_batch(self, scenes: List[str], negative_prompts: List[str], seeds: List[int]) -> List:
+        """一次管道调用生成整批图片，每一项使用独立的随机数生成器"""
+        generators = [torch.Generator(device="cpu").manual_seed(seed) for seed in seeds]
+        prompts = [self.build_prompt(scene) for scene in scenes]
+        if self.embedding_cache is not None and hasattr(self.pipe, "encode_prompt"):
+            text_inputs = {
+                'prompt_embeds': self.embedding_cache.get(self.pipe, self.model_key, prompts),
+                'negative_prompt_embeds': self.embedding_cache.get_negative(self.pipe, self.model_key,
+                                                                            negative_prompts)
+            }
+        else:
+            text_inputs = {'prompt': prompts, 'negative_prompt': negative_prompts}
+        
+        output = self.pipe(
+            **text_inputs,
+            generator=generators,
+            num_inference_steps=self.steps,
+            guidance_scale=self.guidance,
+            width=self.width,
+            height=self.height
+        )
+        self.stats['batches'] += 1
+        self.stats['images'] += len(scenes)
+        return list(output.images)
+    
+    def cleanup(self):
+        """释放模型及其常驻的负面提示词嵌入"""
+        if self.embedding_cache is not None:
+            self.embedding_cache.clear(self.model_key)
+        self.pipe = None
+        PerformanceMonitor.cleanup_gpu_memory()
@@ -0,0 +1,440 @@
+"""
+图像生成工作进程 - 独占扩散模型的常驻进程，多个前端共享同一份热模型
+
+扩散推理放在 Streamlit 脚本线程里会阻塞界面，OOM 或 CUDA 故障还会拖垮整个 Web 服务。
+工作进程通过 multiprocessing.connection 在本机端口上接收生成请求（只绑定 127.0.0.1，带 authkey），
+连接上的消息会被反序列化（pickle），authkey 不能是公开值：未配置时首次启动随机生成并以 0600 权限
+写入 IMAGE_WORKER_AUTHKEY_FILE，客户端与自动拉起的工作进程读取同一文件；
+协调窗口内到达的多个请求合并成一次 generate_story_images 按批推理，
+每张图片完成后立即以 PNG 字节或共享内存缓冲区回传给对应的请求方。
+模型由工作进程内的 model_registry 持有，空闲超时与内存紧张时照常卸载。
+
+运行：python image_worker.py；前端在 Config.IMAGE_WORKER 开启时使用 image_worker_client，
+连接不上且 IMAGE_WORKER_AUTOSTART 开启时自动拉起工作进程。
+"""
+import io
+import itertools
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+from config import Config
+from image_generator import IMAGE_MODEL, NEGATIVE_PROMPT, ImageGenerator, ProgressCallback
+from model_registry import ModelRegistry, model_registry
+
+Address = Tuple[str, int]
+
+def default_address() -> Address:
+    return (Config.IMAGE_WORKER_HOST, Config.IMAGE_WORKER_PORT)
+
+def load_authkey() -> bytes:
+    """连接认证密钥：优先取配置，否则读取密钥文件，不存在时随机生成"""
+    if Config.IMAGE_WORKER_AUTHKEY:
+        return Config.IMAGE_WORKER_AUTHKEY.encode("utf-8")
+    path = Path(Config.IMAGE_WORKER_AUTHKEY_FILE)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # mkstemp 创建的文件权限为 0600；写完后硬链接到目标，多个进程同时生成时只有一个生效
+        fd, temp_path = tempfile.mkstemp(prefix=".authkey.", dir=path.parent)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+            os.link(temp_path, path)
+            logger.info(f"已生成图像工作进程密钥: {path}")
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+    if path.stat().st_mode & 0o077:
+        logger.warning(f"图像工作进程密钥文件权限过宽，已改为 0600: {path}")
+        os.chmod(path, 0o600)
+    key = path.read_text().strip()
+    if not key:
+        raise RuntimeError(f"图像工作进程密钥文件为空: {path}")
+    return key.encode("utf-8")
+
+def discard_payload(payload: Optional[Dict[str, Any]]):
+    """未送达的图片消息：删除其共享内存段，否则会一直留在 /dev/shm"""
+    if payload and 'shm' in payload:
+        try:
+            shm = SharedMemory(name=payload['shm'])
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+def encode_image(image: Image.Image, transport: str) -> Dict[str, Any]:
+    """图片编码为可跨进程传递的消息：png 为压缩字节，shm 为共享内存中的原始像素"""
+    if transport == "shm":
+        pixels = np.asarray(image.convert("RGB"))
+        shm = SharedMemory(create=True, size=pixels.nbytes)
+        np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[:] = pixels
+        name = shm.name
+        shm.close()
+        # 由接收方读取后删除，工作进程的资源跟踪器不再负责它
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return {'shm': name, 'shape': pixels.shape}
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return {'png': buffer.getvalue()}
+
+def decode_image(payload: Dict[str, Any]) -> Image.Image:
+    if 'png' in payload:
+        image = Image.open(io.BytesIO(payload['png']))
+        image.load()
+        return image
+    
+    shm = SharedMemory(name=payload['shm'])
+    try:
+        pixels = np.ndarray(tuple(payload['shape']), dtype=np.uint8, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return Image.fromarray(pixels, "RGB")
+
+class _Request:
+    """工作进程中一个待处理的生成请求"""
+    
+    def __init__(self, conn: Connection, send_lock: threading.Lock, message: Dict[str, Any]):
+        self.conn = conn
+        self.send_lock = send_lock
+        self.id = message['id']
+        self.scenes: List[str] = list(message['scenes'])
+        count = len(self.scenes)
+        self.seeds = list(message.get('seeds') or [None] * count)
+        self.negative_prompts = [prompt or NEGATIVE_PROMPT for prompt in (message.get('negative_prompts')
+                                                                          or [None] * count)]
+        self.transport = message.get('transport') or "png"
+        self.alive = True
+    
+    def send(self, message: tuple) -> bool:
+        """发送给请求方，请求方已断开时返回False"""
+        if not self.alive:
+            return False
+        try:
+            with self.send_lock:
+                self.conn.send(message)
+            return True
+        except (OSError, EOFError, ValueError):
+            # 请求方已断开，其余结果丢弃
+            self.alive = False
+            return False
+
+class ImageWorker:
+    """图像生成服务端：接收请求、合并成批、逐张回传"""
+    
+    def __init__(self, address: Optional[Address] = None, authkey: Optional[bytes] = None,
+                 generator_factory: Callable[[], Any] = ImageGenerator, coalesce_ms: Optional[float] = None,
+                 registry: Optional[ModelRegistry] = None):
+        self.address = address or default_address()
+        self.authkey = authkey or load_authkey()
+        self.generator_factory = generator_factory
+        self.coalesce = (Config.IMAGE_WORKER_COALESCE_MS if coalesce_ms is None else coalesce_ms) / 1000
+        self.registry = registry or model_registry
+        self.stats = {'requests': 0, 'dispatches': 0, 'images': 0, 'errors': 0}
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._stopped = threading.Event()
+        self._listener: Optional[Listener] = None
+    
+    def serve_forever(self):
+        self._listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"图像工作进程已启动 {self.address[0]}:{self.address[1]}（pid {os.getpid()}）")
+        threading.Thread(target=self._dispatch_loop, name="image-dispatch", daemon=True).start()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    conn = self._listener.accept()
+                except (OSError, EOFError) as e:
+                    if self._stopped.is_set():
+                        break
+                    # 认证失败等单个连接错误不影响服务
+                    logger.warning(f"拒绝连接: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+            self.registry.shutdown()
+            logger.info("图像工作进程已退出")
+    
+    def stop(self):
+        self._stopped.set()
+        if self._listener is not None:
+            # 唤醒阻塞在 accept 上的主循环
+            try:
+                Client(self.address, authkey=self.authkey).close()
+            except OSError:
+                pass
+    
+    def _serve_connection(self, conn: Connection):
+        send_lock = threading.Lock()
+        try:
+            while True:
+                message = conn.recv()
+                kind = message.get('type')
+                if kind == 'generate':
+                    self.stats['requests'] += 1
+                    self._queue.put(_Request(conn, send_lock, message))
+                elif kind == 'info':
+                    with send_lock:
+                        conn.send(('info', self._info()))
+                elif kind == 'status':
+                    with send_lock:
+                        conn.send(('status', {'models': self.registry.status(), 'worker': dict(self.stats),
+                                              'pid': os.getpid(), 'queued': self._queue.qsize()}))
+                elif kind == 'shutdown':
+                    self.stop()
+                    break
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+    
+    def _info(self) -> Dict[str, Any]:
+        """模型信息（调度器名称参与缓存指纹），需要时加载模型"""
+        generator = self.registry.acquire(IMAGE_MODEL, self.generator_factory)
+        try:
+            return {'scheduler_name': getattr(generator, 'scheduler_name', None), 'pid': os.getpid()}
+        finally:
+            self.registry.release(IMAGE_MODEL)
+    
+    def _dispatch_loop(self):
+        """取出第一个请求后在协调窗口内继续收集，合并成一次推理"""
+        while not self._stopped.is_set():
+            try:
+                requests = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.coalesce
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    requests.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run(requests)
+    
+    def _run(self, requests: List[_Request]):
+        requests = [request for request in requests if request.alive]
+        if not requests:
+            return
+        owners = [(request, index) for request in requests for index in range(len(request.scenes))]
+        self.stats['dispatches'] += 1
+        if len(requests) > 1:
+            logger.info(f"合并 {len(requests)} 个请求共 {len(owners)} 张插画")
+        
+        def on_image(index: int, image):
+            request, local_index = owners[index]
+            if image is not None:
+                self.registry.record_first_output(IMAGE_MODEL)
+                self.stats['images'] += 1
+            if not request.alive:
+                return
+            payload = encode_image(image, request.transport) if image is not None else None
+            if not request.send(('image', request.id, local_index, payload)):
+                discard_payload(payload)
+        
+        try:
+            with self.registry.use(IMAGE_MODEL, self.generator_factory) as generator:
+                generator.generate_story_images(
+                    [scene for request in requests for scene in request.scenes],
+                    progress_callback=on_image,
+                    negative_prompts=[prompt for request in requests for prompt in request.negative_prompts],
+                    seeds=[seed for request in requests for seed in request.seeds]
+                )
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"图像生成失败: {e}")
+            for request in requests:
+                request.send(('error', request.id, str(e)))
+            return
+        
+        for request in requests:
+            request.send(('done', request.id))
+
+class ImageWorkerClient:
+    """工作进程客户端，接口与 ImageGenerator 一致；每个线程使用自己的连接，便于工作进程合并并发请求"""
+    
+    def __init__(self, address: Optional[Address] = None, authkey: Optional[bytes] = None,
+                 autostart: Optional[bool] = None, transport: Optional[str] = None):
+        self.address = address or default_address()
+        self._authkey = authkey
+        self.autostart = Config.IMAGE_WORKER_AUTOSTART if autostart is None else autostart
+        self.transport = transport or Config.IMAGE_WORKER_TRANSPORT
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self._start_lock = threading.Lock()
+        self._scheduler_name: Optional[str] = None
+    
+    @property
+    def authkey(self) -> bytes:
+        # 首次连接时才读取（或生成）密钥，导入模块不产生副作用
+        if self._authkey is None:
+            self._authkey = load_authkey()
+        return self._authkey
+    
+    @property
+    def scheduler_name(self) -> Optional[str]:
+        if self._scheduler_name is None:
+            self._scheduler_name = self._call({'type': 'info'}, 'info')['scheduler_name']
+        return self._scheduler_name
+    
+    def generate_image(self, prompt: str, negative_prompt: Optional[str] = None, seed: Optional[int] = None):
+        images = self.generate_story_images([prompt], negative_prompts=[negative_prompt],
+                                            seeds=[seed] if seed is not None else None)
+        if images[0] is None:
+            raise RuntimeError("插画生成失败")
+        return images[0]
+    
+    def generate_story_images(self, scenes: Sequence[str], progress_callback: Optional[ProgressCallback] = None,
+                              negative_prompts: Optional[Sequence[Optional[str]]] = None,
+                              seeds: Optional[Sequence[Optional[int]]] = None, batch_size: Optional[int] = None) -> List:
+        """提交给工作进程生成，返回与 scenes 一一对应的列表（失败的位置为None）；batch_size 由工作进程决定"""
+        scenes = list(scenes)
+        if not scenes:
+            return []
+        request_id = next(self._ids)
+        conn = self._connection()
+        results: List[Optional[Image.Image]] = [None] * len(scenes)
+        finished = False
+        try:
+            conn.send({'type': 'generate', 'id': request_id, 'scenes': scenes, 'transport': self.transport,
+                       'negative_prompts': list(negative_prompts) if negative_prompts else None,
+                       'seeds': list(seeds) if seeds else None})
+            while True:
+                message = conn.recv()
+                if message[1] != request_id:
+                    # 之前中断的请求遗留的消息
+                    if message[0] == 'image':
+                        discard_payload(message[3])
+                    continue
+                if message[0] == 'image':
+                    _, _, index, payload = message
+                    results[index] = decode_image(payload) if payload is not None else None
+                    if progress_callback:
+                        progress_callback(index, results[index])
+                elif message[0] == 'done':
+                    finished = True
+                    return results
+                elif message[0] == 'error':
+                    finished = True
+                    raise RuntimeError(f"图像工作进程生成失败: {message[2]}")
+        except (EOFError, OSError) as e:
+            raise RuntimeError(f"图像工作进程已断开（可能因显存不足或CUDA故障退出）: {e!r}") from e
+        finally:
+            if not finished:
+                self._drain(conn, request_id)
+    
+    def _drain(self, conn: Connection, request_id: int):
+        """回调抛出异常等提前退出时，工作进程仍在发送本请求的结果：读完并删除其共享内存段，
+        连接留给本线程的下一个请求；读取失败时断开连接"""
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'image':
+                    discard_payload(message[3])
+                elif message[1] == request_id and message[0] in ('done', 'error'):
+                    return
+        except (EOFError, OSError):
+            self._drop_connection()
+    
+    def status(self) -> Optional[Dict[str, Any]]:
+        """工作进程中的模型状态与统计；工作进程未运行时返回None（不会自动拉起）"""
+        try:
+            return self._call({'type': 'status'}, 'status', autostart=False)
+        except (RuntimeError, OSError):
+            return None
+    
+    def shutdown_worker(self):
+        try:
+            self._connection(autostart=False).send({'type': 'shutdown'})
+        except (RuntimeError, OSError):
+            pass
+        self._drop_connection()
+    
+    def cleanup(self):
+        """关闭本线程的连接，工作进程与其中的模型保持运行"""
+        self._drop_connection()
+    
+    def _call(self, message: Dict[str, Any], reply: str, autostart: Optional[bool] = None) -> Any:
+        conn = self._connection(autostart)
+        try:
+            conn.send(message)
+            kind, payload = conn.recv()
+        except (EOFError, OSError) as e:
+            self._drop_connection()
+            raise RuntimeError(f"图像工作进程已断开（可能因显存不足或CUDA故障退出）: {e!r}") from e
+        assert kind == reply, kind
+        return payload
+    
+    def _connection(self, autostart: Optional[bool] = None) -> Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and not conn.closed:
+            return conn
+        try:
+            conn = Client(self.address, authkey=self.authkey)
+        except ConnectionRefusedError:
+            if not (self.autostart if autostart is None else autostart):
+                raise RuntimeError(f"图像工作进程未运行（{self.address[0]}:{self.address[1]}）")
+            conn = self._start_worker()
+        self._local.conn = conn
+        return conn
+    
+    def _drop_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+    
+    def _start_worker(self) -> Connection:
+        """拉起独立会话中的工作进程（不随前端退出），等待其开始监听"""
+        with self._start_lock:
+            try:
+                return Client(self.address, authkey=self.authkey)
+            except ConnectionRefusedError:
+                pass
+            logger.info("正在启动图像工作进程...")
+            env = dict(os.environ, IMAGE_WORKER_HOST=self.address[0], IMAGE_WORKER_PORT=str(self.address[1]))
+            process = subprocess.Popen([sys.executable, str(Path(__file__).resolve())], cwd=str(Config.BASE_DIR),
+                                       env=env, start_new_session=True, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            deadline = time.monotonic() + Config.IMAGE_WORKER_STARTUP_TIMEOUT
+            while time.monotonic() < deadline:
+                if process.poll() is not None:
+                    # 可能另一个前端同时拉起了工作进程，本进程因端口被占用而退出
+                    try:
+                        return Client(self.address, authkey=self.authkey)
+                    except ConnectionRefusedError:
+                        raise RuntimeError(f"图像工作进程启动失败，退出码 {process.returncode}")
+                try:
+                    return Client(self.address, authkey=self.authkey)
+                except ConnectionRefusedError:
+                    time.sleep(0.2)
+            raise RuntimeError("等待图像工作进程启动超时")
+
+# 创建全局实例
+image_worker_client = ImageWorkerClient()
+
+if __name__ == "__main__":
+    from utils import Logger
+    Logger.setup_logger(Config.LOG_DIR / "image_worker.log", Config.LOG_LEVEL)
+    ImageWorker().serve_forever()
@@ -3,6 +3,7 @@
 """
 import streamlit as st
 import os
+import time
 from pathlib import Path
 from typing import List, Optional, Dict
 import asyncio
@@ -10,14 +11,17 @@ from concurrent.futures import ThreadPoolExecutor
 
 # 导入自定义模块
 from config import config
-from utils import Logger, PerformanceMonitor, cache_manager
+from utils import Logger, PerformanceMonitor, StageFingerprint, cache_manager
 from database_manager import db_manager
-from modules.story_generator import DeepSeekStoryGenerator
-from modules.image_generator import ImageGenerator
+from deepseek_client import deepseek_client
+from image_generator import IMAGE_MODEL, ImageGenerator
+from image_worker import image_worker_client
+from model_registry import model_registry
 from modules.audio_generator import AudioGenerator
 from modules.video_composer import VideoComposer
 from fixed_audio_generator import fixed_audio_generator
-from fixed_video_composer import fixed_video_composer
+from ffmpeg_video_composer import get_video_composer
+from background_renderer import background_renderer
 from modules.scene_extractor import SceneExtractor
 from modules.text_segmenter import TextSegmenter
 
@@ -38,7 +42,6 @@ class IdiomStoryVideoGenerator:
     def __init__(self):
         self.story_generator = None
         self.scene_extractor = None
-        self.image_generator = None
         self.text_segmenter = None
         self.audio_generator = None
         self.video_composer = None
@@ -70,29 +73,22 @@ class IdiomStoryVideoGenerator:
             if not self.performance_monitor:
                 self.performance_monitor = PerformanceMonitor()
             
-            # 初始化故事生成器
+            # 故事生成器：所有会话共享同一个事件循环、连接池、并发上限和限速器
             if not self.story_generator:
-                self.story_generator = DeepSeekStoryGenerator(config.DEEPSEEK_API_KEY)
+                self.story_generator = deepseek_client
             
             st.success("✅ 基础组件初始化完成")
             
         except Exception as e:
             st.error(f"❌ 初始化失败: {e}")
     
-    def _initialize_image_generator(self):
-        """按需初始化图像生成器"""
-        if not self.image_generator:
-            with st.spinner("正在初始化图像生成器..."):
-                self.image_generator = ImageGenerator()
-            st.success("✅ 图像生成器初始化完成")
-    
     def generate_story_text(self, idiom: str) -> str:
         """生成故事文本"""
         if not self.story_generator:
             raise ValueError("故事生成器未初始化")
         
         # 检查缓存
-        cache_key = cache_manager.get_cache_key(f"story_{idiom}")
+        cache_key = cache_manager.get_cache_key(idiom, prefix=f"story/{idiom}")
         cached_result = cache_manager.get_cached_result(cache_key)
         
         if cached_result:
@@ -116,44 +112,69 @@ class IdiomStoryVideoGenerator:
         return scenes
     
     def generate_story_images(self, scenes: List[str], idiom: str) -> List:
-        """生成故事插画"""
-        # 按需初始化图像生成器
-        self._initialize_image_generator()
+        """生成故事插画，返回与 scenes 一一对应的列表（失败的位置为None）
         
-        if not self.image_generator:
-            raise ValueError("图像生成器初始化失败")
+        图像模型由进程内所有会话共享，开启 IMAGE_WORKER 时由独立工作进程生成。
+        """
+        if config.IMAGE_WORKER:
+            # 推理在工作进程中进行，模型故障不会拖垮 Web 服务
+            return self._generate_story_images(image_worker_client, scenes, idiom)
         
-        # 检查缓存
-        cache_key = cache_manager.get_cache_key(f"images_{idiom}")
-        cached_images = cache_manager.get_cached_result(cache_key)
+        if not model_registry.is_loaded(IMAGE_MODEL):
+            st.info("⏳ 图像模型尚未加载，首次生成需要先加载模型")
         
-        if cached_images:
-            st.info("🖼️ 使用缓存的插画")
-            return cached_images
+        with model_registry.use(IMAGE_MODEL, ImageGenerator) as image_generator:
+            return self._generate_story_images(image_generator, scenes, idiom)
+    
+    def _generate_story_images(self, image_generator: ImageGenerator, scenes: List[str], idiom: str) -> List:
+        # 每个场景按 场景文本+模型参数 单独缓存，修改一句话只会重新生成对应场景
+        image_params = StageFingerprint.image_params(image_generator)
         
-        # 生成新插画
-        images = []
+        images = [None] * len(scenes)
+        pending = []
         progress_bar = st.progress(0)
         status_text = st.empty()
         
         for i, scene in enumerate(scenes):
-            status_text.text(f"正在生成第 {i+1}/{len(scenes)} 张插画...")
+            cache_key = cache_manager.get_cache_key(
+                StageFingerprint.compute("image", scene=scene, **image_params),
+                prefix=f"images/{idiom}"
+            )
+            images[i] = cache_manager.get_cached_result(cache_key)
+            if images[i] is None:
+                pending.append((i, cache_key))
+        
+        cached_count = len(scenes) - len(pending)
+        completed = cached_count
+        progress_bar.progress(completed / max(len(scenes), 1))
+        
+        def on_image(index, image):
+            nonlocal completed
+            i, cache_key = pending[index]
+            completed += 1
+            progress_bar.progress(completed / len(scenes))
+            if image is None:
+                st.error(f"生成第 {i+1} 张插画失败")
+                return
+            images[i] = image
+            model_registry.record_first_output(IMAGE_MODEL)
+            cache_manager.save_cache(cache_key, image)
+            status_text.text(f"已生成 {completed}/{len(scenes)} 张插画...")
             
+            # 显示生成的图片
+            with st.expander(f"场景 {i+1}: {scenes[i][:30]}..."):
+                st.image(image, caption=scenes[i][:50])
+        
+        if pending:
+            # 未命中缓存的场景按批送入管道，每张完成后回调更新进度
+            status_text.text(f"正在生成 {len(pending)} 张插画...")
             try:
-                image = self.image_generator.generate_image(scene)
-                images.append(image)
-                progress_bar.progress((i + 1) / len(scenes))
-                
-                # 显示生成的图片
-                with st.expander(f"场景 {i+1}: {scene[:30]}..."):
-                    st.image(image, caption=scene[:50])
-                    
+                image_generator.generate_story_images([scenes[i] for i, _ in pending], progress_callback=on_image)
             except Exception as e:
-                st.error(f"生成第 {i+1} 张插画失败: {e}")
-                continue
+                st.error(f"生成插画失败: {e}")
         
-        # 保存到缓存
-        cache_manager.save_cache(cache_key, images)
+        if cached_count:
+            st.info(f"🖼️ 使用缓存的插画 {cached_count}/{len(scenes)} 张")
         
         status_text.text("✅ 所有插画生成完成")
         return images
@@ -161,7 +182,10 @@ class IdiomStoryVideoGenerator:
     def generate_story_audio(self, story_text: str, idiom: str) -> any:
         """生成故事音频"""
         # 检查缓存
-        cache_key = cache_manager.get_cache_key(f"audio_{idiom}")
+        cache_key = cache_manager.get_cache_key(
+            StageFingerprint.compute("audio", text=story_text, **StageFingerprint.tts_params(self.audio_generator)),
+            prefix=f"audio/{idiom}"
+        )
         cached_audio = cache_manager.get_cached_result(cache_key)
         
         if cached_audio:
@@ -178,6 +202,26 @@ class IdiomStoryVideoGenerator:
         
         return audio
     
+    def generate_narration(self, story_text: str, idiom: str):
+        """生成旁白音轨（内存PCM），按 文本+TTS参数 缓存"""
+        cache_key = cache_manager.get_cache_key(
+            StageFingerprint.compute("narration", text=story_text, **StageFingerprint.tts_params(fixed_audio_generator)),
+            prefix=f"audio/{idiom}"
+        )
+        cached_track = cache_manager.get_cached_result(cache_key)
+        
+        if cached_track is not None:
+            st.info("🔊 使用缓存的音频")
+            return cached_track
+        
+        with st.spinner("正在生成音频..."):
+            track = fixed_audio_generator.synthesize_track(story_text, idiom)
+        
+        if track is not None:
+            cache_manager.save_cache(cache_key, track)
+        
+        return track
+    
     def create_video(self, images: List, audio: any, idiom: str) -> str:
         """创建视频"""
         with st.spinner("正在合成视频..."):
@@ -216,8 +260,7 @@ class IdiomStoryVideoGenerator:
             
             # 处理按钮点击
             if regenerate_clicked:
-                cache_key = cache_manager.get_cache_key(f"story_{idiom}")
-                cache_manager.clear_cache(cache_key.split('_')[0] + '_')
+                cache_manager.clear_cache(f"story/{idiom}")
                 return self.process_single_idiom(idiom)
             
             if not confirm_clicked:
@@ -229,8 +272,11 @@ class IdiomStoryVideoGenerator:
             # 保存故事和场景到数据库
             story_id = db_manager.save_story(idiom, edited_story, scenes)
             
-            # 步骤4：生成插画
-            images = self.generate_story_images(scenes, idiom)
+            # 步骤4：生成插画；失败的场景连同其文本一起剔除，后续图片与场景文本、旁白锚点保持对应
+            pairs = [(scene, image) for scene, image in zip(scenes, self.generate_story_images(scenes, idiom))
+                     if image is not None]
+            image_scenes = [scene for scene, _ in pairs]
+            images = [image for _, image in pairs]
             
             # 保存图片到数据库
             image_paths = db_manager.save_images(story_id, images, idiom)
@@ -239,27 +285,31 @@ class IdiomStoryVideoGenerator:
             if images:
                 st.subheader("🖼️ 生成的插画")
                 for i, image in enumerate(images):
-                    with st.expander(f"场景 {i+1}: {scenes[i][:30]}..."):
-                        st.image(image, caption=scenes[i][:50])
+                    with st.expander(f"场景 {i+1}: {image_scenes[i][:30]}..."):
+                        st.image(image, caption=image_scenes[i][:50])
             
             # 步骤5：生成音频（使用修复版）
-            audio_path = fixed_audio_generator.generate_story_audio(edited_story, idiom)
+            audio_track = self.generate_narration(edited_story, idiom)
             
-            if audio_path:
-                # 保存音频到数据库
-                audio_path = db_manager.save_audio(story_id, audio_path, idiom)
-            else:
+            if audio_track is None:
                 st.warning("音频生成失败，跳过音频保存")
+            elif config.ARCHIVE_AUDIO:
+                # 仅在需要存档时编码为mp3并保存到数据库
+                db_manager.save_audio(story_id, audio_track, idiom)
             
-            # 步骤6：创建视频（使用修复版）
+            # 步骤6：创建视频，先出低清预览，成片在后台渲染，直接使用内存中的音轨
             video_path = None
-            if audio_path:
-                video_path = fixed_video_composer.create_video(images, audio_path, idiom)
+            if audio_track is not None:
+                video_composer = get_video_composer(st.session_state.get('video_backend'),
+                                                    st.session_state.get('video_transition'),
+                                                    st.session_state.get('video_captions'))
+                # 场景按旁白的句子边界切换（由音轨的段落时间表直接得到）
+                durations = audio_track.scene_durations(len(images), image_scenes)
+                render_status = background_renderer.render(story_id, images, audio_track, idiom, video_composer,
+                                                           durations)
+                video_path = render_status['video_path']
                 
-                if video_path:
-                    # 保存视频到数据库
-                    video_path = db_manager.save_video(story_id, video_path, idiom)
-                else:
+                if not video_path and render_status['final_status'] != 'rendering':
                     st.warning("视频生成失败")
             else:
                 st.warning("由于音频生成失败，跳过视频生成")
@@ -269,6 +319,7 @@ class IdiomStoryVideoGenerator:
                 "idiom": idiom,
                 "story": edited_story,
                 "scenes": scenes,
+                "story_id": story_id,
                 "video_path": video_path,
                 "images_count": len(images)
             }
@@ -311,6 +362,23 @@ def render_sidebar():
             max_scenes = st.slider("最大场景数", 5, 20, config.MAX_SCENES)
             image_quality = st.selectbox("图像质量", ["标准", "高质量", "超高质量"])
             audio_speed = st.slider("语音速度", 0.8, 1.5, 1.0)
+            backends = ["ffmpeg", "moviepy"]
+            st.session_state.video_backend = st.selectbox(
+                "视频合成后端", backends,
+                index=backends.index(config.VIDEO_BACKEND) if config.VIDEO_BACKEND in backends else 0,
+                help="ffmpeg：单次调用直接编码静帧，速度快；moviepy：逐帧渲染"
+            )
+            transitions = ["none", "fade", "slide", "zoom"]
+            st.session_state.video_transition = st.selectbox(
+                "转场效果", transitions,
+                index=transitions.index(config.VIDEO_TRANSITION) if config.VIDEO_TRANSITION in transitions else 0,
+                format_func=lambda name: {"none": "无（简单拼接）", "fade": "淡入淡出", "slide": "滑动", "zoom": "缩放"}[name],
+                help="仅ffmpeg后端支持"
+            )
+            st.session_state.video_captions = st.checkbox(
+                "烧录字幕", value=config.VIDEO_CAPTIONS,
+                help="按旁白句子时间表在画面底部叠加字幕，仅ffmpeg后端支持"
+            )
             
             # 更新配置
             config.MAX_SCENES = max_scenes
@@ -331,6 +399,28 @@ def render_sidebar():
         if memory_info:
             st.metric("内存使用率", f"{memory_info['percentage']:.1f}%")
         
+        # 模型状态（进程内各会话共享）
+        if config.IMAGE_WORKER:
+            worker_status = image_worker_client.status()
+            models = worker_status['models'] if worker_status else []
+            st.caption(f"图像工作进程 pid {worker_status['pid']} · 排队 {worker_status['queued']}"
+                       if worker_status else "图像工作进程未运行")
+        else:
+            models = model_registry.status()
+        model_status = {entry['name']: entry for entry in models}.get(IMAGE_MODEL)
+        state_labels = {'loaded': "已加载", 'loading': "加载中", 'unloaded': "未加载"}
+        st.metric("图像模型", state_labels[model_status['state']] if model_status else "未加载")
+        if model_status and model_status['load_seconds'] is not None:
+            first_image = model_status['first_output_seconds']
+            st.caption(f"加载 {model_status['load_seconds']:.1f}秒 · "
+                       f"首图 {f'{first_image:.1f}秒' if first_image is not None else '—'} · "
+                       f"使用中 {model_status['refs']} · 空闲 {model_status['idle_seconds']:.0f}秒")
+        
+        # 缓存状态
+        cache_stats = cache_manager.get_stats()
+        st.metric("缓存占用", f"{cache_stats['total_bytes'] / 1024 / 1024:.1f}/{cache_stats['max_bytes'] / 1024 / 1024:.0f} MB")
+        st.caption(f"命中 {cache_stats['hits']} · 未命中 {cache_stats['misses']} · 淘汰 {cache_stats['evictions']}")
+        
         return input_method
 
 def render_main_interface(generator: IdiomStoryVideoGenerator, input_method: str):
@@ -387,7 +477,7 @@ def render_main_interface(generator: IdiomStoryVideoGenerator, input_method: str
                     st.rerun()
                 else:
                     # 批量处理
-                    st.info("批量处理功能开发中...")
+                    render_batch_processing(idioms)
         
         with col2:
             if st.button("🗑️ 清理缓存", use_container_width=True):
@@ -398,6 +488,35 @@ def render_main_interface(generator: IdiomStoryVideoGenerator, input_method: str
             if st.button("💾 导出结果", use_container_width=True):
                 st.info("导出功能开发中...")
 
+def render_batch_processing(idioms: List[str]):
+    """批量处理成语列表（无需逐个确认，结果写入清单）"""
+    from batch_processor import BatchProcessor
+    
+    st.info(f"批量处理 {len(idioms)} 个成语，结果清单: {config.BATCH_MANIFEST}。大批量任务建议使用命令行: python batch_processor.py 文件名")
+    
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    results = []
+    
+    def on_result(record: Dict):
+        results.append(record)
+        progress_bar.progress(min(len(results) / len(idioms), 1.0))
+        status_text.text(f"[{len(results)}/{len(idioms)}] {record['idiom']}: {record['status']}")
+    
+    summary = BatchProcessor().run(idioms, config.BATCH_MANIFEST, on_result=on_result)
+    progress_bar.progress(1.0)
+    
+    st.success(f"✅ 批量处理完成: 成功 {summary['success']}，失败 {summary['error']}，跳过 {summary['skipped']}")
+    if results:
+        st.dataframe(results, use_container_width=True)
+    
+    if summary.get('pipeline'):
+        st.subheader("⏱️ 各阶段利用率")
+        st.dataframe(
+            [{"阶段": name, **item} for name, item in summary['pipeline']['stages'].items()],
+            use_container_width=True
+        )
+
 def render_processing_interface(generator: IdiomStoryVideoGenerator, idiom: str):
     """渲染处理界面"""
     st.title("📚 成语故事短视频生成器")
@@ -428,14 +547,15 @@ def render_processing_interface(generator: IdiomStoryVideoGenerator, idiom: str)
             
             with col2:
                 st.subheader("🎬 生成视频")
-                if os.path.exists(result["video_path"]):
-                    st.video(result["video_path"])
-                else:
-                    st.error("视频文件不存在")
+                render_video_result(result.get("story_id"), result["video_path"])
             
-            # 重置状态
+            # 重置状态；成片仍在渲染时保留结果页，轮询渲染状态
             st.session_state.processing_step = 'input'
             st.session_state.current_idiom = None
+            if result.get("story_id") and background_renderer.status(result["story_id"])['final_status'] == 'rendering':
+                st.session_state.processing_step = 'result'
+                st.session_state.render_result = result
+                st.rerun()
             
         elif result["status"] == "waiting_for_confirmation":
             st.info("⏳ 等待用户确认...")
@@ -445,6 +565,59 @@ def render_processing_interface(generator: IdiomStoryVideoGenerator, idiom: str)
         st.session_state.processing_step = 'input'
         st.session_state.current_idiom = None
 
+def render_video_result(story_id: Optional[int], video_path: Optional[str]):
+    """显示当前可播放的视频：成片就绪前显示低清预览"""
+    status = background_renderer.status(story_id) if story_id else {
+        'video_path': video_path, 'rendition': 'final', 'final_status': None, 'error': None}
+    video_path = status['video_path'] or video_path
+    
+    if not video_path or not os.path.exists(video_path):
+        st.error("视频文件不存在")
+    else:
+        st.video(video_path)
+    
+    stream = status.get('stream')
+    if status['final_status'] == 'rendering' and stream and stream['playable_seconds'] > 0:
+        # 流式成片：已写出的片段即可播放
+        st.progress(min(stream['playable_seconds'] / stream['duration'], 1.0),
+                    text=f"高清成片已编码 {stream['playable_seconds']:.1f}/{stream['duration']:.1f} 秒")
+        if stream['format'] == 'fmp4':
+            st.video(stream['path'])
+        else:
+            st.caption(f"HLS播放列表: {stream['path']}（{stream['segments']} 个片段）")
+    
+    if status['final_status'] == 'rendering':
+        st.info(f"⏳ 当前为低清预览（{config.VIDEO_PREVIEW_WIDTH}x{config.VIDEO_PREVIEW_HEIGHT}），高清成片正在后台渲染...")
+    elif status['final_status'] == 'failed':
+        st.error(f"高清成片渲染失败: {status['error']}")
+    
+    # 额外画幅（16:9、1:1 等）
+    extras = {name: item for name, item in status.get('renditions', {}).items()
+              if name not in ('final', 'preview') and item['status'] == 'ready'}
+    for name, item in extras.items():
+        with st.expander(f"📐 {name.replace('x', ':')} 画幅"):
+            st.video(item['path'])
+    return status
+
+def render_result_interface():
+    """结果页：轮询 videos 表，成片渲染完成后自动切换"""
+    result = st.session_state.render_result
+    st.title("📚 成语故事短视频生成器")
+    st.markdown("---")
+    st.subheader(f"🎬 {result['idiom']}")
+    
+    if st.button("← 返回", key="back_from_result"):
+        st.session_state.processing_step = 'input'
+        st.session_state.render_result = None
+        st.rerun()
+    
+    status = render_video_result(result['story_id'], result['video_path'])
+    if status['final_status'] == 'rendering':
+        time.sleep(2)
+        st.rerun()
+    elif status['final_status'] == 'ready':
+        st.success("✅ 高清成片已完成")
+
 def main():
     """主函数"""
     # 添加侧边栏导航
@@ -474,6 +647,8 @@ def main():
         render_main_interface(st.session_state.generator, input_method)
     elif st.session_state.processing_step == 'processing':
         render_processing_interface(st.session_state.generator, st.session_state.current_idiom)
+    elif st.session_state.processing_step == 'result':
+        render_result_interface()
     
     # 页脚
     st.markdown("---")
@@ -0,0 +1,199 @@
+"""
+模型注册表 - 进程内共享的模型实例
+
+Streamlit 每个浏览器会话都有自己的 session_state，若各自加载 Stable Diffusion，
+多个会话就有多份模型与多次冷启动。注册表按名称在进程内只加载一次：
+use() 期间引用计数加一并持有该模型的推理锁，多个会话排队共用同一份权重；
+无人使用超过 MODEL_IDLE_TIMEOUT 后卸载，内存使用率超过 MODEL_MEMORY_PRESSURE_PERCENT 时
+按最久未用的顺序卸载空闲模型。
+"""
+import gc
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from config import Config
+from utils import PerformanceMonitor
+
+class ModelEntry:
+    """单个模型的加载状态、引用计数与计时"""
+    
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self.loader = loader
+        self.model = None
+        self.state = 'unloaded'
+        self.refs = 0
+        self.loads = 0
+        self.last_used = time.time()
+        self.load_started: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.first_output_seconds: Optional[float] = None
+        self.load_lock = threading.Lock()
+        self.inference_lock = threading.Lock()
+
+class ModelRegistry:
+    """进程级模型注册表：只加载一次、引用计数、推理加锁、空闲超时与内存压力卸载"""
+    
+    def __init__(self, idle_timeout: Optional[float] = None, memory_pressure_percent: Optional[float] = None,
+                 check_interval: Optional[float] = None):
+        self.idle_timeout = Config.MODEL_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.memory_pressure_percent = (Config.MODEL_MEMORY_PRESSURE_PERCENT if memory_pressure_percent is None
+                                        else memory_pressure_percent)
+        self.check_interval = Config.MODEL_CHECK_INTERVAL if check_interval is None else check_interval
+        self._entries: Dict[str, ModelEntry] = {}
+        self._lock = threading.Lock()
+        self._monitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    def acquire(self, name: str, loader: Callable[[], Any]) -> Any:
+        """取得模型并将引用计数加一（未加载时加载，并发请求只加载一次），用完须 release"""
+        self._ensure_monitor()
+        with self._lock:
+            entry = self._entries.setdefault(name, ModelEntry(name, loader))
+            entry.refs += 1
+        try:
+            return self._ensure_loaded(entry)
+        except Exception:
+            self.release(name)
+            raise
+    
+    def release(self, name: str):
+        with self._lock:
+            entry = self._entries[name]
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.time()
+    
+    @contextmanager
+    def use(self, name: str, loader: Callable[[], Any]) -> Iterator[Any]:
+        """持有引用与推理锁使用模型，同一模型的推理在会话之间串行"""
+        model = self.acquire(name, loader)
+        try:
+            with self._entries[name].inference_lock:
+                yield model
+        finally:
+            self.release(name)
+    
+    def is_loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.state == 'loaded'
+    
+    def record_first_output(self, name: str):
+        """记录本次加载后首个产出（如第一张图片）距开始加载的耗时，每次加载只记一次"""
+        entry = self._entries.get(name)
+        if entry and entry.first_output_seconds is None and entry.load_started is not None:
+            entry.first_output_seconds = time.time() - entry.load_started
+    
+    def unload(self, name: str, reason: str = "手动") -> bool:
+        """卸载无人使用的模型，正在使用时返回False"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry.refs > 0 or entry.model is None:
+                return False
+            model, entry.model = entry.model, None
+            entry.state = 'unloaded'
+            entry.load_started = entry.load_seconds = entry.first_output_seconds = None
+        
+        cleanup = getattr(model, 'cleanup', None)
+        if callable(cleanup):
+            try:
+                cleanup()
+            except Exception as e:
+                logger.warning(f"模型 {name} 清理失败: {e}")
+        del model
+        gc.collect()
+        PerformanceMonitor.cleanup_gpu_memory()
+        logger.info(f"已卸载模型 {name}（{reason}）")
+        return True
+    
+    def sweep(self, now: Optional[float] = None) -> List[str]:
+        """卸载空闲超时的模型；内存紧张时再按最久未用的顺序卸载其余空闲模型"""
+        now = time.time() if now is None else now
+        unloaded = []
+        with self._lock:
+            idle = sorted((entry for entry in self._entries.values() if entry.refs == 0 and entry.model is not None),
+                          key=lambda entry: entry.last_used)
+        
+        for entry in idle:
+            if self.idle_timeout and now - entry.last_used > self.idle_timeout:
+                if self.unload(entry.name, f"空闲 {now - entry.last_used:.0f}秒"):
+                    unloaded.append(entry.name)
+        
+        for entry in idle:
+            if entry.name in unloaded or not self._under_pressure():
+                continue
+            if self.unload(entry.name, "内存紧张"):
+                unloaded.append(entry.name)
+        return unloaded
+    
+    def status(self) -> List[Dict[str, Any]]:
+        """各模型的加载状态，供侧边栏展示"""
+        now = time.time()
+        with self._lock:
+            return [{
+                'name': entry.name,
+                'state': entry.state,
+                'refs': entry.refs,
+                'loads': entry.loads,
+                'load_seconds': entry.load_seconds,
+                'first_output_seconds': entry.first_output_seconds,
+                'idle_seconds': now - entry.last_used if entry.refs == 0 else 0.0
+            } for entry in self._entries.values()]
+    
+    def shutdown(self):
+        """停止后台检查并卸载所有空闲模型"""
+        self._stop.set()
+        for name in list(self._entries):
+            self.unload(name, "退出")
+    
+    def _ensure_loaded(self, entry: ModelEntry) -> Any:
+        if entry.model is not None:
+            return entry.model
+        with entry.load_lock:
+            if entry.model is not None:
+                return entry.model
+            # 加载新模型前先为它腾出空间
+            if self._under_pressure():
+                self.sweep()
+            entry.state = 'loading'
+            entry.load_started = time.time()
+            try:
+                model = entry.loader()
+            except Exception:
+                entry.state = 'unloaded'
+                entry.load_started = None
+                raise
+            entry.load_seconds = time.time() - entry.load_started
+            entry.first_output_seconds = None
+            entry.loads += 1
+            entry.model = model
+            entry.state = 'loaded'
+            logger.info(f"模型 {entry.name} 加载完成，耗时 {entry.load_seconds:.1f}秒")
+            return model
+    
+    def _under_pressure(self) -> bool:
+        if not self.memory_pressure_percent:
+            return False
+        memory_info = PerformanceMonitor.get_memory_info()
+        return bool(memory_info) and memory_info['percentage'] >= self.memory_pressure_percent
+    
+    def _ensure_monitor(self):
+        if self._monitor is not None or not self.check_interval:
+            return
+        with self._lock:
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._monitor_loop, name="model-registry", daemon=True)
+                self._monitor.start()
+    
+    def _monitor_loop(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"模型空闲检查失败: {e}")
+
+# 创建全局实例
+model_registry = ModelRegistry()
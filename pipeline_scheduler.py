@@ -0,0 +1,167 @@
+"""
+流水线调度器 - 各阶段独立的工作池 + 有界队列，使不同成语的不同阶段并行执行
+
+例如成语N在编码视频时，成语N+1在调用TTS，成语N+2在生成插画。
+队列有界，下游变慢时上游自动阻塞（背压），内存占用不会随输入增长。
+进程阶段的子进程用 spawn 启动：此时各阶段线程与日志线程已在运行，fork 可能复制到被其他线程持有的锁而死锁。
+"""
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from loguru import logger
+
+# 队列结束标记
+_DONE = object()
+
+class Stage:
+    """流水线阶段定义
+    
+    kind:
+        thread  - 线程池执行，适合网络I/O（DeepSeek、gTTS）
+        process - 进程池执行，适合CPU密集型任务（视频编码）；func 和 job 需可pickle
+    workers=1 的线程阶段即为"单一所有者"，可用于独占扩散模型。
+    """
+    
+    def __init__(self, name: str, func: Callable[[Dict], Dict], workers: int = 1,
+                 kind: str = "thread", queue_size: int = 2):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"未知的阶段类型: {kind}")
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.kind = kind
+        self.queue_size = queue_size
+
+class StagedScheduler:
+    """分阶段流水线调度器"""
+    
+    def __init__(self, stages: List[Stage]):
+        if not stages:
+            raise ValueError("至少需要一个阶段")
+        self.stages = stages
+        self._lock = threading.Lock()
+        self._stats = {}
+    
+    def run(self, jobs: Iterable[Dict], on_result: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """执行流水线，每个 job 完成全部阶段（或失败）后回调 on_result，返回各阶段利用率报告"""
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results = queue.Queue()
+        self._stats = {stage.name: {'jobs': 0, 'errors': 0, 'busy': 0.0, 'blocked': 0.0} for stage in self.stages}
+        remaining = {stage.name: stage.workers for stage in self.stages}
+        executors = {stage.name: ProcessPoolExecutor(max_workers=stage.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+                     for stage in self.stages if stage.kind == "process"}
+        feed_errors: List[BaseException] = []
+        
+        def feed():
+            try:
+                for job in jobs:
+                    queues[0].put(job)
+            except Exception as e:
+                # 已送入的任务照常完成，run() 结束时再抛出
+                logger.error(f"读取任务失败，停止送入新任务: {e}")
+                feed_errors.append(e)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+        
+        def work(index: int):
+            stage = self.stages[index]
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else results
+            stats = self._stats[stage.name]
+            
+            while True:
+                job = inbox.get()
+                if job is _DONE:
+                    break
+                
+                if not job.get('error'):
+                    start_time = time.perf_counter()
+                    try:
+                        if stage.kind == "process":
+                            job = executors[stage.name].submit(stage.func, job).result()
+                        else:
+                            job = stage.func(job)
+                    except Exception as e:
+                        logger.error(f"[{job.get('idiom')}] 阶段 {stage.name} 失败: {e}")
+                        job['error'] = str(e)
+                        job['failed_stage'] = stage.name
+                        with self._lock:
+                            stats['errors'] += 1
+                    with self._lock:
+                        stats['jobs'] += 1
+                        stats['busy'] += time.perf_counter() - start_time
+                
+                # 下游队列满时在这里阻塞，即背压
+                start_time = time.perf_counter()
+                outbox.put(job)
+                with self._lock:
+                    stats['blocked'] += time.perf_counter() - start_time
+            
+            # 本阶段最后一个退出的工作线程通知下游结束
+            with self._lock:
+                remaining[stage.name] -= 1
+                last = remaining[stage.name] == 0
+            if last:
+                downstream = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+                for _ in range(downstream):
+                    outbox.put(_DONE)
+        
+        threads = [threading.Thread(target=feed, name="pipeline-feed", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                threads.append(threading.Thread(target=work, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True))
+        
+        start_time = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        
+        try:
+            while True:
+                job = results.get()
+                if job is _DONE:
+                    break
+                if on_result:
+                    on_result(job)
+        finally:
+            for thread in threads:
+                thread.join()
+            for executor in executors.values():
+                executor.shutdown()
+        
+        report = self._build_report(time.perf_counter() - start_time)
+        if feed_errors:
+            raise feed_errors[0]
+        return report
+    
+    def _build_report(self, wall_time: float) -> Dict:
+        """生成各阶段吞吐量和利用率报告"""
+        report = {}
+        for stage in self.stages:
+            stats = self._stats[stage.name]
+            capacity = wall_time * stage.workers
+            report[stage.name] = {
+                'kind': stage.kind,
+                'workers': stage.workers,
+                'jobs': stats['jobs'],
+                'errors': stats['errors'],
+                'busy_seconds': round(stats['busy'], 2),
+                'avg_seconds': round(stats['busy'] / stats['jobs'], 2) if stats['jobs'] else 0.0,
+                'blocked_seconds': round(stats['blocked'], 2),
+                'utilization': round(stats['busy'] / capacity, 3) if capacity > 0 else 0.0
+            }
+        
+        logger.info(f"流水线总耗时 {wall_time:.2f}秒")
+        for name, item in report.items():
+            logger.info(
+                f"  {name:<8} {item['kind']:<7} x{item['workers']}  任务 {item['jobs']:>4}  "
+                f"平均 {item['avg_seconds']:>6.2f}秒  利用率 {item['utilization'] * 100:5.1f}%  "
+                f"背压等待 {item['blocked_seconds']:.2f}秒"
+            )
+        return {'wall_seconds': round(wall_time, 2), 'errors': sum(item['errors'] for item in report.values()),
+                'stages': report}
@@ -0,0 +1,145 @@
+"""
+提示词嵌入缓存 - 文本编码器的输出按 (模型, 提示词) 复用
+
+负面提示词在每个模型上只编码一次；正向提示词进入按 (模型, 提示词) 为键的 LRU，
+可选以 .safetensors 存盘，重新渲染同一故事时完全跳过文本编码。
+管道直接接收 prompt_embeds / negative_prompt_embeds。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+from loguru import logger
+
+from config import Config
+from image_backends import backend_tag
+from workspace_manager import atomic_path
+
+def _device(pipe) -> torch.device:
+    # ONNX/OpenVINO 管道没有 _execution_device，在 CPU 上运行
+    return getattr(pipe, '_execution_device', torch.device("cpu"))
+
+class PromptEmbeddingCache:
+    """按 (模型, 提示词) 缓存文本嵌入；负面提示词常驻，正向提示词走 LRU，可选持久化"""
+    
+    def __init__(self, max_entries: Optional[int] = None, persist_dir: Optional[Path] = None,
+                 persist: Optional[bool] = None):
+        self.max_entries = Config.PROMPT_EMBED_CACHE_SIZE if max_entries is None else max_entries
+        self.persist = Config.PROMPT_EMBED_PERSIST if persist is None else persist
+        self.persist_dir = Path(persist_dir or Config.PROMPT_EMBED_DIR)
+        self._entries: "OrderedDict[Tuple[str, str], torch.Tensor]" = OrderedDict()
+        self._negatives: Dict[Tuple[str, str], torch.Tensor] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'negative_encodes': 0}
+    
+    @staticmethod
+    def model_key(pipe, model_path: str = "", backend: Optional[str] = None) -> str:
+        """模型标识：路径、版本、推理后端（含int8量化）与文本编码器精度，换模型或精度后嵌入不再复用"""
+        encoder = getattr(pipe, 'text_encoder', None)
+        dtype = getattr(encoder, 'dtype', None)
+        return f"{model_path or Config.SD_MODEL_PATH}@{Config.SD_MODEL_REVISION}:{backend_tag(backend)}:{dtype}"
+    
+    def get(self, pipe, model_key: str, prompts: Sequence[str]) -> torch.Tensor:
+        """正向提示词嵌入，未命中的提示词合并成一次编码"""
+        found: List[Optional[torch.Tensor]] = []
+        with self._lock:
+            for prompt in prompts:
+                embedding = self._entries.get((model_key, prompt))
+                if embedding is not None:
+                    self._entries.move_to_end((model_key, prompt))
+                    self.stats['hits'] += 1
+                found.append(embedding)
+        
+        missing = [i for i, embedding in enumerate(found) if embedding is None]
+        for i in list(missing):
+            embedding = self._load(model_key, prompts[i])
+            if embedding is not None:
+                found[i] = embedding
+                self.stats['disk_hits'] += 1
+                self._remember(model_key, prompts[i], embedding)
+                missing.remove(i)
+        
+        if missing:
+            unique = list(dict.fromkeys(prompts[i] for i in missing))
+            encoded = dict(zip(unique, self._encode(pipe, unique)))
+            self.stats['misses'] += len(unique)
+            for prompt, embedding in encoded.items():
+                self._remember(model_key, prompt, embedding)
+                self._save(model_key, prompt, embedding)
+            for i in missing:
+                found[i] = encoded[prompts[i]]
+        return torch.stack([embedding.to(_device(pipe)) for embedding in found])
+    
+    def get_negative(self, pipe, model_key: str, prompts: Sequence[str]) -> torch.Tensor:
+        """负面提示词嵌入：每个模型只编码一次并常驻，不参与 LRU 淘汰"""
+        with self._lock:
+            missing = [prompt for prompt in dict.fromkeys(prompts) if (model_key, prompt) not in self._negatives]
+        if missing:
+            for prompt, embedding in zip(missing, self._encode(pipe, missing)):
+                with self._lock:
+                    self._negatives[(model_key, prompt)] = embedding
+            self.stats['negative_encodes'] += len(missing)
+        with self._lock:
+            return torch.stack([self._negatives[(model_key, prompt)] for prompt in prompts])
+    
+    def clear(self, model_key: Optional[str] = None):
+        """清空缓存（指定 model_key 时只清该模型），模型卸载时调用"""
+        with self._lock:
+            for cache in (self._entries, self._negatives):
+                for key in [key for key in cache if model_key is None or key[0] == model_key]:
+                    del cache[key]
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+    
+    def _remember(self, model_key: str, prompt: str, embedding: torch.Tensor):
+        with self._lock:
+            self._entries[(model_key, prompt)] = embedding
+            self._entries.move_to_end((model_key, prompt))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    @staticmethod
+    def _encode(pipe, prompts: List[str]) -> List[torch.Tensor]:
+        """调用管道自身的文本编码（与 prompt= 传参时完全一致），返回每个提示词一份嵌入"""
+        with torch.no_grad():
+            embeddings, _ = pipe.encode_prompt(prompts, _device(pipe), 1, False)
+        return list(embeddings)
+    
+    def _path(self, model_key: str, prompt: str) -> Path:
+        digest = hashlib.sha256(f"{model_key}\n{prompt}".encode('utf-8')).hexdigest()
+        return self.persist_dir / f"{digest[:32]}.safetensors"
+    
+    def _load(self, model_key: str, prompt: str) -> Optional[torch.Tensor]:
+        if not self.persist:
+            return None
+        path = self._path(model_key, prompt)
+        if not path.exists():
+            return None
+        try:
+            from safetensors.torch import load_file
+            return load_file(str(path))['prompt_embeds']
+        except Exception as e:
+            logger.warning(f"读取提示词嵌入失败 {path.name}: {e}")
+            return None
+    
+    def _save(self, model_key: str, prompt: str, embedding: torch.Tensor):
+        if not self.persist:
+            return
+        try:
+            from safetensors.torch import save_file
+            with atomic_path(self._path(model_key, prompt)) as temp_path:
+                save_file({'prompt_embeds': embedding.detach().contiguous().cpu()}, str(temp_path),
+                          metadata={'model': model_key})
+        except ImportError:
+            logger.warning("未安装 safetensors，提示词嵌入不再存盘")
+            self.persist = False
+        except Exception as e:
+            logger.warning(f"保存提示词嵌入失败: {e}")
+
+# 创建全局实例
+prompt_embedding_cache = PromptEmbeddingCache()
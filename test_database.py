@@ -1,47 +1,82 @@
 """
 测试数据库功能
 """
-from database_manager import db_manager
 import os
+import tempfile
+
+from database_manager import DatabaseManager
 
 def test_database():
     """测试数据库功能"""
     print("🧪 测试数据库功能...")
     
-    # 测试保存故事
-    idiom = "刻舟求剑"
-    story_text = "从前有个人坐船过河，不小心把剑掉到河里了。他在船上刻了个记号，以为这样就能找到剑。"
-    scenes = [
-        "一个人坐在船上",
-        "剑掉到河里",
-        "在船上刻记号",
-        "以为能找到剑"
-    ]
-    
-    print(f"📝 保存故事: {idiom}")
-    story_id = db_manager.save_story(idiom, story_text, scenes)
-    print(f"✅ 故事ID: {story_id}")
-    
-    # 测试获取故事
-    print(f"📖 获取故事: {idiom}")
-    story = db_manager.get_story(idiom)
-    if story:
-        print(f"✅ 找到故事: {story['idiom']}")
-        print(f"   场景数量: {len(story['scenes'])}")
-    else:
-        print("❌ 未找到故事")
-    
-    # 测试列出故事
-    print("📚 列出所有故事:")
-    stories = db_manager.list_stories(limit=10)
-    for story in stories:
-        print(f"  - {story['idiom']}: {story['story_text'][:50]}...")
-    
-    # 测试存储统计
-    print("📊 存储统计:")
-    stats = db_manager.get_storage_stats()
-    print(f"  故事数量: {stats['story_count']}")
-    print(f"  总大小: {stats['total_size'] / 1024:.1f} KB")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        
+        # 测试保存故事
+        idiom = "刻舟求剑"
+        story_text = "从前有个人坐船过河，不小心把剑掉到河里了。他在船上刻了个记号，以为这样就能找到剑。"
+        scenes = [
+            "一个人坐在船上",
+            "剑掉到河里",
+            "在船上刻记号",
+            "以为能找到剑"
+        ]
+        
+        print(f"📝 保存故事: {idiom}")
+        story_id = db.save_story(idiom, story_text, scenes)
+        assert db.save_story(idiom, story_text, scenes) == story_id, "重复保存应保持 story_id 不变"
+        print(f"✅ 故事ID: {story_id}")
+        
+        # 测试获取故事
+        print(f"📖 获取故事: {idiom}")
+        story = db.get_story(idiom)
+        assert story and story['id'] == story_id and story['scenes'] == scenes
+        assert story['images'] == [] and story['audio'] is None and story['video'] is None
+        assert db.get_story("不存在的成语") is None
+        print(f"✅ 找到故事: {story['idiom']}，场景数量 {len(story['scenes'])}")
+        
+        # 测试批量获取：强制分块，跨块的结果合并且去重
+        idioms = [f"成语{i:02d}" for i in range(7)]
+        for name in idioms:
+            db.save_story(name, f"{name}的故事", [f"{name}场景"])
+        db._MAX_IN_PARAMS = 3
+        stories = db.get_stories(idioms + [idiom, idioms[0], "不存在的成语"])
+        assert sorted(stories) == sorted(idioms + [idiom])
+        assert all(stories[name]['scenes'] == [f"{name}场景"] for name in idioms)
+        print(f"📦 批量获取: {len(stories)} 个故事")
+        
+        # 测试分页：部分故事的更新时间相同，按 (updated_at, id) 逆序且不重不漏
+        with db.connections.connection() as conn:
+            conn.execute("UPDATE stories SET updated_at = '2024-01-01 00:00:00' WHERE id % 2 = 0")
+            conn.execute("UPDATE stories SET updated_at = '2024-06-01 00:00:00' WHERE id % 2 = 1")
+            expected = [row[0] for row in conn.execute('SELECT id FROM stories ORDER BY updated_at DESC, id DESC')]
+        
+        print("📄 分页列出故事:")
+        cursors = [None]
+        pages = []
+        while True:
+            page = db.list_stories_page(limit=3, cursor=cursors[-1])
+            pages.append([story['id'] for story in page['stories']])
+            if page['next_cursor'] is None:
+                break
+            cursors.append(page['next_cursor'])
+        ids = [story_id for page_ids in pages for story_id in page_ids]
+        assert ids == expected, (ids, expected)
+        assert all(len(page_ids) <= 3 for page_ids in pages)
+        print(f"  共 {len(pages)} 页, {len(ids)} 个故事")
+        
+        # 上一页：回到保存的游标得到与前进时相同的页面
+        for cursor, page_ids in reversed(list(zip(cursors, pages))):
+            assert [story['id'] for story in db.list_stories_page(limit=3, cursor=cursor)['stories']] == page_ids
+        assert [story['idiom'] for story in db.list_stories(limit=2)] == [
+            story['idiom'] for story in db.list_stories_page(limit=2)['stories']]
+        
+        # 测试存储统计
+        stats = db.get_storage_stats()
+        assert stats['story_count'] == len(idioms) + 1 and stats['total_size'] == 0
+        print(f"📊 故事数量: {stats['story_count']}")
+        db.connections.close()
     
     print("✅ 数据库测试完成!")
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试音频段落并行合成 - 使用带人工延迟的模拟TTS后端对比串行/并行耗时
+"""
+import sys
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from fixed_audio_generator import AudioTrack, FixedAudioGenerator
+
+LATENCY = 0.3
+SEGMENTS = [f"第{i}段故事内容。" for i in range(8)]
+
+def make_stub_backend(fail_index=None):
+    """模拟TTS：固定延迟后返回WAV字节（长度按段落序号区分），fail_index 指定的段落返回失败"""
+    lock = threading.Lock()
+    state = {'active': 0, 'peak': 0}
+    
+    def backend(text):
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        try:
+            time.sleep(LATENCY)
+            if fail_index is not None and text == SEGMENTS[fail_index]:
+                return None
+            index = SEGMENTS.index(text)
+            return AudioTrack(np.full(1000 + index, index, dtype=np.int16)).to_wav_bytes()
+        finally:
+            with lock:
+                state['active'] -= 1
+    
+    return backend, state
+
+def run_segments(max_workers, fail_index=None):
+    backend, state = make_stub_backend(fail_index)
+    generator = FixedAudioGenerator(tts_backend=backend, max_workers=max_workers)
+    
+    with tempfile.TemporaryDirectory() as job_dir:
+        start_time = time.perf_counter()
+        parts = generator._synthesize_segments(SEGMENTS, Path(job_dir))
+        elapsed = time.perf_counter() - start_time
+    # 每段的第一个采样值即段落序号，用来校验顺序
+    order = [int(part[0]) if len(part) == 1000 + i else None for i, part in enumerate(parts)]
+    return elapsed, order, state['peak']
+
+def test_audio_parallel():
+    """并行合成应接近单段延迟，结果顺序不变，失败段落单独降级"""
+    print("🧪 测试音频段落并行合成...")
+    
+    serial_time, serial_order, _ = run_segments(max_workers=1)
+    parallel_time, parallel_order, peak = run_segments(max_workers=4)
+    
+    print(f"   串行: {serial_time:.2f}秒   并行(4线程): {parallel_time:.2f}秒   加速比: {serial_time / parallel_time:.1f}x")
+    assert serial_order == parallel_order == list(range(len(SEGMENTS)))
+    assert peak <= 4
+    assert parallel_time < serial_time / 2
+    
+    # 单个段落失败时只有该段落走备用方案，其余段落结果不受影响
+    _, order, _ = run_segments(max_workers=4, fail_index=3)
+    assert order == [i if i != 3 else None for i in range(len(SEGMENTS))], order
+    print("   段落3降级为备用音频，顺序保持不变")
+    
+    print("✅ 音频段落并行合成测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_audio_parallel()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+测试内存音轨 - 内存解码、统一采样率、一次性拼接、缓存往返
+"""
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from fixed_audio_generator import AudioTrack, FixedAudioGenerator, CANONICAL_SAMPLE_RATE
+from utils import CacheManager
+
+def stereo_wav(seconds, rate=44100):
+    """生成双声道WAV字节，模拟采样率与统一采样率不同的TTS输出"""
+    import io
+    import wave
+    frames = (np.sin(np.linspace(0, 200 * np.pi, int(seconds * rate))) * 10000).astype(np.int16)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(2)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(np.repeat(frames, 2).tobytes())
+    return buffer.getvalue()
+
+def test_audio_track():
+    """TTS输出在内存中解码并重采样，段落按顺序拼接，时长与段落长度一致"""
+    print("🧪 测试内存音轨...")
+    
+    generator = FixedAudioGenerator(tts_backend=lambda text: stereo_wav(len(text) * 0.1), max_workers=4)
+    story = "从前有一个农夫。" * 30
+    track = generator.synthesize_track(story, "测试成语")
+    
+    segments = generator._split_text(story, generator.segment_chars)
+    assert track is not None
+    assert track.sample_rate == CANONICAL_SAMPLE_RATE
+    assert len(track.segment_lengths) == len(segments)
+    assert abs(track.duration - len(story) * 0.1) < 0.01, track.duration
+    assert track.to_float().shape == (len(track.samples), 1)
+    print(f"   {len(segments)} 个段落，时长 {track.duration:.2f}秒，段落时长 {[round(d, 2) for d in track.segment_durations]}")
+    
+    # 缓存保存PCM和段落长度
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CacheManager(cache_dir)
+        cache.save_cache("audio/测试成语/key", track)
+        cached = cache.get_cached_result("audio/测试成语/key")
+        assert np.array_equal(cached.samples, track.samples)
+        assert cached.segment_lengths == track.segment_lengths
+    
+    print("✅ 内存音轨测试通过")
+    return True
+
+def test_concatenate_speed():
+    """预分配一次拼接 vs 逐段 combined += audio"""
+    print("🧪 测试音轨拼接速度...")
+    from pydub import AudioSegment
+    
+    parts = [np.random.randint(-1000, 1000, CANONICAL_SAMPLE_RATE * 5, dtype=np.int16) for _ in range(60)]
+    
+    start_time = time.perf_counter()
+    combined = AudioSegment.empty()
+    for part in parts:
+        combined += AudioSegment(data=part.tobytes(), sample_width=2, frame_rate=CANONICAL_SAMPLE_RATE, channels=1)
+    pydub_time = time.perf_counter() - start_time
+    
+    start_time = time.perf_counter()
+    track = AudioTrack.concatenate(parts)
+    track_time = time.perf_counter() - start_time
+    
+    assert track.samples.tobytes() == combined.raw_data
+    print(f"   60段x5秒  逐段拼接: {pydub_time * 1000:.1f}ms   预分配拼接: {track_time * 1000:.1f}ms")
+    print("✅ 音轨拼接速度测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_audio_track() and test_concatenate_speed()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+测试批量处理引擎（使用桩流水线，不调用模型）
+"""
+import sys
+import os
+import json
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch_processor import BatchProcessor, IdiomPipeline
+
+class StubPipeline(IdiomPipeline):
+    """各阶段只做简单计算的桩流水线"""
+    
+    def __init__(self, fail_idioms=()):
+        super().__init__()
+        self.fail_idioms = set(fail_idioms)
+        self.processed = []
+    
+    def run_story(self, job):
+        self.processed.append(job['idiom'])
+        time.sleep(0.01)
+        job['story'] = f"{job['idiom']}的故事"
+        return job
+    
+    def run_scenes(self, job):
+        job['scenes'] = [job['story']] * 3
+        return job
+    
+    def run_images(self, job):
+        if job['idiom'] in self.fail_idioms:
+            raise RuntimeError("模拟插画生成失败")
+        job['images'] = list(job['scenes'])
+        return job
+    
+    def run_audio(self, job):
+        job['audio_path'] = f"{job['idiom']}.mp3"
+        return job
+    
+    def run_video(self, job):
+        job['video_path'] = f"{job['idiom']}.mp4"
+        return job
+
+def test_batch_processor():
+    """测试两种调度方式"""
+    run_batch_processor(overlap=False)
+    run_batch_processor(overlap=True)
+
+def run_batch_processor(overlap: bool):
+    """测试清单流式写入和断点续跑"""
+    print(f"🧪 测试批量处理引擎 (流水线并行: {overlap})...")
+    
+    idioms = ["守株待兔", "画蛇添足", "亡羊补牢", "刻舟求剑", "守株待兔"]
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manifest = Path(temp_dir) / "manifest.jsonl"
+        
+        # 第一次运行：一个成语失败，重复成语只处理一次
+        pipeline = StubPipeline(fail_idioms={"亡羊补牢"})
+        summary = BatchProcessor(pipeline, max_in_flight=2, overlap=overlap).run(idioms, manifest)
+        assert summary['success'] == 3 and summary['error'] == 1
+        
+        records = [json.loads(line) for line in manifest.read_text(encoding='utf-8').splitlines()]
+        assert len(records) == 4
+        failed = [r for r in records if r['status'] == 'error']
+        assert failed[0]['idiom'] == "亡羊补牢" and failed[0]['failed_stage'] == "images"
+        print(f"✅ 第一次运行: {summary}")
+        
+        # 模拟崩溃留下的半行记录
+        with open(manifest, 'a', encoding='utf-8') as f:
+            f.write('{"idiom": "刻舟')
+        
+        # 第二次运行：只重跑失败的成语
+        pipeline = StubPipeline()
+        summary = BatchProcessor(pipeline, max_in_flight=2, overlap=overlap).run(idioms, manifest)
+        assert pipeline.processed == ["亡羊补牢"]
+        assert summary['skipped'] == 3 and summary['success'] == 1
+        assert BatchProcessor.load_manifest(manifest)["亡羊补牢"]['status'] == 'success'
+        print(f"✅ 断点续跑: {summary}")
+    
+    print("✅ 批量处理测试完成!")
+
+if __name__ == "__main__":
+    test_batch_processor()
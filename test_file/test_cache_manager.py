@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+测试内容寻址缓存
+"""
+import sys
+import os
+import tempfile
+from pathlib import Path
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from utils import CacheManager, StageFingerprint
+
+def test_cache_manager():
+    """测试缓存读写、命名空间清理和LRU淘汰"""
+    print("🧪 测试缓存管理器...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = CacheManager(Path(temp_dir), max_bytes=50 * 1024)
+        
+        # 文本缓存
+        story_key = cache.get_cache_key("守株待兔", prefix="story/守株待兔")
+        cache.save_cache(story_key, "从前有个农夫...")
+        assert cache.get_cached_result(story_key) == "从前有个农夫..."
+        print("✅ 文本缓存正常")
+        
+        # 图片缓存（相同内容只存一份blob）
+        images = [Image.new('RGB', (64, 64), 'lightblue') for _ in range(3)]
+        images_key = cache.get_cache_key("场景", prefix="images/守株待兔")
+        cache.save_cache(images_key, images)
+        cached_images = cache.get_cached_result(images_key)
+        assert len(cached_images) == 3
+        assert cached_images[0].getpixel((0, 0)) == images[0].getpixel((0, 0))
+        blob_files = [path for path in (Path(temp_dir) / "blobs").rglob("*") if path.is_file()]
+        assert len(blob_files) == 2
+        print("✅ 图片缓存正常")
+        
+        # 按成语清理命名空间
+        cache.clear_idiom("守株待兔")
+        assert cache.get_cached_result(story_key) is None
+        assert cache.get_cached_result(images_key) is None
+        print("✅ 命名空间清理正常")
+        
+        # 超出预算时按LRU淘汰
+        for i in range(10):
+            noise = Image.effect_noise((64, 64), 100 + i).convert('RGB')
+            cache.save_cache(f"images/测试/{i}", noise)
+        stats = cache.get_stats()
+        assert stats['total_bytes'] <= stats['max_bytes']
+        assert stats['evictions'] > 0
+        assert cache.get_cached_result("images/测试/9") is not None
+        print(f"✅ LRU淘汰正常: {stats}")
+    
+    print("✅ 缓存测试完成!")
+
+def test_stage_fingerprint():
+    """测试阶段指纹随输入参数变化"""
+    print("🧪 测试阶段指纹...")
+    
+    params = StageFingerprint.image_params()
+    base = StageFingerprint.compute("image", scene="农夫在田里工作", **params)
+    
+    assert base == StageFingerprint.compute("image", scene="农夫在田里工作", **dict(reversed(list(params.items()))))
+    assert base != StageFingerprint.compute("image", scene="农夫在树下等待", **params)
+    assert base != StageFingerprint.compute("image", scene="农夫在田里工作", **{**params, 'steps': Config.INFERENCE_STEPS + 1})
+    assert base != StageFingerprint.compute("image", scene="农夫在田里工作", **{**params, 'width': Config.IMAGE_WIDTH * 2})
+    print("✅ 阶段指纹测试完成!")
+
+if __name__ == "__main__":
+    test_cache_manager()
+    test_stage_fingerprint()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+测试字幕渲染 - 字幕时间线、跨故事行缓存，以及15个场景故事加字幕与不加字幕的耗时对比
+"""
+import sys
+import os
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import caption_renderer
+from caption_renderer import CaptionRenderer, caption_cues
+from fixed_audio_generator import FixedAudioGenerator
+from ffmpeg_video_composer import FFmpegVideoComposer, probe_duration
+from test_audio_track import stereo_wav
+from test_ffmpeg_video import create_test_images
+
+SCENES = 15
+STORY = "".join(f"第{i + 1}段故事里，农夫守着树桩等待兔子。" for i in range(SCENES))
+
+def synthesize(story, idiom):
+    generator = FixedAudioGenerator(tts_backend=lambda text: stereo_wav(len(text) * 0.12), max_workers=4)
+    return generator.synthesize_track(story, idiom)
+
+def test_caption_timeline():
+    """场景与字幕边界合并，每种组合只合成一次，字幕像素只改动字幕区域"""
+    print("🧪 测试字幕时间线...")
+    
+    cues = [(0.0, 1.5, "守株待兔"), (1.5, 3.0, "农夫天天守在树桩旁边等兔子")]
+    timeline = CaptionRenderer.timeline([2.0, 2.0], cues)
+    assert timeline == [(0, 0, 1.5), (0, 1, 0.5), (1, 1, 1.0), (1, None, 1.0)], timeline
+    assert CaptionRenderer.cue_index_at(cues, 1.5) == 1 and CaptionRenderer.cue_index_at(cues, 3.5) is None
+    
+    renderer = CaptionRenderer(360, 640)
+    frames = [image.resize((360, 640)) for image in create_test_images(2)]
+    out_frames, out_durations = renderer.apply(frames, [2.0, 2.0], cues)
+    assert len(out_frames) == 4 and abs(sum(out_durations) - 4.0) < 1e-9
+    assert out_frames[3] is frames[1]
+    
+    overlay = renderer.overlay(cues[1][2])
+    assert overlay.x >= 0 and overlay.x + overlay.width <= 360 and overlay.y + overlay.height <= 640
+    original = np.asarray(frames[0])
+    captioned = np.asarray(out_frames[1])
+    changed = np.argwhere((captioned != original).any(axis=2))
+    assert len(changed) > 0
+    assert changed[:, 0].min() >= overlay.y and changed[:, 0].max() < overlay.y + overlay.height
+    
+    print("✅ 字幕时间线测试通过")
+    return True
+
+def test_caption_benchmark():
+    """15个场景的故事：加字幕与不加字幕的编码耗时，以及逐帧绘制文字的对照"""
+    print("🧪 测试字幕叠加开销...")
+    
+    track = synthesize(STORY, "守株待兔")
+    cues = caption_cues(track)
+    images = create_test_images(SCENES)
+    durations = track.scene_durations(SCENES)
+    assert len(cues) == SCENES
+    
+    with tempfile.TemporaryDirectory() as output_dir:
+        plain = FFmpegVideoComposer(output_dir=output_dir, mode="single", segment_cache=False, captions=False)
+        captioned = FFmpegVideoComposer(output_dir=output_dir, mode="single", segment_cache=False, captions=True)
+        
+        start_time = time.perf_counter()
+        plain_path = plain.create_video(images, track, "无字幕", durations)
+        plain_time = time.perf_counter() - start_time
+        
+        start_time = time.perf_counter()
+        captioned_path = captioned.create_video(images, track, "有字幕", durations)
+        captioned_time = time.perf_counter() - start_time
+        
+        assert plain_path and captioned_path
+        assert abs(probe_duration(captioned_path) - track.duration) < 0.2
+        print(f"   {track.duration:.1f}秒音频 {len(cues)} 条字幕")
+        print(f"   无字幕 {plain_time:.2f}秒   有字幕 {captioned_time:.2f}秒   "
+              f"开销 {(captioned_time / plain_time - 1) * 100:+.1f}%")
+    
+    # 对照：逐帧用PIL绘制文字（仅计算绘制，不含编码）
+    from PIL import ImageDraw
+    renderer = CaptionRenderer(plain.width, plain.height)
+    font = caption_renderer.glyph_atlas.font(renderer.font_path, renderer.font_size)
+    scene = images[0].resize((plain.width, plain.height))
+    frame_count = int(track.duration * plain.fps)
+    start_time = time.perf_counter()
+    for frame_index in range(frame_count):
+        cue_index = renderer.cue_index_at(cues, frame_index / plain.fps)
+        frame = scene.copy()
+        if cue_index is not None:
+            ImageDraw.Draw(frame).text((plain.width // 2, int(plain.height * 0.85)), cues[cue_index][2], font=font,
+                                       fill="white", stroke_width=renderer.stroke, stroke_fill="black", anchor="ms")
+    naive_time = time.perf_counter() - start_time
+    print(f"   对照：逐帧绘制 {frame_count} 帧文字 {naive_time:.2f}秒")
+    
+    print("✅ 字幕叠加开销测试通过")
+    return True
+
+def test_line_cache_across_stories():
+    """第二个故事复用相同的字幕行与字形"""
+    print("🧪 测试跨故事字幕缓存...")
+    
+    caption_renderer._line_cache.clear()
+    first = CaptionRenderer(1080, 1920)
+    for text in ["守株待兔", "农夫天天守在树桩旁"]:
+        first.overlay(text)
+    misses = caption_renderer.line_cache_stats['misses']
+    glyphs = caption_renderer.glyph_atlas.stats['glyphs']
+    
+    # 新故事新建渲染器，重复出现的字幕行直接命中
+    hits = caption_renderer.line_cache_stats['hits']
+    second = CaptionRenderer(1080, 1920)
+    second.overlay("守株待兔")
+    assert caption_renderer.line_cache_stats['hits'] == hits + 1
+    assert caption_renderer.line_cache_stats['misses'] == misses
+    
+    second.overlay("兔守在树桩旁")
+    assert caption_renderer.glyph_atlas.stats['glyphs'] == glyphs
+    print(f"   行缓存 {caption_renderer.line_cache_stats}，字形 {caption_renderer.glyph_atlas.stats}")
+    
+    print("✅ 跨故事字幕缓存测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_caption_timeline() and test_line_cache_across_stories() and test_caption_benchmark()
+    sys.exit(0 if success else 1)
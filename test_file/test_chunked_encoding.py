@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+测试分片并行编码 - 15个场景的合成故事，并行数从1扩展到CPU核数
+"""
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_video_composer import FFmpegVideoComposer, probe_duration
+from test_ffmpeg_video import create_test_images, create_test_track
+
+SCENES = 15
+SCENE_SECONDS = 1.2
+
+def worker_counts():
+    """1, 2, 4, ... 直到CPU核数"""
+    cpu_count = os.cpu_count() or 1
+    counts = []
+    workers = 1
+    while workers < cpu_count:
+        counts.append(workers)
+        workers *= 2
+    counts.append(cpu_count)
+    return counts
+
+def test_chunked_encoding():
+    """分片编码后流拷贝拼接，时长与单次编码一致"""
+    print("🧪 测试分片并行编码...")
+    
+    images = create_test_images(SCENES)
+    track = create_test_track(SCENES * SCENE_SECONDS)
+    
+    with tempfile.TemporaryDirectory() as output_dir:
+        composer = FFmpegVideoComposer(output_dir=output_dir, segment_cache=False)  # 测量纯编码耗时，不复用片段
+        
+        # 帧数按累计时长取整，总帧数与总时长一致
+        counts = composer._frame_counts([SCENE_SECONDS] * SCENES)
+        assert sum(counts) == round(SCENES * SCENE_SECONDS * composer.fps), counts
+        composer.chunk_seconds = 0.5
+        assert len(composer._plan_segments([SCENE_SECONDS] * SCENES)) == SCENES * 3
+        composer.chunk_seconds = 0
+        
+        start_time = time.perf_counter()
+        single_path = composer.create_video(images, track, "单次编码", mode="single")
+        single_time = time.perf_counter() - start_time
+        assert single_path
+        print(f"   单次编码: {single_time:.2f}秒")
+        
+        for workers in worker_counts():
+            composer.workers = workers
+            start_time = time.perf_counter()
+            chunked_path = composer.create_video(images, track, f"分片编码_{workers}", mode="chunked")
+            elapsed = time.perf_counter() - start_time
+            
+            assert chunked_path
+            duration = probe_duration(chunked_path)
+            assert abs(duration - SCENES * SCENE_SECONDS) < 0.2, duration
+            print(f"   分片编码 x{workers:<3} {elapsed:.2f}秒  加速比 {single_time / elapsed:.2f}x  时长 {duration:.2f}秒")
+    
+    print("✅ 分片并行编码测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_chunked_encoding()
+    sys.exit(0 if success else 1)
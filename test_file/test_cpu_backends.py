@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试CPU推理后端 - 导出目录与线程数，以及小型随机权重管道在 PyTorch / ONNX Runtime / OpenVINO 上的每张耗时对比
+"""
+import sys
+import os
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_backends
+from config import Config
+from image_generator import ImageGenerator
+from prompt_embedding_cache import PromptEmbeddingCache
+from test_image_batching import SCENES, tiny_pipeline
+from utils import StageFingerprint
+
+STEPS = 4
+IMAGES = 4
+
+def test_backend_selection():
+    """每种后端与量化组合导出到各自目录，非 PyTorch 后端单独参与缓存指纹"""
+    print("🧪 测试后端选择...")
+    
+    dirs = {image_backends.export_dir(backend, "runwayml/stable-diffusion-v1-5", int8)
+            for backend in ("onnx", "openvino") for int8 in (False, True)}
+    assert len(dirs) == 4
+    assert image_backends.export_dir("onnx", "runwayml/stable-diffusion-v1-5", True).name == "onnx-int8"
+    assert image_backends.backend_tag("pytorch", True) == "pytorch"
+    assert image_backends.cpu_threads() >= 1
+    
+    original = Config.SD_BACKEND, Config.SD_INT8
+    try:
+        Config.SD_BACKEND, Config.SD_INT8 = "pytorch", True
+        baseline = StageFingerprint.image_params()
+        assert 'backend' not in baseline
+        Config.SD_BACKEND = "onnx"
+        assert StageFingerprint.image_params()['backend'] == image_backends.backend_tag("onnx") == "onnx-int8"
+        # 生成器自带后端时以生成器为准；指纹与嵌入缓存使用同一后端标识
+        generator = SimpleNamespace(backend="openvino")
+        assert StageFingerprint.image_params(generator)['backend'] == "openvino-int8"
+        keys = {PromptEmbeddingCache.model_key(None, "model", backend) for backend in ("pytorch", "onnx")}
+        Config.SD_INT8 = False
+        keys.add(PromptEmbeddingCache.model_key(None, "model", "onnx"))
+        assert len(keys) == 3, keys
+    finally:
+        Config.SD_BACKEND, Config.SD_INT8 = original
+    
+    try:
+        image_backends.load_pipeline("tensorrt")
+        assert False, "不支持的后端应抛出异常"
+    except ValueError:
+        pass
+    print(f"   推理线程数 {image_backends.cpu_threads()}")
+    
+    print("✅ 后端选择测试通过")
+    return True
+
+def seconds_per_image(generator):
+    generator.generate_story_images(SCENES[:1], seeds=[0])
+    start_time = time.perf_counter()
+    images = generator.generate_story_images(SCENES[:IMAGES], seeds=list(range(IMAGES)))
+    assert all(image is not None for image in images)
+    return (time.perf_counter() - start_time) / IMAGES
+
+def test_cpu_backend_benchmark():
+    """小型随机权重管道：PyTorch 基准与各导出后端的每张耗时"""
+    print("🧪 测试CPU后端耗时...")
+    
+    try:
+        pipe = tiny_pipeline()
+    except ImportError as e:
+        print(f"   跳过：缺少 diffusers/transformers（{e}）")
+        return True
+    pipe.set_progress_bar_config(disable=True)
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        model_dir = Path(temp_dir) / "tiny-sd"
+        pipe.save_pretrained(model_dir)
+        options = dict(device="cpu", steps=STEPS, width=64, height=64, batch_size=1, embedding_cache=False)
+        
+        baseline = seconds_per_image(ImageGenerator(pipe=pipe, **options))
+        print(f"   pytorch      {baseline:.3f}秒/张")
+        
+        for backend in ("onnx", "openvino"):
+            for int8 in (False, True):
+                tag = image_backends.backend_tag(backend, int8)
+                try:
+                    start_time = time.perf_counter()
+                    cpu_pipe = image_backends.load_pipeline(backend, str(model_dir), int8=int8,
+                                                            root=Path(temp_dir) / "exported")
+                    export_time = time.perf_counter() - start_time
+                except ImportError as e:
+                    print(f"   {tag:<12} 跳过：缺少依赖（{e}）")
+                    continue
+                cpu_pipe.set_progress_bar_config(disable=True)
+                elapsed = seconds_per_image(ImageGenerator(pipe=cpu_pipe, backend=backend, **options))
+                print(f"   {tag:<12} {elapsed:.3f}秒/张（{baseline / elapsed:.2f}x），导出+加载 {export_time:.1f}秒")
+                
+                # 第二次加载直接使用缓存的导出结果
+                start_time = time.perf_counter()
+                image_backends.load_pipeline(backend, str(model_dir), int8=int8, root=Path(temp_dir) / "exported")
+                assert time.perf_counter() - start_time < export_time
+    
+    print("✅ CPU后端耗时测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_backend_selection() and test_cpu_backend_benchmark()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+数据库写入测试 - 线程长连接+WAL 的正确性；性能对比每次新建连接(旧) vs 线程长连接+WAL(新)
+
+性能对比耗时较长，不会被 pytest 收集，直接运行本脚本时执行。
+"""
+import sys
+import os
+import time
+import sqlite3
+import threading
+import tempfile
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_manager import DatabaseManager
+
+STORY_COUNT = int(os.getenv('BENCH_STORY_COUNT', 10000))
+SCENES_PER_STORY = 5
+
+def legacy_save_story(db_path: str, idiom: str, story_text: str, scenes: list) -> int:
+    """旧实现：每次调用新建连接，逐条插入场景"""
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO stories (idiom, story_text, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', (idiom, story_text))
+        story_id = cursor.lastrowid
+        cursor.execute('DELETE FROM scenes WHERE story_id = ?', (story_id,))
+        for i, scene in enumerate(scenes):
+            cursor.execute('''
+                INSERT INTO scenes (story_id, scene_text, scene_order)
+                VALUES (?, ?, ?)
+            ''', (story_id, scene, i + 1))
+        conn.commit()
+        return story_id
+
+def run_benchmark(label: str, save_story) -> float:
+    scenes = [f"场景描述 {i}" for i in range(SCENES_PER_STORY)]
+    start_time = time.perf_counter()
+    for i in range(STORY_COUNT):
+        save_story(f"成语{i:05d}", "从前有一个农夫，每天都在田里工作。" * 5, scenes)
+    elapsed = time.perf_counter() - start_time
+    rate = STORY_COUNT / elapsed
+    print(f"  {label}: {elapsed:.2f}秒, {rate:.0f} 故事/秒")
+    return rate
+
+def test_connection_reuse():
+    """同一线程复用一个 WAL 连接，不同线程各自持有连接，重复保存覆盖旧场景"""
+    print("🧪 测试线程长连接...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = DatabaseManager(str(Path(temp_dir) / "pooled.db"), str(Path(temp_dir) / "storage"))
+        conn = manager.connections.connection()
+        assert manager.connections.connection() is conn
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        
+        other = []
+        thread = threading.Thread(target=lambda: other.append(manager.connections.connection()))
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+        
+        manager.save_story("守株待兔", "农夫守着树桩等兔子。", ["种田", "兔子撞树", "守株"])
+        manager.save_story("守株待兔", "农夫守着树桩等兔子。", ["种田", "守株"])
+        story = manager.get_story("守株待兔")
+        assert story['scenes'] == ["种田", "守株"], story['scenes']
+        assert manager.connections.connection() is conn
+        manager.connections.close()
+    
+    print("✅ 线程长连接测试通过")
+    return True
+
+def benchmark_database_speed():
+    """对比新旧两种写入方式的吞吐量"""
+    print(f"🧪 数据库写入性能测试 ({STORY_COUNT} 个故事, 每个 {SCENES_PER_STORY} 个场景)...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 旧：回滚日志模式 + 每次新建连接
+        legacy_db = str(Path(temp_dir) / "legacy.db")
+        DatabaseManager(legacy_db, str(Path(temp_dir) / "storage")).connections.close()
+        with sqlite3.connect(legacy_db) as conn:
+            conn.execute('PRAGMA journal_mode=DELETE')
+        legacy_rate = run_benchmark("旧实现(每次新建连接)", lambda *args: legacy_save_story(legacy_db, *args))
+        
+        # 新：线程长连接 + WAL + executemany
+        manager = DatabaseManager(str(Path(temp_dir) / "pooled.db"), str(Path(temp_dir) / "storage"))
+        pooled_rate = run_benchmark("新实现(长连接+WAL)", manager.save_story)
+        manager.connections.close()
+    
+    print(f"✅ 加速比: {pooled_rate / legacy_rate:.1f}x")
+
+if __name__ == "__main__":
+    success = test_connection_reuse()
+    benchmark_database_speed()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试 DeepSeek 异步客户端 - 使用本地模拟的 OpenAI 兼容接口
+"""
+import sys
+import os
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+LATENCY = 0.2
+
+class MockHandler(BaseHTTPRequestHandler):
+    """模拟 /chat/completions：每个成语第一次返回429，"服务错误"固定返回400"""
+    seen = set()
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+    
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][0]['content']
+        idiom = prompt.split('"')[1]
+        
+        with MockHandler.lock:
+            first = idiom not in MockHandler.seen
+            MockHandler.seen.add(idiom)
+            MockHandler.active += 1
+            MockHandler.peak = max(MockHandler.peak, MockHandler.active)
+        
+        try:
+            time.sleep(LATENCY)
+            if idiom == "服务错误":
+                self._reply(400, {'error': {'message': 'bad request'}})
+            elif first:
+                self._reply(429, {'error': {'message': 'rate limited'}}, {'Retry-After': '0.1'})
+            else:
+                self._reply(200, {'choices': [{'message': {'role': 'assistant', 'content': f" {idiom}的故事 "}}]})
+        finally:
+            with MockHandler.lock:
+                MockHandler.active -= 1
+    
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+def test_deepseek_client():
+    """并发生成故事：429 自动重试，400 直接失败，并发不超过上限"""
+    print("🧪 测试 DeepSeek 异步客户端...")
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    from config import Config
+    from deepseek_client import DeepSeekStoryClient, DeepSeekAPIError
+    
+    # 指向模拟服务，结束后恢复环境变量与配置，不影响同一进程中的其他测试
+    original_env = os.environ.get('DEEPSEEK_BASE_URL')
+    original_config = Config.DEEPSEEK_BASE_URL
+    os.environ['DEEPSEEK_BASE_URL'] = f"http://127.0.0.1:{server.server_port}/v1"
+    Config.DEEPSEEK_BASE_URL = os.environ['DEEPSEEK_BASE_URL']
+    
+    idioms = [f"成语{i}" for i in range(12)] + ["服务错误"]
+    client = None
+    
+    try:
+        client = DeepSeekStoryClient(max_concurrency=4, rate_limit=50, max_retries=3)
+        start_time = time.perf_counter()
+        results = client.generate_stories(idioms)
+        elapsed = time.perf_counter() - start_time
+        
+        for idiom in idioms[:-1]:
+            assert results[idiom] == f"{idiom}的故事", results[idiom]
+        assert isinstance(results["服务错误"], DeepSeekAPIError)
+        assert results["服务错误"].status_code == 400
+        assert MockHandler.peak <= 4, MockHandler.peak
+        
+        # 顺序执行需要 (12*2+1)*LATENCY 秒
+        sequential = (len(idioms) * 2 - 1) * LATENCY
+        print(f"   并发生成 {len(idioms)} 个故事耗时 {elapsed:.2f}秒（顺序约 {sequential:.2f}秒），峰值并发 {MockHandler.peak}")
+        print(f"   统计: {client.stats}")
+        assert elapsed < sequential / 2
+        
+        # 同步单次调用复用同一连接池
+        assert client.generate_story("成语0") == "成语0的故事"
+    finally:
+        if client is not None:
+            client.close()
+        server.shutdown()
+        if original_env is None:
+            os.environ.pop('DEEPSEEK_BASE_URL', None)
+        else:
+            os.environ['DEEPSEEK_BASE_URL'] = original_env
+        Config.DEEPSEEK_BASE_URL = original_config
+    
+    print("✅ DeepSeek 异步客户端测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_deepseek_client()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+测试FFmpeg视频合成后端 - 与MoviePy逐帧渲染对比编码耗时
+"""
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from config import Config
+from fixed_audio_generator import AudioTrack
+from ffmpeg_video_composer import FFmpegVideoComposer, probe_duration
+
+SCENES = 5
+AUDIO_SECONDS = 10
+
+def create_test_images(count=SCENES, size=(512, 512)):
+    """生成带编号的纯色测试插画"""
+    images = []
+    for i in range(count):
+        image = Image.new('RGB', size, (40 * i % 255, 120, 200 - 30 * i % 200))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle([50 + i * 20, 50, 250 + i * 20, 250], fill=(255, 255, 255))
+        draw.text((60, 300), f"Scene {i + 1}", fill=(0, 0, 0))
+        images.append(image)
+    return images
+
+def create_test_track(seconds=AUDIO_SECONDS, sample_rate=22050):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return AudioTrack((np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16), sample_rate)
+
+def test_ffmpeg_video():
+    """FFmpeg后端输出时长正确，并与MoviePy后端对比耗时"""
+    print("🧪 测试FFmpeg视频合成后端...")
+    
+    images = create_test_images()
+    track = create_test_track()
+    
+    with tempfile.TemporaryDirectory() as output_dir:
+        composer = FFmpegVideoComposer(output_dir=output_dir, segment_cache=False)
+        start_time = time.perf_counter()
+        video_path = composer.create_video(images, track, "测试成语")
+        ffmpeg_time = time.perf_counter() - start_time
+        
+        assert video_path and os.path.getsize(video_path) > 0
+        duration = probe_duration(video_path)
+        assert abs(duration - AUDIO_SECONDS) < 0.2, duration
+        print(f"   FFmpeg后端: {ffmpeg_time:.2f}秒  ({Config.VIDEO_WIDTH}x{Config.VIDEO_HEIGHT}, 时长 {duration:.2f}秒)")
+        
+        # 自定义每张图片时长
+        durations = [1.0, 2.0, 3.0, 2.0, 2.0]
+        video_path = composer.create_video(images, track, "测试成语_时长", durations=durations)
+        assert abs(probe_duration(video_path) - sum(durations)) < 0.2
+        
+        from fixed_video_composer import FixedVideoComposer, MOVIEPY_AVAILABLE
+        if not MOVIEPY_AVAILABLE:
+            print("   MoviePy 不可用，跳过对比")
+        else:
+            moviepy_composer = FixedVideoComposer(fps=Config.VIDEO_FPS, bitrate=Config.VIDEO_BITRATE)
+            moviepy_composer.output_dir = composer.output_dir
+            start_time = time.perf_counter()
+            moviepy_path = moviepy_composer.create_video(images, track, "测试成语_moviepy")
+            moviepy_time = time.perf_counter() - start_time
+            assert moviepy_path
+            print(f"   MoviePy后端: {moviepy_time:.2f}秒   加速比: {moviepy_time / ffmpeg_time:.1f}x")
+    
+    print("✅ FFmpeg视频合成后端测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_ffmpeg_video()
+    sys.exit(0 if success else 1)
@@ -7,7 +7,7 @@ import os
 import time
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from modules.image_generator import ImageGenerator
+from image_generator import ImageGenerator
 from loguru import logger
 
 def test_gpu_speed():
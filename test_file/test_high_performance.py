@@ -16,7 +16,7 @@ os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from modules.image_generator import ImageGenerator
+from image_generator import ImageGenerator
 from loguru import logger
 
 def test_high_performance():
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+测试插画按批生成 - 顺序与种子、OOM 减半重试，以及小型随机权重管道在 CPU 上批大小 1-8 的吞吐对比
+"""
+import sys
+import os
+import json
+import tempfile
+import time
+from types import SimpleNamespace
+
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_generator
+from image_generator import NEGATIVE_PROMPT, ImageGenerator
+
+SCENES = [f"第{i + 1}个场景：农夫守在树桩旁" for i in range(8)]
+
+class FakePipeline:
+    """记录每次调用的假管道：图片颜色由种子决定，批大小超过 max_batch 时抛出 OOM"""
+    
+    def __init__(self, max_batch=None):
+        self.max_batch = max_batch
+        self.calls = []
+    
+    def __call__(self, prompt, negative_prompt, generator, **kwargs):
+        if self.max_batch and len(prompt) > self.max_batch:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        self.calls.append({'prompt': list(prompt), 'negative_prompt': list(negative_prompt)})
+        images = []
+        for text, rng in zip(prompt, generator):
+            value = int(torch.randint(0, 256, (1,), generator=rng))
+            images.append(Image.new('RGB', (8, 8), (value, len(text) % 256, 0)))
+        return SimpleNamespace(images=images)
+
+def test_batch_order_and_seeds():
+    """整批一次调用，结果与回调按场景顺序，相同种子得到相同图片，负面提示词逐项传入"""
+    print("🧪 测试按批生成顺序与种子...")
+    
+    pipe = FakePipeline()
+    generator = ImageGenerator(pipe=pipe, device="cpu", batch_size=4, width=64, height=64)
+    seeds = list(range(100, 100 + len(SCENES)))
+    negatives = [f"{NEGATIVE_PROMPT}, 第{i}项" for i in range(len(SCENES))]
+    
+    progress = []
+    images = generator.generate_story_images(SCENES, progress_callback=lambda i, image: progress.append(i),
+                                             seeds=seeds, negative_prompts=negatives)
+    assert progress == list(range(len(SCENES))), progress
+    assert [len(call['prompt']) for call in pipe.calls] == [4, 4]
+    assert pipe.calls[1]['negative_prompt'] == negatives[4:]
+    assert all(call['prompt'][0].startswith(SCENES[4 * k]) for k, call in enumerate(pipe.calls))
+    
+    # 同一种子换到另一批、另一位置，图片不变
+    single = generator.generate_story_images([SCENES[5]], seeds=[seeds[5]])
+    assert single[0].getpixel((0, 0)) == images[5].getpixel((0, 0))
+    print(f"   {len(SCENES)} 个场景 {len(pipe.calls) - 1} 次管道调用")
+    
+    print("✅ 按批生成顺序与种子测试通过")
+    return True
+
+def test_oom_fallback():
+    """OOM 时批大小减半重试并记住上限，其他错误只让该批的位置为None"""
+    print("🧪 测试OOM回退...")
+    
+    pipe = FakePipeline(max_batch=2)
+    generator = ImageGenerator(pipe=pipe, device="cpu", batch_size=8, width=64, height=64)
+    images = generator.generate_story_images(SCENES)
+    assert all(image is not None for image in images)
+    assert [len(call['prompt']) for call in pipe.calls] == [2, 2, 2, 2]
+    assert generator.stats['oom_retries'] == 2 and generator._oom_limit == 2
+    
+    # 可用内存只够两张时直接按两张分批
+    original = image_generator.PerformanceMonitor.get_free_memory_mb
+    image_generator.PerformanceMonitor.get_free_memory_mb = staticmethod(lambda device="cuda": 2 * 1800 / 64 / 0.8)
+    try:
+        generator = ImageGenerator(pipe=FakePipeline(), device="cpu", batch_size=8, width=64, height=64)
+        generator.generate_story_images(SCENES[:4])
+        assert [len(call['prompt']) for call in generator.pipe.calls] == [2, 2]
+    finally:
+        image_generator.PerformanceMonitor.get_free_memory_mb = original
+    
+    def broken(**kwargs):
+        raise ValueError("管道错误")
+    
+    generator = ImageGenerator(pipe=broken, device="cpu", batch_size=4, width=64, height=64)
+    progress = []
+    assert generator.generate_story_images(SCENES[:3], lambda i, image: progress.append(image)) == [None] * 3
+    assert progress == [None] * 3
+    
+    print("✅ OOM回退测试通过")
+    return True
+
+def tiny_pipeline():
+    """随机权重的小型 Stable Diffusion 管道（64x64），分词器由单字节词表构建，不需要联网"""
+    from diffusers import AutoencoderKL, DDIMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+    
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(block_out_channels=(32, 64), layers_per_block=1, sample_size=32, in_channels=4,
+                                out_channels=4, down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+                                up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"), cross_attention_dim=32)
+    vae = AutoencoderKL(block_out_channels=(32, 64), in_channels=3, out_channels=3,
+                        down_block_types=("DownEncoderBlock2D",) * 2, up_block_types=("UpDecoderBlock2D",) * 2,
+                        latent_channels=4)
+    text_encoder = CLIPTextModel(CLIPTextConfig(bos_token_id=0, eos_token_id=2, hidden_size=32, intermediate_size=37,
+                                                num_attention_heads=4, num_hidden_layers=5, pad_token_id=1,
+                                                vocab_size=1000))
+    scheduler = DDIMScheduler(beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear", clip_sample=False,
+                              set_alpha_to_one=False)
+    
+    with tempfile.TemporaryDirectory() as vocab_dir:
+        chars = list(bytes_to_unicode().values())
+        vocab = {token: i for i, token in enumerate(["<|startoftext|>", "<|endoftext|>"] + chars
+                                                    + [f"{char}</w>" for char in chars])}
+        with open(os.path.join(vocab_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(vocab, f)
+        with open(os.path.join(vocab_dir, "merges.txt"), "w", encoding="utf-8") as f:
+            f.write("#version: 0.2\n")
+        tokenizer = CLIPTokenizer(os.path.join(vocab_dir, "vocab.json"), os.path.join(vocab_dir, "merges.txt"))
+    
+    return StableDiffusionPipeline(unet=unet, vae=vae, text_encoder=text_encoder, tokenizer=tokenizer,
+                                   scheduler=scheduler, safety_checker=None, feature_extractor=None,
+                                   requires_safety_checker=False)
+
+def test_batch_benchmark():
+    """小型随机权重管道在 CPU 上，批大小 1-8 生成 8 张图片的吞吐"""
+    print("🧪 测试批大小吞吐...")
+    
+    try:
+        pipe = tiny_pipeline()
+    except ImportError as e:
+        print(f"   跳过：缺少 diffusers/transformers（{e}）")
+        return True
+    pipe.set_progress_bar_config(disable=True)
+    
+    # 预热一次，排除首次调用的初始化开销
+    ImageGenerator(pipe=pipe, device="cpu", steps=4, width=64, height=64).generate_story_images(SCENES[:1])
+    
+    baseline = None
+    for batch_size in range(1, 9):
+        generator = ImageGenerator(pipe=pipe, device="cpu", batch_size=batch_size, steps=4, width=64, height=64)
+        start_time = time.perf_counter()
+        images = generator.generate_story_images(SCENES, seeds=list(range(len(SCENES))))
+        elapsed = time.perf_counter() - start_time
+        assert all(image is not None and image.size == (64, 64) for image in images)
+        throughput = len(SCENES) / elapsed
+        baseline = baseline or throughput
+        print(f"   批大小 {batch_size}: {throughput:.2f} 张/秒（{throughput / baseline:.2f}x）")
+    
+    print("✅ 批大小吞吐测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_batch_order_and_seeds() and test_oom_fallback() and test_batch_benchmark()
+    sys.exit(0 if success else 1)
@@ -6,7 +6,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from modules.image_generator import ImageGenerator
+from image_generator import ImageGenerator
 from modules.scene_extractor import SceneExtractor
 from loguru import logger
 import streamlit as st
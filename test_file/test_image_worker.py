@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+测试图像工作进程 - 并发请求合并成一批、PNG 与共享内存回传一致、工作进程崩溃不影响前端、
+随机密钥文件与未送达的共享内存段回收、回调中途抛出异常后同一连接上的下一个请求不受影响
+"""
+import sys
+import os
+import multiprocessing
+import socket
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import image_worker
+from config import Config
+from image_generator import ImageGenerator
+from image_worker import ImageWorker, ImageWorkerClient, _Request
+from model_registry import ModelRegistry
+from test_image_batching import SCENES, FakePipeline
+from utils import StageFingerprint
+
+CRASH_SCENE = "崩溃"
+
+class CrashablePipeline(FakePipeline):
+    """遇到特定场景时直接终止进程，模拟 CUDA 故障"""
+    
+    def __call__(self, prompt, negative_prompt, generator, **kwargs):
+        if any(text.startswith(CRASH_SCENE) for text in prompt):
+            os._exit(1)
+        return super().__call__(prompt, negative_prompt, generator, **kwargs)
+
+def fake_generator():
+    return ImageGenerator(pipe=CrashablePipeline(), device="cpu", batch_size=8, width=64, height=64,
+                          embedding_cache=False, model_key="fake")
+
+def serve(address, coalesce_ms):
+    ImageWorker(address=address, authkey=b"test", generator_factory=fake_generator,
+                coalesce_ms=coalesce_ms).serve_forever()
+
+def free_address():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return ("127.0.0.1", sock.getsockname()[1])
+
+def start_worker(address, coalesce_ms=300):
+    process = multiprocessing.get_context("spawn").Process(target=serve, args=(address, coalesce_ms), daemon=True)
+    process.start()
+    client = ImageWorkerClient(address=address, authkey=b"test", autostart=False)
+    deadline = time.time() + 30
+    while client.status() is None:
+        assert time.time() < deadline and process.is_alive(), "工作进程启动失败"
+        time.sleep(0.1)
+    return process
+
+def test_coalesced_requests():
+    """两个前端同时提交：工作进程合并为一次推理，结果按各自顺序回传，缓存指纹与本地生成一致"""
+    print("🧪 测试并发请求合并...")
+    
+    address = free_address()
+    process = start_worker(address)
+    client = ImageWorkerClient(address=address, authkey=b"test", autostart=False)
+    try:
+        progress = {0: [], 1: []}
+        
+        def front_end(k):
+            scenes = SCENES[3 * k:3 * k + 3]
+            return client.generate_story_images(scenes, seeds=list(range(3)),
+                                                progress_callback=lambda i, image: progress[k].append(i))
+        
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(front_end, range(2)))
+        elapsed = time.perf_counter() - start_time
+        
+        assert all(image is not None and image.size == (8, 8) for images in results for image in images)
+        assert progress == {0: [0, 1, 2], 1: [0, 1, 2]}, progress
+        # 同一种子、不同场景：图片只差在由提示词长度决定的通道上
+        assert results[0][0].getpixel((0, 0))[0] == results[1][0].getpixel((0, 0))[0]
+        status = client.status()
+        assert status['worker']['requests'] == 2 and status['worker']['dispatches'] == 1, status
+        assert status['models'][0]['state'] == 'loaded'
+        print(f"   2 个请求合并为 {status['worker']['dispatches']} 次推理，{elapsed:.2f}秒")
+        
+        local = fake_generator()
+        assert StageFingerprint.image_params(client) == StageFingerprint.image_params(local)
+        
+        # 共享内存回传与PNG结果一致，且不留下共享内存段
+        shm_client = ImageWorkerClient(address=address, authkey=b"test", autostart=False, transport="shm")
+        before = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+        png_images = client.generate_story_images(SCENES, seeds=list(range(len(SCENES))))
+        shm_images = shm_client.generate_story_images(SCENES, seeds=list(range(len(SCENES))))
+        for a, b in zip(png_images, shm_images):
+            assert np.array_equal(np.asarray(a.convert("RGB")), np.asarray(b))
+        if before:
+            assert set(os.listdir("/dev/shm")) <= before
+        shm_client.cleanup()
+    finally:
+        client.shutdown_worker()
+        process.join(timeout=10)
+    assert process.exitcode == 0
+    
+    print("✅ 并发请求合并测试通过")
+    return True
+
+def test_worker_crash_isolation():
+    """工作进程崩溃时前端得到异常而不退出，重启工作进程后继续可用"""
+    print("🧪 测试工作进程崩溃隔离...")
+    
+    address = free_address()
+    process = start_worker(address, coalesce_ms=0)
+    client = ImageWorkerClient(address=address, authkey=b"test", autostart=False)
+    try:
+        client.generate_story_images([CRASH_SCENE])
+        assert False, "工作进程崩溃应抛出异常"
+    except RuntimeError as e:
+        print(f"   前端收到: {e}")
+    process.join(timeout=10)
+    assert process.exitcode == 1
+    assert client.status() is None
+    
+    process = start_worker(address, coalesce_ms=0)
+    try:
+        assert client.generate_image(SCENES[0]) is not None
+    finally:
+        client.shutdown_worker()
+        process.join(timeout=10)
+    
+    print("✅ 工作进程崩溃隔离测试通过")
+    return True
+
+class CallbackFailure(Exception):
+    pass
+
+def test_callback_failure():
+    """回调在第二张图片时抛出：本请求剩余的结果被丢弃，同一线程的下一个请求只拿到自己的图片"""
+    print("🧪 测试回调异常后的连接复用...")
+    
+    address = free_address()
+    process = start_worker(address, coalesce_ms=0)
+    before = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+    client = ImageWorkerClient(address=address, authkey=b"test", autostart=False, transport="shm")
+    try:
+        def fail_halfway(index, image):
+            if index == 1:
+                raise CallbackFailure()
+        
+        try:
+            client.generate_story_images(SCENES[:4], seeds=[0, 1, 2, 3], progress_callback=fail_halfway)
+            assert False, "回调异常应向调用方抛出"
+        except CallbackFailure:
+            pass
+        
+        seeds = [40, 41, 42]
+        images = client.generate_story_images(SCENES[4:7], seeds=seeds)
+        expected = fake_generator().generate_story_images(SCENES[4:7], seeds=seeds)
+        for image, reference in zip(images, expected):
+            assert np.array_equal(np.asarray(image), np.asarray(reference.convert("RGB")))
+        if before:
+            assert set(os.listdir("/dev/shm")) <= before
+        client.cleanup()
+    finally:
+        ImageWorkerClient(address=address, authkey=b"test", autostart=False).shutdown_worker()
+        process.join(timeout=10)
+    
+    print("✅ 回调异常后的连接复用测试通过")
+    return True
+
+def test_generated_authkey():
+    """未配置密钥时随机生成，文件权限 0600，再次读取得到同一密钥"""
+    print("🧪 测试随机密钥...")
+    
+    original = (Config.IMAGE_WORKER_AUTHKEY, Config.IMAGE_WORKER_AUTHKEY_FILE)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        try:
+            Config.IMAGE_WORKER_AUTHKEY = ""
+            Config.IMAGE_WORKER_AUTHKEY_FILE = Path(temp_dir) / ".image_worker_key"
+            key = image_worker.load_authkey()
+            assert len(key) == 64
+            assert stat.S_IMODE(Config.IMAGE_WORKER_AUTHKEY_FILE.stat().st_mode) == 0o600
+            assert image_worker.load_authkey() == key
+            assert os.listdir(temp_dir) == [".image_worker_key"]
+            
+            Config.IMAGE_WORKER_AUTHKEY = "configured"
+            assert image_worker.load_authkey() == b"configured"
+        finally:
+            Config.IMAGE_WORKER_AUTHKEY, Config.IMAGE_WORKER_AUTHKEY_FILE = original
+    
+    print("✅ 随机密钥测试通过")
+    return True
+
+class ClosingConnection:
+    """第一条消息之后请求方断开"""
+    
+    def __init__(self):
+        self.sent = []
+    
+    def send(self, message):
+        if self.sent:
+            raise BrokenPipeError("请求方已断开")
+        self.sent.append(message)
+
+def test_undelivered_shm_released():
+    """请求方断开后，未送达的共享内存段被删除，之后的图片不再编码"""
+    print("🧪 测试未送达共享内存回收...")
+    
+    if not os.path.isdir("/dev/shm"):
+        print("   跳过：没有 /dev/shm")
+        return True
+    registry = ModelRegistry(idle_timeout=0, check_interval=3600)
+    worker = ImageWorker(address=free_address(), authkey=b"test", generator_factory=fake_generator,
+                         registry=registry)
+    conn = ClosingConnection()
+    request = _Request(conn, threading.Lock(), {'id': 1, 'scenes': SCENES[:4], 'transport': "shm"})
+    before = set(os.listdir("/dev/shm"))
+    try:
+        worker._run([request])
+    finally:
+        registry.shutdown()
+    
+    assert not request.alive
+    assert [message[0] for message in conn.sent] == ['image']
+    # 送达的一段由请求方负责删除
+    delivered = conn.sent[0][3]['shm'].lstrip("/")
+    assert set(os.listdir("/dev/shm")) - before == {delivered}
+    image_worker.discard_payload(conn.sent[0][3])
+    assert set(os.listdir("/dev/shm")) <= before
+    
+    print("✅ 未送达共享内存回收测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = (test_coalesced_requests() and test_worker_crash_isolation() and test_callback_failure()
+               and test_generated_authkey() and test_undelivered_shm_released())
+    sys.exit(0 if success else 1)
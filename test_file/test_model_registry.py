@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+测试模型注册表 - 多会话并发只加载一次、推理串行、空闲超时与内存压力卸载
+"""
+import sys
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_registry import ModelRegistry
+
+SESSIONS = 3
+LOAD_SECONDS = 0.3
+
+class FakeModel:
+    """加载耗时固定的假模型，记录并发推理数与是否已清理"""
+    
+    loads = 0
+    
+    def __init__(self):
+        time.sleep(LOAD_SECONDS)
+        FakeModel.loads += 1
+        self.active = 0
+        self.max_active = 0
+        self.cleaned = False
+    
+    def infer(self):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        self.active -= 1
+        return "image"
+    
+    def cleanup(self):
+        self.cleaned = True
+
+def test_shared_loading():
+    """三个会话同时请求：只加载一份模型，推理串行，首图耗时按加载开始计"""
+    print("🧪 测试多会话共享模型...")
+    
+    FakeModel.loads = 0
+    registry = ModelRegistry(idle_timeout=0, memory_pressure_percent=0, check_interval=0)
+    
+    def session(_):
+        with registry.use("sd", FakeModel) as model:
+            result = model.infer()
+            registry.record_first_output("sd")
+            return model, result
+    
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=SESSIONS) as executor:
+        results = list(executor.map(session, range(SESSIONS)))
+    elapsed = time.perf_counter() - start_time
+    
+    models = {id(model) for model, _ in results}
+    assert FakeModel.loads == 1 and len(models) == 1
+    assert results[0][0].max_active == 1
+    status = registry.status()[0]
+    assert status['state'] == 'loaded' and status['refs'] == 0 and status['loads'] == 1
+    assert status['first_output_seconds'] >= status['load_seconds'] >= LOAD_SECONDS
+    print(f"   {SESSIONS} 个会话 {elapsed:.2f}秒，加载 {status['load_seconds']:.2f}秒，"
+          f"首图 {status['first_output_seconds']:.2f}秒")
+    
+    # 加载失败不留下引用
+    def broken():
+        raise RuntimeError("模型文件缺失")
+    
+    try:
+        registry.acquire("broken", broken)
+        assert False, "加载失败应抛出异常"
+    except RuntimeError:
+        pass
+    assert {entry['name']: entry for entry in registry.status()}['broken']['refs'] == 0
+    
+    print("✅ 多会话共享模型测试通过")
+    return True
+
+def test_idle_and_pressure_unload():
+    """使用中的模型不会被卸载；空闲超时与内存紧张时卸载，再次使用时重新加载"""
+    print("🧪 测试空闲与内存压力卸载...")
+    
+    FakeModel.loads = 0
+    registry = ModelRegistry(idle_timeout=60, memory_pressure_percent=0, check_interval=0)
+    model = registry.acquire("sd", FakeModel)
+    assert registry.sweep(now=time.time() + 3600) == [] and registry.is_loaded("sd")
+    
+    registry.release("sd")
+    assert registry.sweep() == []
+    assert registry.sweep(now=time.time() + 61) == ["sd"] and model.cleaned
+    assert registry.status()[0]['state'] == 'unloaded'
+    
+    with registry.use("sd", FakeModel):
+        pass
+    assert FakeModel.loads == 2
+    
+    # 内存使用率阈值设为极低，空闲模型按最久未用的顺序立即卸载
+    registry.memory_pressure_percent = 0.1
+    registry.idle_timeout = 0
+    with registry.use("other", FakeModel):
+        assert not registry.is_loaded("sd")
+        assert registry.sweep() == []
+    assert registry.sweep() == ["other"]
+    
+    # 后台检查线程按间隔卸载空闲模型
+    registry = ModelRegistry(idle_timeout=0.1, memory_pressure_percent=0, check_interval=0.05)
+    with registry.use("sd", FakeModel):
+        pass
+    deadline = time.time() + 5
+    while registry.is_loaded("sd") and time.time() < deadline:
+        time.sleep(0.05)
+    assert not registry.is_loaded("sd")
+    registry.shutdown()
+    registry._monitor.join(timeout=1)
+    assert not registry._monitor.is_alive()
+    
+    print("✅ 空闲与内存压力卸载测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_shared_loading() and test_idle_and_pressure_unload()
+    sys.exit(0 if success else 1)
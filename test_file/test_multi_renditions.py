@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试多画幅输出 - 单进程split多路输出与逐个画幅单独编码对比，字幕按各画幅尺寸叠加
+"""
+import sys
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from background_renderer import BackgroundRenderer
+from caption_renderer import CaptionRenderer
+from database_manager import DatabaseManager
+from ffmpeg_video_composer import RENDITIONS, FFmpegVideoComposer, get_ffmpeg_binary, probe_duration
+from test_ffmpeg_video import create_test_images, create_test_track
+
+SCENES = 5
+AUDIO_SECONDS = 10
+NAMES = ["final", "16x9", "1x1"]
+
+def probe_size(path):
+    result = subprocess.run([get_ffmpeg_binary(), "-hide_banner", "-i", str(path)],
+                            capture_output=True, text=True, errors="replace")
+    width, height = re.search(r"Video: .*?(\d{2,5})x(\d{2,5})", result.stderr).groups()
+    return int(width), int(height)
+
+def test_multi_renditions():
+    """各画幅分辨率、时长正确，并与逐个画幅编码对比耗时"""
+    print("🧪 测试多画幅输出...")
+    
+    images = create_test_images(SCENES)
+    track = create_test_track(AUDIO_SECONDS)
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        composer = FFmpegVideoComposer(output_dir=os.path.join(temp_dir, "output"), mode="single", segment_cache=False)
+        
+        start_time = time.perf_counter()
+        paths = composer.create_renditions(images, track, "多画幅", NAMES)
+        split_time = time.perf_counter() - start_time
+        
+        for name, path in paths.items():
+            width, height, _, _ = composer._rendition_spec(name)
+            assert path and probe_size(path) == (width, height), (name, path)
+            assert abs(probe_duration(path) - AUDIO_SECONDS) < 0.2
+        print(f"   split 单进程输出 {len(NAMES)} 个画幅: {split_time:.2f}秒")
+        
+        start_time = time.perf_counter()
+        for name in NAMES:
+            width, height, bitrate, _ = composer._rendition_spec(name)
+            single = FFmpegVideoComposer(width=width, height=height, bitrate=bitrate, mode="single", segment_cache=False,
+                                         output_dir=os.path.join(temp_dir, "sequential"))
+            assert single.create_video(images, track, f"逐个_{name}")
+        sequential_time = time.perf_counter() - start_time
+        print(f"   逐个画幅编码: {sequential_time:.2f}秒   加速比 {sequential_time / split_time:.2f}x")
+        
+        # 各画幅分别登记到 videos 表
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        story_id = db.save_story("多画幅", "测试故事", ["场景"] * SCENES)
+        renderer = BackgroundRenderer(database=db, extra_renditions=["16x9", "1x1"])
+        assert renderer.render_final(story_id, images, track, "多画幅", composer)
+        renditions = db.get_video_renditions(story_id)
+        assert sorted(renditions) == sorted(NAMES) and all(item['status'] == 'ready' for item in renditions.values())
+        assert set(RENDITIONS) >= {"16x9", "1x1"}
+    
+    print("✅ 多画幅输出测试通过")
+    return True
+
+def read_frame(path, seconds, width, height):
+    result = subprocess.run([get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-ss", str(seconds),
+                             "-i", str(path), "-frames:v", "1", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"],
+                            capture_output=True, check=True)
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape(height, width, 3)
+
+def test_captioned_renditions():
+    """字幕在补边之后叠加：9:16 画幅的字幕位于底部黑边区域，按该画幅的宽度排版"""
+    print("🧪 测试多画幅字幕...")
+    
+    images = create_test_images(SCENES)
+    track = create_test_track(AUDIO_SECONDS)
+    text = "守株待兔"
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        composer = FFmpegVideoComposer(output_dir=temp_dir, mode="single", segment_cache=False)
+        composer.captions = [(0.0, AUDIO_SECONDS, text)]
+        paths = composer.create_renditions(images, track, "字幕", ["9x16", "16x9"])
+        assert all(paths.values()), paths
+        
+        width, height, _, _ = RENDITIONS["9x16"]
+        frame = read_frame(paths["9x16"], 1.0, width, height)
+        overlay = CaptionRenderer(width, height).overlay(text)
+        # 方形画面在 9:16 中上下各留黑边，字幕行落在下方黑边内
+        content_bottom = (height + width) // 2
+        assert overlay.y > content_bottom
+        caption_rows = frame[overlay.y:overlay.y + overlay.height]
+        assert caption_rows.max() > 200
+        assert frame[content_bottom + 8:overlay.y - 8].max() < 40
+        
+        width, height, _, _ = RENDITIONS["16x9"]
+        frame = read_frame(paths["16x9"], 1.0, width, height)
+        overlay = CaptionRenderer(width, height).overlay(text)
+        region = frame[overlay.y:overlay.y + overlay.height, overlay.x:overlay.x + overlay.width]
+        assert region.max() > 200
+    
+    print("✅ 多画幅字幕测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_multi_renditions() and test_captioned_renditions()
+    sys.exit(0 if success else 1)
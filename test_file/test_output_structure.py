@@ -17,7 +17,7 @@ os.environ['TRANSFORMERS_VERBOSITY'] = 'error'
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config import config
-from modules.image_generator import ImageGenerator
+from image_generator import ImageGenerator
 from modules.scene_extractor import SceneExtractor
 from loguru import logger
 
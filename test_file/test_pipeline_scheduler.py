@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+测试流水线调度器 - 各阶段重叠执行的吞吐量
+"""
+import sys
+import os
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline_scheduler import Stage, StagedScheduler
+
+JOB_COUNT = 12
+STAGE_SECONDS = 0.05
+
+def network_stage(job):
+    time.sleep(STAGE_SECONDS)
+    job['story'] = True
+    return job
+
+def model_stage(job):
+    if job['idiom'] == "成语3":
+        raise RuntimeError("模拟推理失败")
+    time.sleep(STAGE_SECONDS)
+    job['images'] = True
+    return job
+
+def encode_stage(job):
+    # 在子进程中执行
+    time.sleep(STAGE_SECONDS)
+    job['video_pid'] = os.getpid()
+    return job
+
+def test_pipeline_scheduler():
+    """三个阶段各耗时相同，流水线并行后总耗时应明显小于顺序执行"""
+    print("🧪 测试流水线调度器...")
+    
+    stages = [
+        Stage("story", network_stage, workers=2),
+        Stage("images", model_stage, workers=1),
+        Stage("video", encode_stage, workers=2, kind="process")
+    ]
+    jobs = ({'idiom': f"成语{i}"} for i in range(JOB_COUNT))
+    
+    results = []
+    report = StagedScheduler(stages).run(jobs, on_result=results.append)
+    
+    sequential_seconds = JOB_COUNT * STAGE_SECONDS * len(stages)
+    print(f"  顺序执行预计: {sequential_seconds:.2f}秒, 流水线实际: {report['wall_seconds']:.2f}秒")
+    for name, item in report['stages'].items():
+        print(f"  {name}: 任务 {item['jobs']}, 利用率 {item['utilization'] * 100:.0f}%")
+    
+    assert len(results) == JOB_COUNT
+    failed = [job for job in results if job.get('error')]
+    assert len(failed) == 1 and failed[0]['failed_stage'] == "images"
+    assert all(job['video_pid'] != os.getpid() for job in results if not job.get('error'))
+    assert report['wall_seconds'] < sequential_seconds
+    assert report['stages']['images']['utilization'] > 0.5
+    assert report['errors'] == 1
+    
+    print("✅ 流水线调度器测试完成!")
+
+def failing_jobs():
+    yield {'idiom': "成语0"}
+    yield {'idiom': "成语1"}
+    raise IOError("模拟读取输入失败")
+
+def test_feed_error():
+    """读取任务出错时已送入的任务照常完成，run() 随后抛出该异常"""
+    print("🧪 测试任务读取失败...")
+    
+    stages = [Stage("story", network_stage), Stage("video", encode_stage, kind="process")]
+    results = []
+    try:
+        StagedScheduler(stages).run(failing_jobs(), on_result=results.append)
+        assert False, "读取失败应抛出异常"
+    except IOError:
+        pass
+    assert sorted(job['idiom'] for job in results) == ["成语0", "成语1"]
+    
+    print("✅ 任务读取失败测试完成!")
+
+if __name__ == "__main__":
+    test_pipeline_scheduler()
+    test_feed_error()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+测试两级渲染 - 低清预览的出片时间与后台成片渲染状态，多个会话并发提交同一故事
+"""
+import sys
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from background_renderer import BackgroundRenderer
+from database_manager import DatabaseManager
+from ffmpeg_video_composer import FFmpegVideoComposer, probe_duration
+from test_ffmpeg_video import create_test_images, create_test_track
+
+SCENES = 5
+AUDIO_SECONDS = 10
+
+def test_preview_render():
+    """预览先返回并可播放，成片完成后状态切换为 ready"""
+    print("🧪 测试两级渲染...")
+    
+    images = create_test_images(SCENES)
+    track = create_test_track(AUDIO_SECONDS)
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        story_id = db.save_story("测试成语", "测试故事", ["场景"] * SCENES)
+        renderer = BackgroundRenderer(database=db)
+        composer = FFmpegVideoComposer(output_dir=os.path.join(temp_dir, "output"), segment_cache=False)
+        
+        start_time = time.perf_counter()
+        status = renderer.render(story_id, images, track, "测试成语", composer)
+        preview_time = time.perf_counter() - start_time
+        
+        assert status['rendition'] == 'preview', status
+        assert status['final_status'] in ('rendering', 'ready'), status
+        assert abs(probe_duration(status['video_path']) - AUDIO_SECONDS) < 0.2
+        print(f"   预览可播放: {preview_time:.2f}秒")
+        
+        final_path = renderer.wait(story_id, timeout=300)
+        final_time = time.perf_counter() - start_time
+        status = renderer.status(story_id)
+        assert final_path and status['rendition'] == 'final' and status['final_status'] == 'ready', status
+        assert status['renditions']['preview']['status'] == 'ready'
+        assert db.get_story("测试成语")['video']['rendition'] == 'final'
+        # 已结束的任务不再保留 Future 与流式句柄，wait 改从 videos 表返回成片
+        assert story_id not in renderer._futures and story_id not in renderer._streams
+        assert renderer.wait(story_id) == final_path
+        print(f"   成片完成: {final_time:.2f}秒  (预览提前 {final_time - preview_time:.2f}秒)")
+        
+        # 重新渲染只替换同一版本的记录
+        db.save_video(story_id, final_path, "测试成语")
+        assert sorted(db.get_video_renditions(story_id)) == ['final', 'preview']
+        assert db.get_storage_stats()['video_count'] == 2
+        
+        # 渲染失败时记录错误
+        video_id = db.begin_video(story_id, "测试成语", 'final')
+        db.fail_video(video_id, "编码失败")
+        status = renderer.status(story_id)
+        assert status['final_status'] == 'failed' and status['rendition'] == 'preview'
+    
+    print("✅ 两级渲染测试通过")
+    return True
+
+class SlowComposer:
+    """只写出占位文件的合成器，用于放大并发提交的时间窗口"""
+    
+    def create_video(self, images, audio, idiom, durations=None, output_path=None):
+        time.sleep(0.5)
+        Path(output_path).write_bytes(b"0" * 16)
+        return output_path
+
+def test_concurrent_submit():
+    """多个会话同时提交同一故事时只启动一个成片任务"""
+    print("🧪 测试并发提交成片...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        story_id = db.save_story("测试成语", "测试故事", ["场景"])
+        renderer = BackgroundRenderer(database=db, max_workers=4)
+        composer = SlowComposer()
+        
+        barrier = threading.Barrier(8)
+        futures = []
+        
+        def submit():
+            barrier.wait()
+            futures.append(renderer.submit_final(story_id, [], None, "测试成语", composer))
+        
+        threads = [threading.Thread(target=submit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len({id(future) for future in futures}) == 1, "同一故事只应有一个成片任务"
+        assert renderer.wait(story_id, timeout=30)
+        assert renderer.status(story_id)['final_status'] == 'ready'
+        assert story_id not in renderer._futures
+    
+    print("✅ 并发提交成片测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_preview_render() and test_concurrent_submit()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+测试提示词嵌入缓存 - 负面提示词每个模型只编码一次、正向提示词 LRU、safetensors 存盘，以及与直接传提示词的一致性
+"""
+import sys
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_generator import ImageGenerator
+from prompt_embedding_cache import PromptEmbeddingCache
+from test_image_batching import SCENES, tiny_pipeline
+
+class EncodingPipeline:
+    """带文本编码的假管道：嵌入由提示词文本决定，记录每次编码的提示词"""
+    
+    _execution_device = torch.device("cpu")
+    
+    def __init__(self):
+        self.encoded = []
+    
+    def encode_prompt(self, prompt, device, num_images_per_prompt, do_classifier_free_guidance):
+        self.encoded.append(list(prompt))
+        embeds = torch.stack([torch.full((4, 8), float(sum(map(ord, text)) % 997)) for text in prompt])
+        return embeds, None
+    
+    def __call__(self, prompt_embeds, negative_prompt_embeds, generator, **kwargs):
+        assert prompt_embeds.shape == negative_prompt_embeds.shape == (len(generator), 4, 8)
+        return SimpleNamespace(images=[Image.new('RGB', (8, 8), (int(embeds[0, 0]) % 256, 0, 0))
+                                       for embeds in prompt_embeds])
+
+def test_embedding_reuse():
+    """负面提示词只编码一次；重新渲染命中 LRU；超过容量淘汰最久未用的提示词"""
+    print("🧪 测试提示词嵌入复用...")
+    
+    pipe = EncodingPipeline()
+    cache = PromptEmbeddingCache(max_entries=len(SCENES), persist=False)
+    generator = ImageGenerator(pipe=pipe, device="cpu", batch_size=4, width=64, height=64,
+                               embedding_cache=cache, model_key="fake")
+    
+    first = generator.generate_story_images(SCENES)
+    assert [len(prompts) for prompts in pipe.encoded] == [4, 1, 4]
+    assert cache.stats['negative_encodes'] == 1 and cache.stats['misses'] == len(SCENES)
+    
+    # 重新渲染：不再调用文本编码器
+    pipe.encoded.clear()
+    second = generator.generate_story_images(SCENES)
+    assert pipe.encoded == [] and cache.stats['hits'] == len(SCENES)
+    assert [image.getpixel((0, 0)) for image in first] == [image.getpixel((0, 0)) for image in second]
+    
+    # 新提示词挤出最久未用的条目；另一个模型各自编码
+    generator.generate_story_images(["新场景"])
+    assert len(cache) == len(SCENES) and pipe.encoded == [[generator.build_prompt("新场景")]]
+    other = ImageGenerator(pipe=pipe, device="cpu", embedding_cache=cache, model_key="other", width=64, height=64)
+    other.generate_story_images(["新场景"])
+    assert cache.stats['negative_encodes'] == 2
+    
+    generator.cleanup()
+    assert cache.stats['negative_encodes'] == 2 and all(key[0] != "fake" for key in cache._entries)
+    print(f"   {cache.stats}")
+    
+    print("✅ 提示词嵌入复用测试通过")
+    return True
+
+def test_embedding_persistence():
+    """存盘后新的缓存实例直接读取 .safetensors，不调用文本编码器"""
+    print("🧪 测试提示词嵌入存盘...")
+    
+    try:
+        import safetensors.torch  # noqa: F401
+    except ImportError as e:
+        print(f"   跳过：缺少 safetensors（{e}）")
+        return True
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pipe = EncodingPipeline()
+        PromptEmbeddingCache(persist=True, persist_dir=temp_dir).get(pipe, "fake", SCENES[:3])
+        assert len(os.listdir(temp_dir)) == 3
+        
+        pipe.encoded.clear()
+        cache = PromptEmbeddingCache(persist=True, persist_dir=temp_dir)
+        embeds = cache.get(pipe, "fake", SCENES[:3])
+        assert pipe.encoded == [] and cache.stats['disk_hits'] == 3 and embeds.shape == (3, 4, 8)
+    
+    print("✅ 提示词嵌入存盘测试通过")
+    return True
+
+def test_tiny_pipeline_parity():
+    """小型随机权重管道：传嵌入与传提示词生成的图片一致，并对比重新渲染的耗时"""
+    print("🧪 测试嵌入输入一致性...")
+    
+    try:
+        pipe = tiny_pipeline()
+    except ImportError as e:
+        print(f"   跳过：缺少 diffusers/transformers（{e}）")
+        return True
+    pipe.set_progress_bar_config(disable=True)
+    
+    seeds = list(range(len(SCENES)))
+    plain = ImageGenerator(pipe=pipe, device="cpu", steps=2, width=64, height=64, embedding_cache=False)
+    cached = ImageGenerator(pipe=pipe, device="cpu", steps=2, width=64, height=64,
+                            embedding_cache=PromptEmbeddingCache(persist=False), model_key="tiny")
+    
+    expected = plain.generate_story_images(SCENES, seeds=seeds)
+    actual = cached.generate_story_images(SCENES, seeds=seeds)
+    for a, b in zip(expected, actual):
+        diff = (torch.tensor(list(a.getdata())) - torch.tensor(list(b.getdata()))).abs().max()
+        assert diff <= 1, diff
+    
+    start_time = time.perf_counter()
+    plain.generate_story_images(SCENES, seeds=seeds)
+    plain_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    cached.generate_story_images(SCENES, seeds=seeds)
+    cached_time = time.perf_counter() - start_time
+    print(f"   重新渲染 {len(SCENES)} 张：每次编码 {plain_time:.2f}秒   命中缓存 {cached_time:.2f}秒")
+    
+    print("✅ 嵌入输入一致性测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_embedding_reuse() and test_embedding_persistence() and test_tiny_pipeline_parity()
+    sys.exit(0 if success else 1)
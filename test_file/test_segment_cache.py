@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+测试增量重新导出 - 只重新编码图片或时长发生变化的场景
+"""
+import sys
+import os
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from ffmpeg_video_composer import FFmpegVideoComposer, SegmentCache, probe_duration
+from test_ffmpeg_video import create_test_images, create_test_track
+
+SCENES = 15
+SCENE_SECONDS = 1.0
+
+def render(composer, images, durations, name):
+    cache = composer.segment_cache
+    misses = cache.stats['misses']
+    start_time = time.perf_counter()
+    video_path = composer.create_video(images, create_test_track(sum(durations)), name,
+                                       durations=durations, mode="chunked")
+    elapsed = time.perf_counter() - start_time
+    assert video_path
+    assert abs(probe_duration(video_path) - sum(durations)) < 0.2
+    return elapsed, cache.stats['misses'] - misses
+
+def test_segment_cache():
+    """整片导出后修改一张插画/一个场景时长，只编码变化的分片"""
+    print("🧪 测试增量重新导出...")
+    
+    images = create_test_images(SCENES)
+    durations = [SCENE_SECONDS] * SCENES
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = SegmentCache(Path(temp_dir) / "segments", 1024 ** 3)
+        composer = FFmpegVideoComposer(output_dir=temp_dir, segment_cache=cache)
+        
+        full_time, encoded = render(composer, images, durations, "首次导出")
+        assert encoded == SCENES, encoded
+        print(f"   首次导出: {full_time:.2f}秒，编码 {encoded} 个分片")
+        
+        # 重新生成第8张插画
+        images[7] = Image.new('RGB', (512, 512), (255, 0, 0))
+        image_time, encoded = render(composer, images, durations, "修改插画")
+        assert encoded == 1, encoded
+        print(f"   修改一张插画: {image_time:.2f}秒，编码 {encoded} 个分片，加速比 {full_time / image_time:.1f}x")
+        
+        # 调整第3个场景时长（整帧变化，其余场景帧数不变）
+        durations[2] += 0.5
+        timing_time, encoded = render(composer, images, durations, "修改时长")
+        assert encoded == 1, encoded
+        print(f"   修改一个场景时长: {timing_time:.2f}秒，编码 {encoded} 个分片")
+        
+        # 编码参数变化时缓存全部失效
+        composer.bitrate = "3000k"
+        _, encoded = render(composer, images, durations, "修改码率")
+        assert encoded == SCENES, encoded
+    
+    print("✅ 增量重新导出测试通过")
+    return True
+
+def test_segment_cache_eviction():
+    """缓存容量不足时其他任务的淘汰不影响已命中片段的拼接"""
+    print("🧪 测试片段缓存淘汰...")
+    
+    images = create_test_images(4)
+    durations = [SCENE_SECONDS] * 4
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = SegmentCache(Path(temp_dir) / "segments", 1024 ** 3)
+        composer = FFmpegVideoComposer(output_dir=temp_dir, segment_cache=cache)
+        render(composer, images, durations, "预热")
+        
+        # 命中后缓存条目被删除，工作区中的链接依然可用
+        key = next(Path(cache.cache_dir).glob("*.mp4")).stem
+        dest = Path(temp_dir) / "hit.mp4"
+        assert cache.get(key, dest) == dest
+        os.remove(cache.cache_dir / f"{key}.mp4")
+        assert probe_duration(str(dest)) > 0
+        assert cache.get(key, Path(temp_dir) / "miss.mp4") is None
+        
+        # 容量为0时每次写入都会清空缓存，导出仍然完整
+        cache.max_bytes = 0
+        render(composer, images, durations, "边写边淘汰")
+        assert not list(Path(cache.cache_dir).glob("*.mp4"))
+    
+    print("✅ 片段缓存淘汰测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_segment_cache() and test_segment_cache_eviction()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+测试存储统计 - 触发器随保存、替换、删除同步更新，回填已有数据，校准报告无漂移，后台校准修复漂移
+"""
+import sys
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from database_manager import DatabaseManager
+
+CATEGORIES = ("story", "image", "audio", "video")
+
+def make_images(count, color):
+    return [Image.new("RGB", (32, 32), (color, 40 * i % 256, 90)) for i in range(count)]
+
+def make_file(directory, name, size):
+    path = Path(directory) / name
+    path.write_bytes(os.urandom(size))
+    return path
+
+def expected_stats(db):
+    """直接扫描各表得到的期望值"""
+    with db.connections.connection() as conn:
+        stories = conn.execute('SELECT COUNT(*) FROM stories').fetchone()[0]
+        counts = {}
+        for category, table, column in (("image", "images", "image_size"), ("audio", "audio", "audio_size"),
+                                        ("video", "videos", "video_size")):
+            counts[category] = conn.execute(f'SELECT COUNT(*), COALESCE(SUM({column}), 0) FROM {table}').fetchone()
+    return {
+        'story_count': stories,
+        'image_count': counts['image'][0], 'image_size': counts['image'][1],
+        'audio_count': counts['audio'][0], 'audio_size': counts['audio'][1],
+        'video_count': counts['video'][0], 'video_size': counts['video'][1],
+        'total_size': counts['image'][1] + counts['audio'][1] + counts['video'][1]
+    }
+
+def assert_stats(db, step, **expected):
+    stats = db.get_storage_stats()
+    for key, value in {**expected_stats(db), **expected}.items():
+        assert stats[key] == value, (step, key, stats[key], value)
+    print(f"   {step}: 故事 {stats['story_count']}, 图片 {stats['image_count']}, 音频 {stats['audio_count']}, "
+          f"视频 {stats['video_count']}, 共 {stats['total_size']} 字节")
+
+def assert_no_drift(db):
+    report = db.reconcile_storage()
+    assert all(report[category]['drift'] == (0, 0) for category in CATEGORIES), report
+    return report
+
+def test_storage_stats():
+    """保存、替换、删除故事及其图片/音频/视频后，汇总表与逐表统计一致"""
+    print("🧪 测试存储统计...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        assert_stats(db, "空库", story_count=0, total_size=0)
+        
+        first = db.save_story("守株待兔", "农夫守着树桩等兔子。", ["农夫", "兔子", "树桩"])
+        second = db.save_story("画蛇添足", "比赛画蛇，有人给蛇添了脚。", ["画蛇", "添足"])
+        db.save_story("守株待兔", "农夫天天守着树桩。", ["农夫", "树桩"])
+        assert_stats(db, "保存故事（含重复保存）", story_count=2, total_size=0)
+        
+        image_paths = db.save_images(first, make_images(3, 200), "守株待兔")
+        image_paths += db.save_images(second, make_images(2, 50), "画蛇添足")
+        assert_stats(db, "保存图片", image_count=5, image_size=sum(os.path.getsize(path) for path in image_paths))
+        
+        db.save_images(first, make_images(1, 120), "守株待兔")
+        assert_stats(db, "替换图片", image_count=3)
+        
+        db.save_audio(first, make_file(temp_dir, "a.mp3", 3000), "守株待兔")
+        db.save_audio(first, make_file(temp_dir, "b.mp3", 5000), "守株待兔")
+        db.save_audio(second, make_file(temp_dir, "c.mp3", 700), "画蛇添足")
+        assert_stats(db, "保存并替换音频", audio_count=2, audio_size=5700)
+        
+        db.save_video(first, make_file(temp_dir, "v1.mp4", 10000), "守株待兔")
+        db.save_video(first, make_file(temp_dir, "v2.mp4", 12000), "守株待兔")
+        db.save_video(first, make_file(temp_dir, "p.mp4", 900), "守株待兔", rendition="preview")
+        assert_stats(db, "保存并替换视频", video_count=2, video_size=12900)
+        
+        # 渲染中的记录没有大小，完成后按实际大小计入
+        video_id = db.begin_video(second, "画蛇添足")
+        assert_stats(db, "视频渲染中", video_count=3, video_size=12900)
+        db.finish_video(video_id, make_file(temp_dir, "v3.mp4", 4000))
+        assert_stats(db, "视频渲染完成", video_count=3, video_size=16900)
+        
+        report = assert_no_drift(db)
+        assert report['video']['file_count'] == 3 and report['video']['file_size'] == 16900
+        assert report['audio']['file_count'] == 2 and report['audio']['file_size'] == 5700
+        
+        assert db.delete_story("守株待兔")
+        assert_stats(db, "删除故事", story_count=1, image_count=2, audio_count=1, audio_size=700,
+                     video_count=1, video_size=4000)
+        assert not db.delete_story("守株待兔")
+        report = assert_no_drift(db)
+        assert report['video']['file_count'] == 1 and report['audio']['file_count'] == 1
+        
+        db.connections.close()
+        
+        # 重新打开已有数据库：汇总表保留，不重复回填
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        assert_stats(db, "重新打开", story_count=1)
+        assert_no_drift(db)
+        db.connections.close()
+    
+    print("✅ 存储统计测试通过")
+    return True
+
+def test_backfill_and_reconcile():
+    """旧库首次建立汇总表时回填；汇总表漂移时校准报告漂移并修复，后台校准线程同样修复"""
+    print("🧪 测试回填与校准...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "test.db")
+        db = DatabaseManager(db_path, os.path.join(temp_dir, "storage"))
+        story_id = db.save_story("刻舟求剑", "在船上刻记号找剑。", ["坐船", "落剑"])
+        db.save_images(story_id, make_images(2, 10), "刻舟求剑")
+        db.save_audio(story_id, make_file(temp_dir, "a.mp3", 2500), "刻舟求剑")
+        
+        # 模拟旧库：没有汇总表与触发器
+        with db.connections.connection() as conn:
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+                conn.execute(f'DROP TRIGGER {name}')
+            conn.execute('DROP TABLE storage_stats')
+        db.connections.close()
+        
+        db = DatabaseManager(db_path, os.path.join(temp_dir, "storage"))
+        assert_stats(db, "回填", story_count=1, image_count=2, audio_count=1, audio_size=2500)
+        assert_no_drift(db)
+        
+        # 人为制造漂移：校准报告漂移量并修复
+        with db.connections.connection() as conn:
+            conn.execute("UPDATE storage_stats SET item_count = item_count + 3, total_size = total_size - 100 "
+                         "WHERE category = 'image'")
+        report = db.reconcile_storage(repair=False)
+        assert report['image']['drift'] == (3, -100), report['image']
+        assert db.reconcile_storage()['image']['drift'] == (3, -100)
+        assert_no_drift(db)
+        assert_stats(db, "校准后", image_count=2)
+        assert {item['category'] for item in db.get_reconcile_report()} == {"image", "audio", "video"}
+        
+        # 后台校准线程
+        with db.connections.connection() as conn:
+            conn.execute("UPDATE storage_stats SET item_count = 99 WHERE category = 'story'")
+        db.start_reconciler(interval=0.1)
+        reconciler = db._reconciler
+        db.start_reconciler(interval=0.1)
+        assert db._reconciler is reconciler, "重复启动不应创建新线程"
+        deadline = time.time() + 10
+        while db.get_storage_stats()['story_count'] != 1:
+            assert time.time() < deadline, "后台校准未修复漂移"
+            time.sleep(0.05)
+        assert_stats(db, "后台校准后", story_count=1)
+    
+    print("✅ 回填与校准测试通过")
+    return True
+
+def test_reconcile_concurrent_writes():
+    """校准与写入并发进行时，校准不会用过期的计数覆盖汇总表"""
+    print("🧪 测试并发写入下的校准...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        errors = []
+        
+        def writer():
+            try:
+                for i in range(30):
+                    db.save_story(f"成语{i}", "故事内容。", ["场景"])
+            except Exception as e:
+                errors.append(e)
+        
+        thread = threading.Thread(target=writer)
+        thread.start()
+        while thread.is_alive():
+            db.reconcile_storage()
+        thread.join()
+        assert not errors, errors
+        assert not db.connections.connection().in_transaction
+        
+        assert_stats(db, "并发校准后", story_count=30)
+        assert_no_drift(db)
+    
+    print("✅ 并发写入下的校准测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_storage_stats() and test_backfill_and_reconcile() and test_reconcile_concurrent_writes()
+    sys.exit(0 if success else 1)
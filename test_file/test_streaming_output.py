@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+测试流式输出 - 分片MP4/HLS在编码完成前即可播放
+"""
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ffmpeg_video_composer import FFmpegVideoComposer, probe_duration
+from test_ffmpeg_video import create_test_images, create_test_track
+
+SCENES = 15
+AUDIO_SECONDS = 30
+
+def test_streaming_output():
+    """首个可播放片段出现的时间与完整编码时间对比"""
+    print("🧪 测试流式输出...")
+    
+    images = create_test_images(SCENES)
+    track = create_test_track(AUDIO_SECONDS)
+    
+    with tempfile.TemporaryDirectory() as output_dir:
+        composer = FFmpegVideoComposer(output_dir=output_dir, segment_cache=False)
+        
+        for fmt in ("fmp4", "hls"):
+            start_time = time.perf_counter()
+            stream = composer.start_stream(images, track, f"流式_{fmt}", fmt=fmt)
+            first_playable = None
+            while True:
+                status = stream.poll()
+                if first_playable is None and status['playable_seconds'] > 0 and os.path.exists(status['path']):
+                    first_playable = time.perf_counter() - start_time
+                if status['status'] != 'encoding':
+                    break
+                time.sleep(0.1)
+            total_time = time.perf_counter() - start_time
+            
+            assert status['status'] == 'ready', status
+            assert first_playable is not None and first_playable < total_time
+            if fmt == "hls":
+                assert status['segments'] >= AUDIO_SECONDS // 2 - 1, status
+            
+            video_path = stream.to_mp4(os.path.join(output_dir, f"合并_{fmt}.mp4"))
+            assert abs(probe_duration(video_path) - AUDIO_SECONDS) < 0.2
+            print(f"   {fmt:<5} 首次可播放 {first_playable:.2f}秒   编码完成 {total_time:.2f}秒")
+    
+    print("✅ 流式输出测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_streaming_output()
+    sys.exit(0 if success else 1)
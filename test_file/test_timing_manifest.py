@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试音频时间表 - 段落起止采样位置、按句子边界切分场景、视频场景切换点
+"""
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixed_audio_generator import AudioTrack, FixedAudioGenerator
+from ffmpeg_video_composer import FFmpegVideoComposer, probe_duration
+from test_audio_track import stereo_wav
+from test_ffmpeg_video import create_test_images
+from utils import CacheManager
+
+STORY = ("从前，宋国有个农夫。他每天都在田里辛苦劳作！有一天，一只兔子飞奔而来，撞死在树桩上。"
+         "农夫高兴地说：“真是白捡的午饭。”从此他放下锄头，天天守在树桩旁。"
+         "可是再也没有兔子撞上来？他的田地荒芜了，庄稼全都枯死。人们都笑话他。")
+SCENES = ["从前，宋国有个农夫，每天辛苦劳作", "有一天，一只兔子飞奔而来", "从此他放下锄头，天天守在树桩旁",
+          "他的田地荒芜了，庄稼全都枯死"]
+
+def test_timing_manifest():
+    """时间表连续覆盖整条音轨，场景切换点落在句子起点"""
+    print("🧪 测试音频时间表...")
+    
+    generator = FixedAudioGenerator(tts_backend=lambda text: stereo_wav(len(text) * 0.15), max_workers=4)
+    track = generator.synthesize_track(STORY, "守株待兔")
+    manifest = track.timing_manifest()
+    
+    assert len(manifest) == len(generator._split_text(STORY, 0)) == 8, [item['text'] for item in manifest]
+    assert manifest[0]['start'] == 0 and manifest[-1]['end'] == len(track.samples)
+    assert all(a['end'] == b['start'] for a, b in zip(manifest, manifest[1:]))
+    assert "".join(item['text'] for item in manifest) == STORY
+    sentence_starts = {item['start'] for item in manifest}
+    
+    # 场景文本定位到各自所在的句子
+    durations = track.scene_durations(len(SCENES), SCENES)
+    assert abs(sum(durations) - track.duration) < 1e-9
+    cuts = [round(sum(durations[:k]) * track.sample_rate) for k in range(1, len(SCENES))]
+    assert cuts == [manifest[2]['start'], manifest[4]['start'], manifest[6]['start']], cuts
+    print(f"   {len(manifest)} 句，场景时长 {[round(d, 2) for d in durations]}")
+    
+    # 无场景文本：在最接近均分点的句子边界切换
+    balanced = track.scene_durations(3)
+    assert all(round(sum(balanced[:k]) * track.sample_rate) in sentence_starts for k in range(1, 3))
+    
+    # 句子少于场景时退化为均分
+    short = AudioTrack.concatenate([track.samples[:1000]], track.sample_rate, ["一句。"])
+    short_durations = short.scene_durations(3)
+    assert max(short_durations) - min(short_durations) < 2 / track.sample_rate
+    assert abs(sum(short_durations) - short.duration) < 1e-9
+    
+    # 缓存往返保留段落文本
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CacheManager(cache_dir)
+        cache.save_cache("audio/守株待兔/key", track)
+        cached = cache.get_cached_result("audio/守株待兔/key")
+        assert cached.timing_manifest() == manifest
+    
+    print("✅ 音频时间表测试通过")
+    return True
+
+def test_scene_cuts_in_video():
+    """合成器直接使用时间表：视频时长等于音频，场景切换帧与句子起点相差不超过1帧"""
+    print("🧪 测试视频场景切换点...")
+    
+    generator = FixedAudioGenerator(tts_backend=lambda text: stereo_wav(len(text) * 0.15), max_workers=4)
+    track = generator.synthesize_track(STORY, "守株待兔")
+    durations = track.scene_durations(len(SCENES), SCENES)
+    
+    with tempfile.TemporaryDirectory() as output_dir:
+        composer = FFmpegVideoComposer(output_dir=output_dir, mode="single", segment_cache=False)
+        boundaries = [sum(composer._frame_counts(durations)[:k]) / composer.fps for k in range(1, len(SCENES))]
+        for boundary, duration_sum in zip(boundaries, [sum(durations[:k]) for k in range(1, len(SCENES))]):
+            assert abs(boundary - duration_sum) <= 1 / composer.fps, (boundary, duration_sum)
+        
+        start_time = time.perf_counter()
+        video_path = composer.create_video(create_test_images(len(SCENES)), track, "守株待兔", durations)
+        elapsed = time.perf_counter() - start_time
+        assert abs(probe_duration(video_path) - track.duration) < 0.1
+        print(f"   视频时长 {probe_duration(video_path):.2f}秒 / 音频 {track.duration:.2f}秒，编码 {elapsed:.2f}秒")
+    
+    print("✅ 视频场景切换点测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_timing_manifest() and test_scene_cuts_in_video()
+    sys.exit(0 if success else 1)
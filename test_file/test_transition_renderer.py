@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+测试NumPy转场渲染器 - 各转场效果的帧生成速度与端到端编码速度
+"""
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from ffmpeg_video_composer import probe_duration
+from transition_renderer import TRANSITIONS, SmoothVideoComposer, TransitionRenderer
+from test_ffmpeg_video import create_test_images, create_test_track
+
+SCENES = 5
+SCENE_SECONDS = 2.0
+
+def test_transition_frames():
+    """淡入淡出与滑动的像素结果正确"""
+    print("🧪 测试转场帧内容...")
+    
+    renderer = TransitionRenderer(64, 32, 10, transition_duration=0.5)
+    black = Image.new('RGB', (64, 32), (0, 0, 0))
+    white = Image.new('RGB', (64, 32), (200, 200, 200))
+    
+    scenes = renderer.prepare([black, white], "fade")
+    frames = [frame.copy() for frame in renderer.iter_frames(scenes, [10, 10], "fade")]
+    assert len(frames) == 20
+    # 第一个场景最后5帧为转场，亮度单调递增，之后为第二个场景
+    levels = [int(frame[0, 0, 0]) for frame in frames]
+    assert levels[:5] == [0] * 5 and levels[10:] == [200] * 10, levels
+    assert levels[5:10] == sorted(levels[5:10]) and 0 < levels[7] < 200, levels
+    
+    scenes = renderer.prepare([black, white], "slide")
+    frames = [frame.copy() for frame in renderer.iter_frames(scenes, [10, 10], "slide")]
+    middle = frames[7]
+    assert middle[0, 0, 0] == 0 and middle[0, -1, 0] == 200
+    
+    scenes = renderer.prepare([black, white], "zoom")
+    assert scenes[0].shape[:2] == (round(32 * renderer.zoom_ratio), round(64 * renderer.zoom_ratio))
+    frames = list(renderer.iter_frames(scenes, [10, 10], "zoom"))
+    assert all(frame.shape == (32, 64, 3) for frame in frames)
+    
+    print("✅ 转场帧内容测试通过")
+    return True
+
+def test_transition_speed():
+    """各转场效果：纯帧生成fps，以及写入ffmpeg编码的端到端fps"""
+    print("🧪 测试转场渲染速度...")
+    
+    images = create_test_images(SCENES)
+    track = create_test_track(SCENES * SCENE_SECONDS)
+    width, height, fps = Config.VIDEO_WIDTH, Config.VIDEO_HEIGHT, Config.VIDEO_FPS
+    
+    with tempfile.TemporaryDirectory() as output_dir:
+        composer = SmoothVideoComposer(output_dir=output_dir, segment_cache=False)
+        frame_counts = composer._frame_counts([SCENE_SECONDS] * SCENES)
+        total_frames = sum(frame_counts)
+        
+        for transition in TRANSITIONS:
+            renderer = TransitionRenderer(width, height, fps, transition_duration=0.5)
+            scenes = renderer.prepare(images, transition)
+            start_time = time.perf_counter()
+            count = sum(1 for _ in renderer.iter_frames(scenes, frame_counts, transition))
+            render_fps = count / (time.perf_counter() - start_time)
+            assert count == total_frames
+            
+            start_time = time.perf_counter()
+            video_path = composer.create_video(images, track, f"转场_{transition}", transition=transition)
+            encode_fps = total_frames / (time.perf_counter() - start_time)
+            assert video_path and abs(probe_duration(video_path) - SCENES * SCENE_SECONDS) < 0.2
+            
+            print(f"   {transition:<6} 帧生成 {render_fps:8.1f} fps   端到端编码 {encode_fps:6.1f} fps  ({width}x{height})")
+    
+    print("✅ 转场渲染速度测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_transition_frames() and test_transition_speed()
+    sys.exit(0 if success else 1)
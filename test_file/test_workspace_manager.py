@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+测试任务工作区 - 同名成语并发渲染互不覆盖、原子写出、按内容哈希版本化、遗留工作区回收
+"""
+import sys
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from background_renderer import BackgroundRenderer
+from database_manager import DatabaseManager
+from ffmpeg_video_composer import FFmpegVideoComposer, probe_duration
+from test_ffmpeg_video import create_test_images, create_test_track
+from workspace_manager import OWNER_FILE, WorkspaceManager, atomic_path, workspace_manager
+
+SCENES = 3
+AUDIO_SECONDS = 3
+JOBS = 3
+
+def test_concurrent_jobs():
+    """同名成语任务并发：输出文件原子替换不会损坏，同一故事并发重渲染最终只保留一个版本，不留临时文件"""
+    print("🧪 测试同名任务并发渲染...")
+    
+    track = create_test_track(AUDIO_SECONDS)
+    job_images = [[Image.new('RGB', (256, 256), (60 * i, 80 * k % 255, 120)) for k in range(SCENES)]
+                  for i in range(JOBS)]
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        composer = FFmpegVideoComposer(width=180, height=320, mode="single", segment_cache=False,
+                                       output_dir=os.path.join(temp_dir, "output"))
+        
+        # 多个任务写同一个默认输出路径：各自在工作区编码，完成后原子替换
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=JOBS) as executor:
+            paths = list(executor.map(lambda images: composer.create_video(images, track, "同名成语"), job_images))
+        elapsed = time.perf_counter() - start_time
+        assert all(paths) and len(set(paths)) == 1, paths
+        assert abs(probe_duration(paths[0]) - AUDIO_SECONDS) < 0.2
+        assert os.listdir(os.path.join(temp_dir, "output")) == ["同名成语_story.mp4"]
+        print(f"   {JOBS} 个任务并发写同一输出: {elapsed:.2f}秒")
+        
+        # 同一故事并发重渲染：后登记的任务替换先前的记录，存储中只留下最终版本
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        story_id = db.save_story("同名成语", "测试故事", ["场景"] * SCENES)
+        renderer = BackgroundRenderer(database=db, max_workers=JOBS, extra_renditions=[])
+        with ThreadPoolExecutor(max_workers=JOBS) as executor:
+            saved = list(executor.map(
+                lambda images: renderer.render_final(story_id, images, track, "同名成语", composer), job_images))
+        
+        final = db.get_video_renditions(story_id)['final']
+        assert final['status'] == 'ready' and final['path'] in saved, (final, saved)
+        assert os.listdir(os.path.join(temp_dir, "storage", "videos")) == [final['filename']]
+        assert abs(probe_duration(final['path']) - AUDIO_SECONDS) < 0.2
+        
+        assert workspace_manager.active_count == 0
+        leftovers = [path.name for path in Path(temp_dir).rglob(".*")]
+        assert not leftovers, leftovers
+        print(f"   同一故事并发重渲染 {JOBS} 次，保留版本: {final['filename']}")
+    
+    print("✅ 同名任务并发渲染测试通过")
+    return True
+
+def test_versioned_storage():
+    """相同内容复用同一文件；新内容写入新版本并删除旧版本"""
+    print("🧪 测试按内容哈希版本化...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = DatabaseManager(os.path.join(temp_dir, "test.db"), os.path.join(temp_dir, "storage"))
+        story_id = db.save_story("守株待兔", "测试故事", ["场景"] * SCENES)
+        videos_dir = Path(temp_dir) / "storage" / "videos"
+        
+        first = Path(temp_dir) / "first.mp4"
+        first.write_bytes(b"video-1" * 1000)
+        second = Path(temp_dir) / "second.mp4"
+        second.write_bytes(b"video-2" * 1000)
+        
+        path_a = db.save_video(story_id, str(first), "守株待兔")
+        assert db.save_video(story_id, str(first), "守株待兔") == path_a
+        assert Path(path_a).name.startswith("守株待兔_story.") and len(list(videos_dir.iterdir())) == 1
+        
+        path_b = db.save_video(story_id, str(second), "守株待兔")
+        assert path_b != path_a and not Path(path_a).exists()
+        assert sorted(p.name for p in videos_dir.iterdir()) == [Path(path_b).name]
+        assert db.get_story("守株待兔")['video']['path'] == path_b
+        
+        # 图片重新保存（数量减少）后旧文件全部清理
+        images = create_test_images(SCENES)
+        db.save_images(story_id, images, "守株待兔")
+        new_paths = db.save_images(story_id, images[:1] + [images[2].rotate(90)], "守株待兔")
+        assert sorted(p.name for p in (Path(temp_dir) / "storage" / "images").iterdir()) == \
+            sorted(Path(path).name for path in new_paths)
+        
+        # 音频存档同样按哈希命名，删除故事时一并删除
+        narration = create_test_track(1).export(Path(temp_dir) / "narration.wav", format="wav")
+        audio_path = db.save_audio(story_id, narration, "守株待兔")
+        assert Path(audio_path).exists() and Path(audio_path).name.startswith("守株待兔_01.")
+        assert db.delete_story("守株待兔")
+        assert not any((Path(temp_dir) / "storage").rglob("守株待兔*"))
+    
+    # 原子写出：异常时既不产生目标文件，也不留下临时文件
+    with tempfile.TemporaryDirectory() as temp_dir:
+        target = Path(temp_dir) / "result.mp4"
+        try:
+            with atomic_path(target) as temp_path:
+                temp_path.write_bytes(b"partial")
+                raise RuntimeError("编码中断")
+        except RuntimeError:
+            pass
+        assert not any(Path(temp_dir).iterdir())
+    
+    print("✅ 按内容哈希版本化测试通过")
+    return True
+
+def test_workspace_gc():
+    """属主进程已退出的工作区立即回收，存活进程的工作区保留到过期"""
+    print("🧪 测试工作区回收...")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = WorkspaceManager(root=temp_dir, max_age_hours=1, gc_interval=3600)
+        
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        orphan = Path(temp_dir) / "video_orphan"
+        orphan.mkdir()
+        (orphan / OWNER_FILE).write_text(str(dead.pid))
+        (orphan / "scene_000.png").write_bytes(b"x" * 1024)
+        
+        alive = Path(temp_dir) / "video_alive"
+        alive.mkdir()
+        (alive / OWNER_FILE).write_text(str(os.getppid()))
+        
+        result = manager.gc()
+        assert result['removed'] == 1 and not orphan.exists(), result
+        assert alive.exists()
+        
+        workspace = manager.create("video_当前任务")
+        workspace.file("output.mp4").write_bytes(b"x")
+        
+        # 过期后回收，进行中的工作区不受影响
+        result = manager.gc(max_age_hours=0)
+        assert not alive.exists() and workspace.path.exists(), result
+        
+        workspace.close()
+        assert not workspace.path.exists() and manager.active_count == 0
+    
+    print("✅ 工作区回收测试通过")
+    return True
+
+if __name__ == "__main__":
+    success = test_versioned_storage() and test_workspace_gc() and test_concurrent_jobs()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,242 @@
+"""
+转场渲染器 - NumPy向量化生成淡入淡出/滑动/缩放转场帧，直接写入ffmpeg标准输入
+
+每个场景只按输出分辨率预处理一次；静止帧直接复用场景数组，
+淡入淡出在预分配的缓冲区中做整数混合，滑动为数组切片拷贝，
+缩放（Ken Burns）使用预先计算的最近邻行列索引裁剪。
+"""
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+from loguru import logger
+
+from config import Config
+from ffmpeg_video_composer import FFmpegVideoComposer, fit_image, get_ffmpeg_binary, probe_duration, scene_durations
+from workspace_manager import atomic_move, workspace_manager
+
+TRANSITIONS = ("none", "fade", "slide", "zoom")
+
+class TransitionRenderer:
+    """转场帧生成器，iter_frames 产出的数组在下一次迭代前有效（缓冲区会被复用）"""
+    
+    def __init__(self, width: int, height: int, fps: int, transition_duration: float = 0.5,
+                 zoom_ratio: float = 1.15):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.transition_duration = transition_duration
+        self.zoom_ratio = zoom_ratio
+        
+        shape = (height, width, 3)
+        self._frame = np.empty(shape, dtype=np.uint8)
+        self._current = np.empty(shape, dtype=np.uint8)
+        self._next = np.empty(shape, dtype=np.uint8)
+        self._acc = np.empty(shape, dtype=np.uint16)
+        self._tmp = np.empty(shape, dtype=np.uint16)
+        self._rows = None
+    
+    def prepare(self, images: List, transition: str) -> List[np.ndarray]:
+        """按输出分辨率预处理每个场景（缩放转场额外放大 zoom_ratio 倍作为裁剪源）"""
+        if transition == "zoom":
+            width = round(self.width * self.zoom_ratio)
+            height = round(self.height * self.zoom_ratio)
+        else:
+            width, height = self.width, self.height
+        scenes = [np.asarray(fit_image(image, width, height)) for image in images]
+        if transition == "zoom":
+            self._rows = np.empty((self.height, width, 3), dtype=np.uint8)
+        return scenes
+    
+    def iter_frames(self, scenes: List[np.ndarray], frame_counts: Sequence[int],
+                    transition: str = "fade") -> Iterator[np.ndarray]:
+        """按帧产出画面；转场占用前一场景的最后若干帧，总帧数不变"""
+        if transition not in TRANSITIONS:
+            raise ValueError(f"未知的转场效果: {transition}")
+        transition_frames = round(self.transition_duration * self.fps) if transition != "none" else 0
+        
+        for index, (scene, count) in enumerate(zip(scenes, frame_counts)):
+            has_next = index + 1 < len(scenes)
+            blend_frames = min(transition_frames, count // 2) if has_next else 0
+            blend_start = count - blend_frames
+            
+            for position in range(count):
+                frame = self._scene_frame(scene, position, count, transition, self._current)
+                if position < blend_start:
+                    yield frame
+                    continue
+                
+                progress = (position - blend_start + 1) / (blend_frames + 1)
+                incoming = self._scene_frame(scenes[index + 1], 0, frame_counts[index + 1], transition, self._next)
+                if transition == "slide":
+                    yield self._slide(frame, incoming, progress)
+                else:
+                    yield self._fade(frame, incoming, progress)
+    
+    def _scene_frame(self, scene: np.ndarray, position: int, count: int, transition: str,
+                     buffer: np.ndarray) -> np.ndarray:
+        """场景在第 position 帧的画面：非缩放转场直接返回场景数组本身"""
+        if transition != "zoom":
+            return scene
+        
+        # 从整幅（缩小显示）逐渐放大到中心 1:1 区域
+        progress = position / max(1, count - 1)
+        scale = 1.0 + (self.zoom_ratio - 1.0) * progress
+        step = self.zoom_ratio / scale
+        source_height, source_width = scene.shape[:2]
+        top = (source_height - self.height * step) / 2
+        left = (source_width - self.width * step) / 2
+        rows = np.minimum((top + np.arange(self.height) * step).astype(np.intp), source_height - 1)
+        cols = np.minimum((left + np.arange(self.width) * step).astype(np.intp), source_width - 1)
+        
+        np.take(scene, rows, axis=0, out=self._rows)
+        np.take(self._rows, cols, axis=1, out=buffer)
+        return buffer
+    
+    def _fade(self, outgoing: np.ndarray, incoming: np.ndarray, progress: float) -> np.ndarray:
+        """整数交叉淡化：(a*(256-w) + b*w) >> 8，全部在预分配缓冲区中完成"""
+        weight = int(round(progress * 256))
+        np.multiply(outgoing, 256 - weight, out=self._acc, dtype=np.uint16)
+        np.multiply(incoming, weight, out=self._tmp, dtype=np.uint16)
+        np.add(self._acc, self._tmp, out=self._acc)
+        np.right_shift(self._acc, 8, out=self._acc)
+        np.copyto(self._frame, self._acc, casting='unsafe')
+        return self._frame
+    
+    def _slide(self, outgoing: np.ndarray, incoming: np.ndarray, progress: float) -> np.ndarray:
+        """新场景从右侧推入"""
+        offset = int(round(progress * self.width))
+        self._frame[:, :self.width - offset] = outgoing[:, offset:]
+        self._frame[:, self.width - offset:] = incoming[:, :offset]
+        return self._frame
+
+class SmoothVideoComposer(FFmpegVideoComposer):
+    """带转场效果的视频合成器，帧由 TransitionRenderer 生成并经管道写入ffmpeg"""
+    
+    # 标准输入用于传输视频帧，暂不支持流式输出
+    streaming_supported = False
+    
+    def __init__(self, transition: str = None, transition_duration: float = None, **kwargs):
+        super().__init__(**kwargs)
+        self.transition = transition or Config.VIDEO_TRANSITION
+        self.transition_duration = Config.VIDEO_TRANSITION_SECONDS if transition_duration is None else transition_duration
+    
+    def create_video(self, images: List, audio, idiom: str, durations: Optional[Sequence[float]] = None,
+                     output_path: Optional[str] = None, transition: Optional[str] = None,
+                     captions=None) -> Optional[str]:
+        output_path = output_path or self.output_dir / f"{idiom}_story.mp4"
+        return self.create_smooth_story_video(images, audio, output_path, transition or self.transition, durations,
+                                              captions)
+    
+    def create_renditions(self, images: List, audio, idiom: str, names: Sequence[str],
+                          durations: Optional[Sequence[float]] = None,
+                          output_dir: Optional[Path] = None) -> Dict[str, Optional[str]]:
+        """转场帧按单一画幅生成，多画幅时逐个画幅渲染"""
+        output_dir = Path(output_dir or self.output_dir)
+        paths = {}
+        for name in names:
+            width, height, bitrate, _ = self._rendition_spec(name)
+            composer = SmoothVideoComposer(transition=self.transition, transition_duration=self.transition_duration,
+                                           width=width, height=height, fps=self.fps, bitrate=bitrate,
+                                           preset=self.preset, output_dir=self.output_dir,
+                                           segment_cache=self.segment_cache or False,
+                                           captions=self.captions)
+            filename = f"{idiom}_story.mp4" if name == "final" else f"{idiom}_{name}.mp4"
+            paths[name] = composer.create_video(images, audio, idiom, durations, output_dir / filename)
+        return paths
+    
+    def create_smooth_story_video(self, images: List, audio, output_path: str, transition_type: str = "fade",
+                                  durations: Optional[Sequence[float]] = None, captions=None) -> Optional[str]:
+        """生成带转场的故事视频，audio 为音频文件路径或 AudioTrack"""
+        if not images:
+            logger.error("没有可用的图片")
+            return None
+        
+        workspace = workspace_manager.create("smooth_video")
+        work_dir = workspace.path
+        start_time = time.perf_counter()
+        try:
+            if hasattr(audio, 'to_wav_bytes'):
+                # 标准输入用于传输视频帧，音轨写为临时WAV
+                audio_path = work_dir / "narration.wav"
+                audio_path.write_bytes(audio.to_wav_bytes())
+                audio_duration = audio.duration
+            else:
+                audio_path = audio
+                audio_duration = probe_duration(audio)
+            
+            durations = list(durations) if durations else scene_durations(audio, len(images), audio_duration)
+            frame_counts = self._frame_counts(durations)
+            
+            renderer = TransitionRenderer(self.width, self.height, self.fps, self.transition_duration)
+            scenes = renderer.prepare(images, transition_type)
+            
+            args = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+                    "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{self.width}x{self.height}",
+                    "-r", str(self.fps), "-i", "pipe:0",
+                    "-i", str(audio_path), "-map", "0:v", "-map", "1:a"]
+            args += self._video_codec_args(tune=None if transition_type in ("slide", "zoom") else "stillimage")
+            encoded_path = work_dir / "output.mp4"
+            args += ["-c:a", "aac", "-b:a", "128k", "-shortest", "-movflags", "+faststart", str(encoded_path)]
+            
+            frames = renderer.iter_frames(scenes, frame_counts, transition_type)
+            cues = self._caption_cues(audio, captions)
+            if cues:
+                frames = self._captioned_frames(frames, scenes, cues)
+            
+            process = subprocess.Popen(args, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                for frame in frames:
+                    process.stdin.write(frame.data)
+            except BrokenPipeError:
+                pass
+            finally:
+                process.stdin.close()
+            stderr = process.stderr.read()
+            if process.wait() != 0:
+                raise RuntimeError(f"ffmpeg失败: {stderr.decode('utf-8', 'replace')[-500:]}")
+            atomic_move(encoded_path, output_path)
+            
+            logger.info(f"转场视频创建成功: {output_path}（{transition_type}，{time.perf_counter() - start_time:.2f}秒）")
+            return str(output_path)
+        
+        except Exception as e:
+            logger.error(f"创建转场视频失败: {e}")
+            workspace.close(failed=True)
+            return None
+        finally:
+            workspace.close()
+    
+    def _captioned_frames(self, frames: Iterator[np.ndarray], scenes: List[np.ndarray],
+                          cues: Sequence) -> Iterator[np.ndarray]:
+        """叠加字幕：静止画面只在场景或字幕变化时合成一次，转场帧直接在渲染缓冲区上合成字幕区域"""
+        from caption_renderer import CaptionRenderer
+        
+        captioner = CaptionRenderer(self.width, self.height)
+        static = {id(scene): index for index, scene in enumerate(scenes)}
+        buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        last_key = None
+        
+        for frame_index, frame in enumerate(frames):
+            cue_index = captioner.cue_index_at(cues, frame_index / self.fps)
+            if cue_index is None:
+                yield frame
+                continue
+            
+            overlay = captioner.overlay(cues[cue_index][2])
+            scene_index = static.get(id(frame))
+            if scene_index is None:
+                # 转场/缩放帧每帧不同，缓冲区属于渲染器，可原地合成
+                last_key = None
+                yield captioner.composite(frame, overlay, out=frame)
+                continue
+            
+            if (scene_index, cue_index) != last_key:
+                captioner.composite(frame, overlay, out=buffer)
+                last_key = (scene_index, cue_index)
+            yield buffer
+
+# 创建全局实例
+smooth_video_composer = SmoothVideoComposer()
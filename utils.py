@@ -2,57 +2,327 @@
 工具函数
 """
 import hashlib
-import pickle
+import io
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
 import logging
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import torch
 import GPUtil
 from loguru import logger
+from config import Config
+from image_backends import backend_tag
 
 class CacheManager:
-    """缓存管理器"""
+    """缓存管理器 - 内容寻址的产物缓存
+
+    缓存对象按类型序列化为blob（文本→UTF-8，图片→PNG/WebP，音频→原始PCM），
+    以SHA-256命名存放在 blobs/ 下，键到blob的映射保存在SQLite索引中。
+    总字节数超出预算时按最近访问时间(LRU)淘汰。
+    """
+    
+    def __init__(self, cache_dir: Path = Path("./cache"), max_bytes: int = 2 * 1024 ** 3,
+                 image_format: str = "PNG"):
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.image_format = image_format.upper()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.cache_dir / "index.db"), timeout=30, check_same_thread=False)
+        self._init_index()
     
-    def __init__(self, cache_dir: Path = Path("./cache")):
-        self.cache_dir = cache_dir
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
+    def _init_index(self):
+        """初始化缓存索引"""
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    blobs TEXT NOT NULL,
+                    meta TEXT,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    digest TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    refcount INTEGER NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_namespace ON entries(namespace)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_access ON entries(last_access)')
+            self._conn.commit()
     
     def get_cache_key(self, content: str, prefix: str = "") -> str:
-        """生成缓存键"""
-        hash_content = f"{prefix}_{content}"
-        return hashlib.md5(hash_content.encode()).hexdigest()
+        """生成缓存键，prefix 作为命名空间（如 "images/守株待兔"）"""
+        digest = hashlib.md5(content.encode()).hexdigest()
+        return f"{prefix}/{digest}" if prefix else digest
     
     def get_cached_result(self, key: str) -> Optional[Any]:
         """获取缓存结果"""
-        cache_file = self.cache_dir / f"{key}.pkl"
-        if cache_file.exists():
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT kind, blobs, meta FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            
+            kind, digests, meta = row[0], json.loads(row[1]), json.loads(row[2] or '{}')
             try:
-                with open(cache_file, 'rb') as f:
-                    return pickle.load(f)
+                payloads = [self._blob_path(digest).read_bytes() for digest in digests]
+                result = self._decode(kind, payloads, meta)
             except Exception as e:
                 logger.warning(f"读取缓存失败: {e}")
-        return None
+                self._delete_entries([key])
+                self._conn.commit()
+                self.stats['misses'] += 1
+                return None
+            
+            self._conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            self.stats['hits'] += 1
+            return result
     
     def save_cache(self, key: str, result: Any) -> bool:
         """保存缓存"""
         try:
-            cache_file = self.cache_dir / f"{key}.pkl"
-            with open(cache_file, 'wb') as f:
-                pickle.dump(result, f)
+            encoded = self._encode(result)
+            if encoded is None:
+                logger.warning(f"不支持缓存的对象类型: {type(result)}")
+                return False
+            kind, payloads, meta = encoded
+            
+            with self._lock:
+                self._delete_entries([key])
+                digests = [self._put_blob(payload) for payload in payloads]
+                namespace = key.rsplit('/', 1)[0] if '/' in key else ''
+                self._conn.execute('''
+                    INSERT INTO entries (key, namespace, kind, blobs, meta, size, last_access)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (key, namespace, kind, json.dumps(digests), json.dumps(meta),
+                      sum(len(payload) for payload in payloads), time.time()))
+                self._conn.commit()
+                self._evict()
             return True
         except Exception as e:
             logger.error(f"保存缓存失败: {e}")
             return False
     
     def clear_cache(self, prefix: str = ""):
-        """清理缓存"""
-        if prefix:
-            pattern = f"{prefix}_*.pkl"
-            for cache_file in self.cache_dir.glob(pattern):
-                cache_file.unlink()
+        """清理缓存，prefix 为命名空间时只清理该命名空间及其子命名空间"""
+        with self._lock:
+            if prefix:
+                rows = self._conn.execute(
+                    'SELECT key FROM entries WHERE namespace = ? OR substr(namespace, 1, ?) = ?',
+                    (prefix, len(prefix) + 1, prefix + '/')
+                ).fetchall()
+                self._delete_entries([row[0] for row in rows])
+                self._conn.commit()
+                logger.info(f"已清理缓存命名空间 {prefix}，共 {len(rows)} 项")
+            else:
+                self._conn.execute('DELETE FROM entries')
+                self._conn.execute('DELETE FROM blobs')
+                self._conn.commit()
+                shutil.rmtree(self.blob_dir, ignore_errors=True)
+                self.blob_dir.mkdir(parents=True, exist_ok=True)
+                # 旧版本遗留的pickle缓存
+                for cache_file in self.cache_dir.glob("*.pkl"):
+                    cache_file.unlink()
+                logger.info("缓存已全部清理")
+    
+    def clear_idiom(self, idiom: str, stages: tuple = ("story", "images", "audio")):
+        """清理某个成语在各阶段的缓存"""
+        for stage in stages:
+            self.clear_cache(f"{stage}/{idiom}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            entry_count = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        return {
+            **self.stats,
+            'entries': entry_count,
+            'total_bytes': total_bytes,
+            'max_bytes': self.max_bytes
+        }
+    
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+    
+    def _put_blob(self, payload: bytes) -> str:
+        """写入blob（已存在则只增加引用计数）"""
+        digest = hashlib.sha256(payload).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not blob_path.exists():
+            blob_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = blob_path.with_name(f"{digest}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(payload)
+            os.replace(tmp_path, blob_path)
+        self._conn.execute('''
+            INSERT INTO blobs (digest, size, refcount) VALUES (?, ?, 1)
+            ON CONFLICT(digest) DO UPDATE SET refcount = refcount + 1
+        ''', (digest, len(payload)))
+        return digest
+    
+    def _delete_entries(self, keys: List[str]):
+        """删除索引项并回收不再被引用的blob"""
+        released = set()
+        for key in keys:
+            row = self._conn.execute('SELECT blobs FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                continue
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            for digest in json.loads(row[0]):
+                self._conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE digest = ?', (digest,))
+                released.add(digest)
+        
+        for digest in released:
+            row = self._conn.execute('SELECT refcount FROM blobs WHERE digest = ?', (digest,)).fetchone()
+            if row is not None and row[0] <= 0:
+                self._conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+                self._blob_path(digest).unlink(missing_ok=True)
+    
+    def _evict(self):
+        """按LRU淘汰，直到总大小回到预算以内"""
+        total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        while total_bytes > self.max_bytes:
+            row = self._conn.execute('SELECT key FROM entries ORDER BY last_access LIMIT 1').fetchone()
+            if row is None:
+                break
+            self._delete_entries([row[0]])
+            self.stats['evictions'] += 1
+            total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        self._conn.commit()
+    
+    def _encode(self, result: Any) -> Optional[Tuple[str, List[bytes], Dict]]:
+        """按类型序列化缓存对象"""
+        if isinstance(result, str):
+            return "text", [result.encode('utf-8')], {}
+        if isinstance(result, bytes):
+            return "bytes", [result], {}
+        if _is_pil_image(result):
+            return "image", [self._encode_image(result)], {}
+        if isinstance(result, (list, tuple)) and result and all(_is_pil_image(item) for item in result):
+            return "images", [self._encode_image(item) for item in result], {}
+        if hasattr(result, 'samples') and hasattr(result, 'segment_lengths'):
+            # AudioTrack：保存PCM和段落长度
+            meta = {'sample_rate': result.sample_rate, 'segment_lengths': result.segment_lengths,
+                    'segment_texts': getattr(result, 'segment_texts', None)}
+            return "track", [result.samples.tobytes()], meta
+        if hasattr(result, 'raw_data') and hasattr(result, 'frame_rate'):
+            # pydub.AudioSegment：保存原始PCM，避免再次编解码
+            meta = {
+                'frame_rate': result.frame_rate,
+                'channels': result.channels,
+                'sample_width': result.sample_width
+            }
+            return "audio", [result.raw_data], meta
+        try:
+            return "json", [json.dumps(result, ensure_ascii=False).encode('utf-8')], {}
+        except (TypeError, ValueError):
+            return None
+    
+    def _decode(self, kind: str, payloads: List[bytes], meta: Dict) -> Any:
+        """反序列化缓存对象"""
+        if kind == "text":
+            return payloads[0].decode('utf-8')
+        if kind == "bytes":
+            return payloads[0]
+        if kind == "image":
+            return self._decode_image(payloads[0])
+        if kind == "images":
+            return [self._decode_image(payload) for payload in payloads]
+        if kind == "audio":
+            from pydub import AudioSegment
+            return AudioSegment(data=payloads[0], sample_width=meta['sample_width'],
+                                frame_rate=meta['frame_rate'], channels=meta['channels'])
+        if kind == "track":
+            import numpy as np
+            from fixed_audio_generator import AudioTrack
+            return AudioTrack(np.frombuffer(payloads[0], dtype=np.int16), meta['sample_rate'],
+                              meta['segment_lengths'], meta.get('segment_texts'))
+        if kind == "json":
+            return json.loads(payloads[0].decode('utf-8'))
+        raise ValueError(f"未知的缓存类型: {kind}")
+    
+    def _encode_image(self, image) -> bytes:
+        buffer = io.BytesIO()
+        if self.image_format == "WEBP":
+            image.save(buffer, format="WEBP", lossless=True)
         else:
-            for cache_file in self.cache_dir.glob("*.pkl"):
-                cache_file.unlink()
+            image.save(buffer, format="PNG")
+        return buffer.getvalue()
+    
+    @staticmethod
+    def _decode_image(payload: bytes):
+        from PIL import Image
+        image = Image.open(io.BytesIO(payload))
+        image.load()
+        return image
+
+def _is_pil_image(obj: Any) -> bool:
+    """判断是否为PIL图片（不强制导入PIL）"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    return isinstance(obj, Image.Image)
+
+class StageFingerprint:
+    """阶段缓存指纹 - 由阶段的全部输入参数派生缓存键"""
+    
+    @staticmethod
+    def compute(stage: str, **params) -> str:
+        """计算阶段指纹，参数顺序无关"""
+        payload = json.dumps({'stage': stage, **params}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def image_params(image_generator: Any = None) -> Dict[str, Any]:
+        """图像生成参数：模型、调度器、步数、引导强度、种子、分辨率（非PyTorch后端另加推理后端）"""
+        scheduler = getattr(image_generator, 'scheduler_name', None)
+        if scheduler is None:
+            pipe_scheduler = getattr(getattr(image_generator, 'pipe', None), 'scheduler', None)
+            scheduler = type(pipe_scheduler).__name__ if pipe_scheduler is not None else Config.SD_SCHEDULER
+        params = {
+            'model': Config.SD_MODEL_PATH,
+            'revision': Config.SD_MODEL_REVISION,
+            'scheduler': scheduler,
+            'steps': Config.INFERENCE_STEPS,
+            'guidance': Config.GUIDANCE_SCALE,
+            'seed': Config.IMAGE_SEED,
+            'width': Config.IMAGE_WIDTH,
+            'height': Config.IMAGE_HEIGHT
+        }
+        backend = backend_tag(getattr(image_generator, 'backend', None))
+        if backend != 'pytorch':
+            # ONNX/OpenVINO（及int8量化）的输出与 PyTorch 存在数值差异，分开缓存
+            params['backend'] = backend
+        return params
+    
+    @staticmethod
+    def tts_params(audio_generator: Any) -> Dict[str, Any]:
+        """语音合成参数：引擎、音色、语速"""
+        return {
+            'engine': getattr(audio_generator, 'tts_engine', type(audio_generator).__name__),
+            'voice': getattr(audio_generator, 'lang', getattr(audio_generator, 'narration_voice', None)),
+            'rate': getattr(audio_generator, 'slow', None),
+            'sample_rate': getattr(audio_generator, 'sample_rate', None),
+            'segment_chars': getattr(audio_generator, 'segment_chars', None)
+        }
 
 class PerformanceMonitor:
     """性能监控器"""
@@ -92,6 +362,20 @@ class PerformanceMonitor:
             logger.warning(f"获取内存信息失败: {e}")
         return None
     
+    @staticmethod
+    def get_free_memory_mb(device: str = "cuda") -> Optional[float]:
+        """推理设备的可用内存（MB）：cuda 为空闲显存，cpu 为可用内存；无法获取时返回None"""
+        if device.startswith("cuda"):
+            gpu_info = PerformanceMonitor.get_gpu_info()
+            if gpu_info:
+                return float(gpu_info['memory_free'])
+            if torch.cuda.is_available():
+                free, _ = torch.cuda.mem_get_info()
+                return free / 1024 / 1024
+            return None
+        memory_info = PerformanceMonitor.get_memory_info()
+        return memory_info['available'] / 1024 / 1024 if memory_info else None
+    
     @staticmethod
     def cleanup_gpu_memory():
         """清理GPU内存"""
@@ -199,7 +483,7 @@ class Logger:
         return logger
 
 # 初始化工具
-cache_manager = CacheManager()
+cache_manager = CacheManager(Config.CACHE_DIR, Config.CACHE_MAX_BYTES, Config.CACHE_IMAGE_FORMAT)
 performance_monitor = PerformanceMonitor()
 text_processor = TextProcessor()
 file_manager = FileManager()
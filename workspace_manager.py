@@ -0,0 +1,223 @@
+"""
+任务工作区管理 - 每个任务独立的临时目录、原子写出、按内容哈希版本化的产物
+
+并发任务各自在 Config.WORKSPACE_DIR 下获得唯一目录，中间文件（临时音频、帧图、分片）互不覆盖；
+产物先写入目标目录下的唯一临时文件再 os.replace，读者不会看到写了一半的文件；
+存档产物命名为 {名称}.{内容哈希}{后缀}，同一内容只保存一份，旧版本在不再被引用时删除。
+工作区结束即删除；进程异常退出遗留的工作区由 gc 按属主进程是否存活及存活时间回收。
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+from loguru import logger
+
+from config import Config
+
+OWNER_FILE = ".owner"
+FAILED_FILE = ".failed"
+DIGEST_LENGTH = 12
+
+PathLike = Union[str, Path]
+
+def file_digest(path: PathLike, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def versioned_name(stem: str, digest: str, suffix: str) -> str:
+    return f"{stem}.{digest[:DIGEST_LENGTH]}{suffix}"
+
+@contextmanager
+def atomic_path(dest: PathLike) -> Iterator[Path]:
+    """给出与目标同目录、同后缀的唯一临时路径；正常退出时原子替换为目标文件，异常时删除"""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(prefix=f".{dest.stem}.", suffix=dest.suffix, dir=dest.parent)
+    os.close(fd)
+    temp_path = Path(temp_name)
+    try:
+        yield temp_path
+        os.replace(temp_path, dest)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+def atomic_copy(src: PathLike, dest: PathLike) -> Path:
+    with atomic_path(dest) as temp_path:
+        shutil.copyfile(src, temp_path)
+    return Path(dest)
+
+def atomic_move(src: PathLike, dest: PathLike) -> Path:
+    """同一文件系统直接 os.replace，跨文件系统时复制后替换"""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(src, dest)
+    except OSError:
+        atomic_copy(src, dest)
+        Path(src).unlink(missing_ok=True)
+    return dest
+
+def publish(src: PathLike, directory: PathLike, stem: str, suffix: Optional[str] = None) -> Path:
+    """按内容哈希发布文件到 directory/{stem}.{哈希}{后缀}，内容相同时复用已有文件"""
+    src = Path(src)
+    dest = Path(directory) / versioned_name(stem, file_digest(src), suffix or src.suffix)
+    if dest.exists() and dest.stat().st_size == src.stat().st_size:
+        return dest
+    return atomic_copy(src, dest)
+
+def publish_bytes(data: bytes, directory: PathLike, stem: str, suffix: str) -> Path:
+    dest = Path(directory) / versioned_name(stem, hashlib.sha256(data).hexdigest(), suffix)
+    if dest.exists() and dest.stat().st_size == len(data):
+        return dest
+    with atomic_path(dest) as temp_path:
+        temp_path.write_bytes(data)
+    return dest
+
+def prune_versions(directory: PathLike, stem: str, suffix: str, keep: Iterable[PathLike]) -> int:
+    """删除同一产物中不在 keep 里的其他哈希版本，返回删除的文件数"""
+    pattern = re.compile(rf"{re.escape(stem)}\.[0-9a-f]{{{DIGEST_LENGTH}}}{re.escape(suffix)}")
+    keep = {Path(path).resolve() for path in keep}
+    removed = 0
+    for path in Path(directory).glob(f"{stem}.*{suffix}"):
+        if pattern.fullmatch(path.name) and path.resolve() not in keep:
+            try:
+                path.unlink()
+                removed += 1
+            except OSError as e:
+                logger.warning(f"删除旧版本失败 {path}: {e}")
+    return removed
+
+class Workspace:
+    """单个任务的临时工作区，close() 后删除（WORKSPACE_KEEP_FAILED 时保留失败现场）"""
+    
+    def __init__(self, path: Path, manager: "WorkspaceManager"):
+        self.path = path
+        self._manager = manager
+        self.closed = False
+    
+    def file(self, name: str) -> Path:
+        return self.path / name
+    
+    def subdir(self, name: str) -> Path:
+        path = self.path / name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+    
+    def close(self, failed: bool = False):
+        """结束工作区，重复调用无副作用"""
+        if self.closed:
+            return
+        self.closed = True
+        self._manager._release(self)
+        if failed and Config.WORKSPACE_KEEP_FAILED:
+            (self.path / FAILED_FILE).touch()
+            logger.warning(f"保留失败任务的工作区: {self.path}")
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
+    
+    def __enter__(self) -> "Workspace":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close(failed=exc_type is not None)
+
+class WorkspaceManager:
+    """工作区管理器：创建唯一工作区，并定期回收属主进程已退出或过期的工作区"""
+    
+    def __init__(self, root: Optional[PathLike] = None, max_age_hours: Optional[float] = None,
+                 gc_interval: Optional[float] = None):
+        self.root = Path(root or Config.WORKSPACE_DIR)
+        self.max_age_hours = Config.WORKSPACE_MAX_AGE_HOURS if max_age_hours is None else max_age_hours
+        self.gc_interval = Config.WORKSPACE_GC_INTERVAL if gc_interval is None else gc_interval
+        self._active: Dict[Path, Workspace] = {}
+        self._lock = threading.Lock()
+        self._last_gc = 0.0
+    
+    def create(self, job: str) -> Workspace:
+        """为任务创建唯一的工作区目录，目录名以任务名开头便于排查"""
+        self._maybe_gc()
+        self.root.mkdir(parents=True, exist_ok=True)
+        prefix = re.sub(r'[\\/:*?"<>|\s]+', "_", job)[:40] + "_"
+        path = Path(tempfile.mkdtemp(prefix=prefix, dir=self.root))
+        (path / OWNER_FILE).write_text(str(os.getpid()))
+        
+        workspace = Workspace(path, self)
+        with self._lock:
+            self._active[path] = workspace
+        return workspace
+    
+    def _release(self, workspace: Workspace):
+        with self._lock:
+            self._active.pop(workspace.path, None)
+    
+    @property
+    def active_count(self) -> int:
+        with self._lock:
+            return len(self._active)
+    
+    def gc(self, max_age_hours: Optional[float] = None) -> Dict[str, int]:
+        """回收工作区：属主进程已退出的立即删除，其余（含保留的失败现场）超过最长存活时间后删除"""
+        max_age = (self.max_age_hours if max_age_hours is None else max_age_hours) * 3600
+        now = time.time()
+        removed, freed = 0, 0
+        if not self.root.exists():
+            return {'removed': 0, 'bytes': 0}
+        
+        with self._lock:
+            active = set(self._active)
+        
+        for path in self.root.iterdir():
+            if not path.is_dir() or path in active:
+                continue
+            try:
+                age = now - path.stat().st_mtime
+                owner = self._owner(path)
+                if (path / FAILED_FILE).exists() or owner is None or owner == os.getpid():
+                    expired = age > max_age
+                else:
+                    # 属主进程已退出：任务不可能再完成，立即回收
+                    expired = age > max_age or not self._pid_alive(owner)
+                if not expired:
+                    continue
+                freed += sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"回收工作区失败 {path}: {e}")
+        
+        self._last_gc = now
+        if removed:
+            logger.info(f"已回收 {removed} 个工作区，释放 {freed / 1024 / 1024:.1f}MB")
+        return {'removed': removed, 'bytes': freed}
+    
+    def _maybe_gc(self):
+        if time.time() - self._last_gc >= self.gc_interval:
+            try:
+                self.gc()
+            except Exception as e:
+                logger.warning(f"工作区回收失败: {e}")
+    
+    @staticmethod
+    def _owner(path: Path) -> Optional[int]:
+        try:
+            return int((path / OWNER_FILE).read_text().strip())
+        except (OSError, ValueError):
+            return None
+    
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        import psutil
+        return psutil.pid_exists(pid)
+
+# 创建全局实例
+workspace_manager = WorkspaceManager()